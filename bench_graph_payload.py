@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Size/latency comparison for graph payloads
+Builds a synthetic /graph payload (entities with descriptions, relations
+with keywords) and times FastAPI's default JSON path against the API's
+encoder (orjson when installed), then gzip and brotli. With --url it also
+times a full GET against a running API and the 304 revalidation:
+
+    python bench_graph_payload.py --nodes 20000 --edges 60000
+    python bench_graph_payload.py --url "http://localhost:8000/graph?limit=100000"
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lightrag_api"))
+import json_responses  # noqa: E402
+
+WORDS = "revenue margin coffee supply contract default credit export farm price risk loan harvest bank rating".split()
+
+
+def synthetic_graph(nodes: int, edges: int):
+    rng = random.Random(42)
+    names = [f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}" for i in range(nodes)]
+    return {
+        "nodes": [
+            {"id": name, "name": name, "description": " ".join(rng.choices(WORDS, k=rng.randint(10, 40))), "type": rng.choice(["organization", "person", "event"])}
+            for name in names
+        ],
+        "edges": [
+            {"from": rng.choice(names), "to": rng.choice(names), "relation": ",".join(rng.choices(WORDS, k=3)), "description": " ".join(rng.choices(WORDS, k=rng.randint(8, 25)))}
+            for _ in range(edges)
+        ],
+        "node_count": nodes,
+        "edge_count": edges,
+    }
+
+
+def timed(func, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def offline(args):
+    import json
+
+    payload = synthetic_graph(args.nodes, args.edges)
+    rows = []
+    # What FastAPI does for a returned dict
+    body, ms = timed(lambda: json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8"), args.repeat)
+    rows.append(("fastapi default (jsonable_encoder + json)", len(body), ms))
+    raw, ms = timed(lambda: json_responses.dumps(payload), args.repeat)
+    rows.append((f"{'orjson' if json_responses.orjson is not None else 'json'} (uncompressed)", len(raw), ms))
+    encodings = ["gzip"] + (["br"] if json_responses.brotli is not None else [])
+    for encoding in encodings:
+        compressed, compress_ms = timed(lambda: json_responses.compress(raw, encoding), args.repeat)
+        rows.append((f"  + {encoding}", len(compressed), ms + compress_ms))
+    print(f"Synthetic graph: {args.nodes} nodes, {args.edges} edges (best of {args.repeat})")
+    print(f"{'encoding':45} {'bytes':>12} {'ms':>9}")
+    for name, size, elapsed in rows:
+        print(f"{name:45} {size:>12,} {elapsed:>9.1f}")
+    if json_responses.brotli is None:
+        print("(brotli not installed: pip install brotli)")
+
+
+def live(args):
+    with httpx.Client(timeout=300) as client:
+        for encoding in ["identity", "gzip", "br"]:
+            start = time.perf_counter()
+            response = client.get(args.url, headers={"Accept-Encoding": encoding})
+            full_ms = (time.perf_counter() - start) * 1000
+            if response.status_code != 200:
+                print(f"{encoding}: HTTP {response.status_code}")
+                continue
+            wire = response.num_bytes_downloaded
+            etag = response.headers.get("etag")
+            line = f"{encoding:9} {wire:>12,} bytes {full_ms:>9.1f} ms ({response.headers.get('content-encoding', 'identity')})"
+            if etag:
+                start = time.perf_counter()
+                revalidated = client.get(args.url, headers={"Accept-Encoding": encoding, "If-None-Match": etag})
+                line += f" | If-None-Match: HTTP {revalidated.status_code} in {(time.perf_counter() - start) * 1000:.1f} ms"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--edges", type=int, default=60000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--url", help="Time a running API endpoint instead of the synthetic payload")
+    args = parser.parse_args()
+    live(args) if args.url else offline(args)
+
+
+if __name__ == "__main__":
+    main()
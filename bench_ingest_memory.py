@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Server memory for a large upload: /ingest (JSON body) vs /ingest/stream
+Generates a synthetic paged document of --mb megabytes, posts it to both
+endpoints of a running API and reports the server's peak RSS for each.
+With --pid (server on this machine) the kernel's high-water mark (VmHWM)
+is reset before each request and read after it; otherwise only the
+streaming endpoint's own "upload" report is available:
+
+    python bench_ingest_memory.py --url http://localhost:8000 --pid $(pgrep -f "uvicorn main:app") --mb 100
+
+Post the document once before measuring (--prime) so both runs see only
+unchanged sections: what is then measured is the upload, parsing and
+section diff, which is what the two endpoints do differently. Extraction
+of new sections costs the same either way.
+"""
+
+import argparse
+import json
+import random
+import time
+
+import httpx
+
+WORDS = "revenue margin coffee supply contract default credit export farm price risk loan harvest bank rating".split()
+PAGE_CHARS = 3000
+
+
+def synthetic_pages(megabytes: float):
+    """Yield `--- Page N ---` pages until the document reaches the requested size"""
+    rng = random.Random(7)
+    total, page = 0, 0
+    while total < megabytes * 1e6:
+        page += 1
+        text = f"\n--- Page {page} ---\n" + " ".join(rng.choices(WORDS, k=PAGE_CHARS // 6)) + f" page {page}\n"
+        total += len(text)
+        yield text
+
+
+def read_hwm(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def reset_hwm(pid: int):
+    # Writing 5 to clear_refs resets the peak RSS counter to the current RSS
+    with open(f"/proc/{pid}/clear_refs", "w") as f:
+        f.write("5")
+
+
+def measure(args, name: str, send):
+    if args.pid:
+        reset_hwm(args.pid)
+    start = time.perf_counter()
+    response = send()
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        print(f"{name}: HTTP {response.status_code} {response.text[:200]}")
+        return
+    body = response.json()
+    peak = f"{read_hwm(args.pid) / 1e6:,.0f} MB" if args.pid else f"{body.get('upload', {}).get('peak_rss_mb', '?')} MB (self-reported)"
+    sections = body["sections"]
+    print(f"{name:16} {elapsed:>8.1f} s   peak RSS {peak:>22}   sections {sections['sections_total']} ({sections['sections_inserted']} inserted)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--pid", type=int, help="Server process id (read its VmHWM from /proc)")
+    parser.add_argument("--mb", type=float, default=100)
+    parser.add_argument("--doc-id", default="bench_large_doc")
+    parser.add_argument("--prime", action="store_true", help="Ingest the document once (streamed) before measuring")
+    args = parser.parse_args()
+
+    with httpx.Client(base_url=args.url, timeout=None) as client:
+        def stream():
+            body = (page.encode("utf-8") for page in synthetic_pages(args.mb))
+            return client.post("/ingest/stream", params={"doc_id": args.doc_id}, content=body, headers={"Content-Type": "text/plain"})
+
+        def whole():
+            text = "".join(synthetic_pages(args.mb))
+            return client.post("/ingest", content=json.dumps({"text": text, "doc_id": args.doc_id}), headers={"Content-Type": "application/json"})
+
+        if args.prime:
+            measure(args, "prime (stream)", stream)
+        # Streamed first: memory freed after the JSON request is not always returned to the OS
+        measure(args, "/ingest/stream", stream)
+        measure(args, "/ingest", whole)
+
+
+if __name__ == "__main__":
+    main()
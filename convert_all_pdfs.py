@@ -4,10 +4,15 @@ Batch convert all GAFTA PDF files to text
 Handles multiple contract PDFs and the defaulters list
 """
 
+import csv
 import os
 import sys
 from pathlib import Path
 
+# Shared defaulters parser (standard library only) lives with the API code
+sys.path.insert(0, str(Path(__file__).resolve().parent / "lightrag_api"))
+from defaulters import parse_defaulters_text
+
 # Import the conversion function from convert_pdf_to_text
 try:
     import PyPDF2
@@ -73,6 +78,17 @@ def convert_pdf(pdf_path, output_path):
         return False, str(e)
 
 
+def write_defaulters_table(text_path, csv_path):
+    """Parse the converted defaulters list into a company/country/award/date CSV"""
+    with open(text_path, 'r', encoding='utf-8') as f:
+        rows = parse_defaulters_text(f.read())
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["company", "country", "award_number", "date"])
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+
 def main():
     print("=== GAFTA PDF Batch Converter ===\n")
     
@@ -130,7 +146,10 @@ def main():
         print(f"Converting: {defaulters_pdf.name} -> {output_path.name}")
         success, message = convert_pdf(str(defaulters_pdf), str(output_path))
         if success:
-            print(f"  ✓ Success: {message}\n")
+            print(f"  ✓ Success: {message}")
+            table_path = Path("demo_files/defaulters_list.csv")
+            row_count = write_defaulters_table(str(output_path), str(table_path))
+            print(f"  ✓ Parsed {row_count} defaulter rows -> {table_path.name}\n")
             success_count += 1
         else:
             print(f"  ✗ Failed: {message}\n")
@@ -145,7 +164,7 @@ def main():
     print(f"Failed conversions: {failed_count}")
     print(f"\nConverted contract files: {contracts_dir}")
     if defaulters_pdf:
-        print(f"Defaulters list: demo_files/defaulters_list.txt")
+        print(f"Defaulters list: demo_files/defaulters_list.txt (table: demo_files/defaulters_list.csv)")
     
     if failed_count == 0:
         print("\n✓ All conversions successful!")
@@ -0,0 +1,361 @@
+"""
+Load balancing across multiple inference hosts
+Every *_HOST setting accepts a comma-separated list of URLs. Requests go to
+the healthy host with the fewest outstanding requests (or the lowest
+latency-weighted load). Hosts are ejected after consecutive failures
+(passive tracking) and re-admitted by a background probe.
+
+Each pool also has a circuit breaker: once every host is ejected, or
+requests keep failing on all hosts, calls fail fast with
+BackendUnavailableError instead of waiting out connection timeouts. After
+BREAKER_RESET_SECONDS (or a successful probe) one trial request is let
+through (half-open) and its outcome closes or re-opens the breaker.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+# "least_outstanding" or "latency" (outstanding requests weighted by EWMA latency)
+BACKEND_BALANCING = os.getenv("BACKEND_BALANCING", "least_outstanding").lower()
+BACKEND_EJECT_FAILURES = int(os.getenv("BACKEND_EJECT_FAILURES", "3"))
+BACKEND_EJECT_SECONDS = float(os.getenv("BACKEND_EJECT_SECONDS", "30"))
+BACKEND_PROBE_INTERVAL = float(os.getenv("BACKEND_PROBE_INTERVAL", "15"))
+BACKEND_PROBE_TIMEOUT = float(os.getenv("BACKEND_PROBE_TIMEOUT", "5"))
+# Connect timeout for inference requests (read timeouts stay long for slow generations)
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "5"))
+# Consecutive requests failing on every host before the breaker opens
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+# Smoothing factor of the per-host latency moving average
+_EWMA_ALPHA = 0.2
+# Ejection time doubles on repeated ejections up to this multiple
+_MAX_EJECT_MULTIPLIER = 8
+
+
+class BackendUnavailableError(Exception):
+    """Raised without contacting any host while a pool's circuit breaker is open"""
+
+
+def parse_hosts(value: str) -> List[str]:
+    """Split a comma-separated host setting into URLs (without trailing slashes)"""
+    return [host.strip().rstrip("/") for host in value.split(",") if host.strip()]
+
+
+def _is_backend_failure(error: Exception) -> bool:
+    """Connection errors, timeouts and 5xx count against a host; 4xx are request errors"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return True
+
+
+class Backend:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.ewma_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_probe: Optional[float] = None
+        self.last_probe_ok: Optional[bool] = None
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def load(self) -> float:
+        if BACKEND_BALANCING == "latency":
+            return (self.outstanding + 1) * (self.ewma_ms or 1.0)
+        return self.outstanding + (self.ewma_ms or 0.0) * 1e-9  # latency only breaks ties
+
+    def record_success(self, elapsed_ms: float):
+        self.consecutive_failures = 0
+        self.ewma_ms = elapsed_ms if self.ewma_ms is None else (1 - _EWMA_ALPHA) * self.ewma_ms + _EWMA_ALPHA * elapsed_ms
+
+    def record_failure(self, error: str):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.consecutive_failures >= BACKEND_EJECT_FAILURES and self.healthy:
+            self.eject()
+
+    def eject(self):
+        multiplier = min(2 ** self.ejections, _MAX_EJECT_MULTIPLIER)
+        self.ejections += 1
+        self.ejected_until = time.monotonic() + BACKEND_EJECT_SECONDS * multiplier
+        print(f"Warning: Backend {self.url} ejected for {BACKEND_EJECT_SECONDS * multiplier:.0f}s ({self.last_error})")
+
+    def readmit(self):
+        if not self.healthy:
+            print(f"✓ Backend {self.url} re-admitted")
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.consecutive_failures = 0
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "ewma_ms": round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            "last_error": self.last_error,
+            "last_probe_ok": self.last_probe_ok,
+            "last_probe_age_s": round(time.time() - self.last_probe, 1) if self.last_probe else None,
+        }
+
+
+class CircuitBreaker:
+    """closed -> open -> half_open -> closed/open, with transition counters"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.open_reason: Optional[str] = None
+        self._trial_in_flight = False
+        self.rejected = 0
+        self.transitions: Dict[str, int] = {}
+        self.history = deque(maxlen=20)
+
+    def _transition(self, state: str, reason: str):
+        if state == self.state:
+            return
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        self.history.append({"ts": time.time(), "from": self.state, "to": state, "reason": reason})
+        print(f"{'✓' if state == 'closed' else 'Warning:'} Circuit breaker {self.name}: {key} ({reason})")
+        self.state = state
+        if state == "open":
+            self.opened_at = time.monotonic()
+            self.open_reason = reason
+        self._trial_in_flight = False
+
+    def _reject(self):
+        self.rejected += 1
+        retry_in = max(0.0, BREAKER_RESET_SECONDS - (time.monotonic() - self.opened_at))
+        raise BackendUnavailableError(
+            f"Inference backend {self.name} is unavailable ({self.open_reason}); "
+            f"circuit breaker open, retrying in {retry_in:.0f}s"
+        )
+
+    def check(self):
+        """Raise BackendUnavailableError if open and not yet due for a trial (does not change state)"""
+        if self.state == "open" and time.monotonic() - self.opened_at < BREAKER_RESET_SECONDS:
+            self._reject()
+
+    def before_request(self) -> bool:
+        """Raise BackendUnavailableError if open; returns True if this request is the half-open trial"""
+        if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_RESET_SECONDS:
+            self._transition("half_open", "reset timeout elapsed")
+        if self.state == "open" or (self.state == "half_open" and self._trial_in_flight):
+            self._reject()
+        if self.state == "half_open":
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        if self.state != "closed":
+            self._transition("closed", "request succeeded")
+
+    def record_failure(self, reason: str):
+        self.consecutive_failures += 1
+        if self.state == "half_open":
+            self._transition("open", f"trial request failed: {reason}")
+        elif self.consecutive_failures >= BREAKER_FAILURES:
+            self._transition("open", f"{self.consecutive_failures} consecutive failures: {reason}")
+
+    def end_trial(self):
+        # A cancelled trial must not leave the breaker stuck in half_open
+        self._trial_in_flight = False
+
+    def trip(self, reason: str):
+        if self.state != "open":
+            self._transition("open", reason)
+
+    def probe_recovered(self):
+        if self.state == "open":
+            self._transition("half_open", "probe succeeded")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "open_reason": self.open_reason if self.state != "closed" else None,
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions),
+            "history": list(self.history),
+        }
+
+
+class BackendPool:
+    """A set of interchangeable hosts for one binding"""
+
+    def __init__(self, name: str, urls: List[str], probe: Optional[Callable[[httpx.AsyncClient, str], Awaitable[bool]]] = None):
+        if not urls:
+            raise ValueError(f"Backend pool {name} has no hosts")
+        self.name = name
+        self.backends = [Backend(url) for url in urls]
+        self.probe = probe
+        self.breaker = CircuitBreaker(name)
+
+    @property
+    def primary(self) -> str:
+        return self.backends[0].url
+
+    @property
+    def available(self) -> bool:
+        return self.breaker.state != "open" and any(b.healthy for b in self.backends)
+
+    def ensure_available(self):
+        """Fail fast before starting long-running work (e.g. ingestion) on a dead backend"""
+        self.breaker.check()
+
+    def _pick(self, exclude: List[Backend], trial: bool) -> Optional[Backend]:
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+        healthy = [b for b in candidates if b.healthy]
+        if healthy:
+            return min(healthy, key=lambda b: b.load())
+        if trial:
+            # Half-open trial: try the host that is due back first
+            return min(candidates, key=lambda b: b.ejected_until)
+        return None
+
+    async def run(self, request: Callable[[str], Awaitable[Any]]) -> Any:
+        """
+        Call request(host_url) on the least-loaded healthy host
+
+        Host failures (connection errors, timeouts, 5xx) are recorded and the
+        request is retried once on each other healthy host; the last error is
+        raised. Raises BackendUnavailableError while the breaker is open.
+        """
+        trial = self.breaker.before_request()
+        try:
+            return await self._run(request, trial)
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    async def _run(self, request: Callable[[str], Awaitable[Any]], trial: bool) -> Any:
+        tried: List[Backend] = []
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self._pick(tried, trial)
+            if backend is None:
+                if last_error is None:
+                    self.breaker.trip("all hosts ejected")
+                    raise BackendUnavailableError(f"Inference backend {self.name} is unavailable: all hosts ejected")
+                self.breaker.record_failure(f"{type(last_error).__name__}: {last_error}")
+                if not any(b.healthy for b in self.backends):
+                    self.breaker.trip("all hosts ejected")
+                raise last_error
+            tried.append(backend)
+            backend.outstanding += 1
+            backend.requests += 1
+            start = time.perf_counter()
+            try:
+                result = await request(backend.url)
+                backend.record_success((time.perf_counter() - start) * 1000)
+                if not backend.healthy:
+                    backend.readmit()
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                if not _is_backend_failure(e):
+                    if trial:
+                        # The host answered, so it is reachable
+                        self.breaker.record_success()
+                    raise
+                backend.record_failure(f"{type(e).__name__}: {e}")
+                last_error = e
+            finally:
+                backend.outstanding -= 1
+
+    async def probe_all(self, client: httpx.AsyncClient):
+        if self.probe is None:
+            return
+        for backend in self.backends:
+            try:
+                ok = await self.probe(client, backend.url)
+                error = None if ok else "probe returned unhealthy"
+            except Exception as e:
+                ok, error = False, f"{type(e).__name__}: {e}"
+            backend.last_probe = time.time()
+            backend.last_probe_ok = ok
+            if ok:
+                backend.readmit()
+            else:
+                backend.last_error = error
+                if backend.healthy:
+                    backend.eject()
+        if any(b.healthy for b in self.backends):
+            self.breaker.probe_recovered()
+        else:
+            self.breaker.trip("all hosts failed health probes")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "balancing": BACKEND_BALANCING,
+            "healthy": sum(b.healthy for b in self.backends),
+            "breaker": self.breaker.describe(),
+            "hosts": [b.describe() for b in self.backends],
+        }
+
+
+class BackendRegistry:
+    """Shares one pool per (binding, host list) and runs the background probes"""
+
+    def __init__(self):
+        self.pools: Dict[str, BackendPool] = {}
+        self._probe_task: Optional[asyncio.Task] = None
+        self.last_probe: Optional[float] = None
+
+    def get(self, binding: str, hosts: List[str], probe: Optional[Callable] = None) -> BackendPool:
+        name = f"{binding}:{','.join(hosts)}"
+        if name not in self.pools:
+            self.pools[name] = BackendPool(name, hosts, probe)
+        return self.pools[name]
+
+    async def probe_once(self):
+        async with httpx.AsyncClient(timeout=BACKEND_PROBE_TIMEOUT) as client:
+            await asyncio.gather(*(pool.probe_all(client) for pool in self.pools.values()))
+        self.last_probe = time.time()
+
+    async def _probe_loop(self):
+        while True:
+            try:
+                await self.probe_once()
+            except Exception as e:
+                print(f"Warning: Backend probe failed: {e}")
+            await asyncio.sleep(BACKEND_PROBE_INTERVAL)
+
+    def start(self):
+        if self._probe_task is None and BACKEND_PROBE_INTERVAL > 0:
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {name: pool.describe() for name, pool in self.pools.items()}
@@ -0,0 +1,192 @@
+"""
+Shared retrieval for batches of questions (/query/batch)
+Answering a regression set one /query at a time embeds every question on
+its own and runs one vector search per question and storage. For a batch
+whose keywords are known up front (local keyword extraction), the strings
+LightRAG will embed are known before any answer is generated:
+
+    - the question itself (chunk search, and the query embedding kg_query
+      uses to pick entity chunks)
+    - ", ".join(ll_keywords) for the entity search (local, hybrid)
+    - ", ".join(hl_keywords) for the relation search (global, hybrid)
+
+BatchRetrieval embeds all of them in one backend request, then scores each
+vector store against the whole batch with one matrix product and keeps each
+string's top hits. Generation then runs LightRAG's own kg_query/naive_query
+against PrefetchedStorage stand-ins that answer query() and the embedding
+function from those results, so prompts and answers are the same as /query.
+Strings that were not prefetched (LLM-extracted keywords, a larger top_k)
+fall through to the real storage.
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class PrefetchedEmbeddings:
+    """Embedding function that returns batch-computed vectors for known texts and calls through otherwise"""
+
+    def __init__(self, func: Callable, vectors: Dict[str, np.ndarray]):
+        self.func = func
+        self.vectors = vectors
+        self.hits = 0
+        self.misses = 0
+
+    async def __call__(self, texts: List[str], **kwargs) -> np.ndarray:
+        if texts and all(text in self.vectors for text in texts):
+            self.hits += len(texts)
+            return np.stack([self.vectors[text] for text in texts])
+        self.misses += len(texts)
+        return await self.func(texts, **kwargs)
+
+    def __getattr__(self, name: str):
+        # embedding_dim, max_token_size, ... of the wrapped EmbeddingFunc
+        return getattr(self.func, name)
+
+
+class PrefetchedStorage:
+    """
+    Stand-in for a LightRAG storage inside kg_query/naive_query
+
+    query() answers from the batched search when the string was prefetched
+    with at least top_k hits (a shorter list is a prefix of a longer one);
+    everything else is delegated to the wrapped storage.
+    """
+
+    def __init__(self, storage, embedding_func: PrefetchedEmbeddings, results: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.storage = storage
+        self.embedding_func = embedding_func
+        self.results = results or {}
+        self.hits = 0
+        self.misses = 0
+
+    async def query(self, query: str, top_k: int, query_embedding=None) -> List[Dict[str, Any]]:
+        prefetched = self.results.get(query)
+        if prefetched is not None and prefetched["top_k"] >= top_k:
+            self.hits += 1
+            return prefetched["hits"][:top_k]
+        self.misses += 1
+        if query_embedding is None and query in self.embedding_func.vectors:
+            query_embedding = self.embedding_func.vectors[query]
+        return await self.storage.query(query, top_k=top_k, query_embedding=query_embedding)
+
+    def __getattr__(self, name: str):
+        return getattr(self.storage, name)
+
+
+# Texts scored per matrix product; bounds the (stored vectors x texts) score matrix
+_SEARCH_COLUMNS = 64
+
+
+def _top_hits(matrix: np.ndarray, data: List[Dict[str, Any]], queries: np.ndarray, top_k: int, threshold: float) -> List[List[Dict[str, Any]]]:
+    scores = matrix @ queries.T  # (stored vectors, texts)
+    k = min(top_k, scores.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=0)[:k]
+    columns = []
+    for column in range(scores.shape[1]):
+        rows = top[:, column]
+        rows = rows[np.argsort(-scores[rows, column])]
+        hits = []
+        for row in rows:
+            score = float(scores[row, column])
+            if score < threshold:
+                break
+            record = data[row]
+            hits.append({
+                **{key: value for key, value in record.items() if key != "vector"},
+                "__metrics__": score,
+                "id": record["__id__"],
+                "distance": score,
+                "created_at": record.get("__created_at__"),
+            })
+        columns.append(hits)
+    return columns
+
+
+async def batch_search(storage, vectors: Dict[str, np.ndarray], top_k: int) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Top top_k hits of every text against one NanoVectorDB storage, scored with matrix products
+
+    Hits have the shape NanoVectorDBStorage.query() returns (exactly tied
+    scores may come back in a different order). None when the storage is not
+    NanoVectorDB-backed (callers fall back to per-query search).
+    """
+    client = await storage._get_client() if hasattr(storage, "_get_client") else None
+    db = getattr(client, "_NanoVectorDB__storage", None)
+    if db is None or not vectors:
+        return None
+    matrix, data = db["matrix"], db["data"]
+    texts = list(vectors)
+    if not len(data):
+        return {text: {"top_k": top_k, "hits": []} for text in texts}
+    queries = np.stack([np.asarray(vectors[text], dtype=np.float32) for text in texts])
+    # The stored matrix is already normalized (cosine metric); normalize the queries the same way
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    queries = queries / np.where(norms == 0, 1.0, norms)
+    results = {}
+    for start in range(0, len(texts), _SEARCH_COLUMNS):
+        group = texts[start:start + _SEARCH_COLUMNS]
+        columns = await asyncio.to_thread(_top_hits, matrix, data, queries[start:start + _SEARCH_COLUMNS], top_k, storage.cosine_better_than_threshold)
+        results.update((text, {"top_k": top_k, "hits": hits}) for text, hits in zip(group, columns))
+    return results
+
+
+class BatchRetrieval:
+    """Batch-embedded, batch-searched retrieval state shared by the questions of one /query/batch request"""
+
+    def __init__(self, rag, embed: Callable):
+        self.rag = rag
+        self._embed = embed
+        self._wanted: Dict[str, Dict[str, int]] = {"chunks": {}, "entities": {}, "relationships": {}}
+        self._texts: Dict[str, None] = {}
+        self.embeddings = PrefetchedEmbeddings(rag.embedding_func, {})
+        self.chunks_vdb = PrefetchedStorage(rag.chunks_vdb, self.embeddings)
+        self.entities_vdb = PrefetchedStorage(rag.entities_vdb, self.embeddings)
+        self.relationships_vdb = PrefetchedStorage(rag.relationships_vdb, self.embeddings)
+        self.text_chunks = PrefetchedStorage(rag.text_chunks, self.embeddings)
+        self.stats: Dict[str, Any] = {}
+
+    def want(self, text: str, store: Optional[str] = None, top_k: int = 0):
+        """Register a string LightRAG will embed, and optionally the store and depth it will be searched with"""
+        if not text:
+            return
+        self._texts[text] = None
+        if store is not None:
+            wanted = self._wanted[store]
+            wanted[text] = max(wanted.get(text, 0), top_k)
+
+    async def prepare(self):
+        """One embedding request for every registered string, then one scoring pass per store"""
+        texts = list(self._texts)
+        start = time.perf_counter()
+        if texts:
+            vectors = await self._embed(texts)
+            self.embeddings.vectors.update(zip(texts, vectors))
+        embedded = time.perf_counter()
+        searched = {}
+        for store, wanted in self._wanted.items():
+            if not wanted:
+                continue
+            storage = getattr(self, f"{store}_vdb")
+            # One pass at the deepest top_k asked for; shallower requests take a prefix
+            results = await batch_search(storage.storage, {text: self.embeddings.vectors[text] for text in wanted}, max(wanted.values()))
+            if results is not None:
+                storage.results = results
+                searched[store] = len(results)
+        self.stats = {
+            "embedded_texts": len(texts),
+            "embed_ms": round((embedded - start) * 1000, 1),
+            "searched": searched,
+            "search_ms": round((time.perf_counter() - embedded) * 1000, 1),
+        }
+
+    def report(self) -> Dict[str, Any]:
+        stores = {"chunks": self.chunks_vdb, "entities": self.entities_vdb, "relationships": self.relationships_vdb}
+        return {
+            **self.stats,
+            "prefetched_searches": {name: {"hits": s.hits, "misses": s.misses} for name, s in stores.items()},
+            "prefetched_embeddings": {"hits": self.embeddings.hits, "misses": self.embeddings.misses},
+        }
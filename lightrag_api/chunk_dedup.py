@@ -0,0 +1,258 @@
+"""
+Near-duplicate chunk detection for entity extraction
+Fingerprints chunks with MinHash/LSH so exact and near-duplicate chunks
+(e.g. boilerplate clauses shared by GAFTA contract forms) reuse a prior
+extraction result instead of calling the LLM again. LightRAG parses the
+reused result against the new chunk, so entities are linked to the new document.
+
+A near duplicate reuses the result only when the words that differ carry
+no entities: if any of them has a digit or a capital (form numbers,
+parties, dates, amounts) the chunk is extracted again, since the reused
+result would drop its values and attribute the other chunk's to it.
+
+Counters are kept per ingest: LightRAG's worker tasks do not see the
+request's context, so carry_counts() passes the counters of the ingest
+started with counting() along as a keyword.
+"""
+
+import hashlib
+import json
+import os
+import re
+import zlib
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from lightrag.prompt import PROMPTS
+
+from documents import strip_section_header
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.9"))
+DEDUP_NUM_PERM = 128
+DEDUP_BANDS = 32
+DEDUP_SHINGLE_WORDS = 5
+# Chunks with fewer shingles than this are only matched exactly
+DEDUP_MIN_SHINGLES = 20
+
+FINGERPRINT_FILE = "chunk_fingerprints.jsonl"
+
+_STAT_KEYS = ["extraction_calls", "llm_calls", "reused_exact", "reused_near", "near_reextracted"]
+_WORD_RE = re.compile(r"\w[\w./,-]*\w|\w")
+
+_ingest_counts: ContextVar[Optional[Dict[str, int]]] = ContextVar("dedup_ingest_counts", default=None)
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(0x5EED)
+_PERM_A = _rng.integers(1, _MERSENNE_PRIME, size=DEDUP_NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _MERSENNE_PRIME, size=DEDUP_NUM_PERM, dtype=np.uint64)
+
+
+def _template_markers() -> Optional[Tuple[str, str]]:
+    """Static text immediately around {input_text} in LightRAG's extraction prompt"""
+    for key in ("entity_extraction_user_prompt", "entity_extraction"):
+        template = PROMPTS.get(key)
+        if isinstance(template, str) and "{input_text}" in template:
+            before, after = template.split("{input_text}", 1)
+            head = before[before.rfind("}") + 1:]
+            tail = after[:after.find("{")] if "{" in after else after
+            # LightRAG strips prompts before sending, so trailing whitespace cannot be relied on
+            tail = tail.rstrip()
+            if head.strip() and tail.strip():
+                return head, tail
+    return None
+
+
+_MARKERS = _template_markers()
+
+
+def extract_input_text(prompt: str) -> Optional[str]:
+    """Return the chunk text embedded in an entity-extraction prompt, or None for other prompts"""
+    if not _MARKERS or not prompt:
+        return None
+    head, tail = _MARKERS
+    start = prompt.find(head)
+    if start < 0:
+        return None
+    start += len(head)
+    end = prompt.rfind(tail)
+    if end < start:
+        return None
+    return prompt[start:end]
+
+
+def _clean(text: str) -> str:
+    return re.sub(r"\s+", " ", strip_section_header(text)).strip()
+
+
+def _normalize(text: str) -> str:
+    return _clean(text).lower()
+
+
+def _carries_entities(text: str, other: str) -> bool:
+    """Whether the words that differ between two chunks include numbers or names"""
+    differing = set(_WORD_RE.findall(text)) ^ set(_WORD_RE.findall(other))
+    return any(word[0].isupper() or any(ch.isdigit() for ch in word) for word in differing)
+
+
+def carry_counts(func: Callable) -> Callable:
+    """Wrap one of LightRAG's queued LLM functions so each call carries the current ingest's counters"""
+    @wraps(func)
+    async def counted(*args, **kwargs):
+        if "dedup_counts" not in kwargs:
+            kwargs["dedup_counts"] = _ingest_counts.get()
+        return await func(*args, **kwargs)
+    return counted
+
+
+def _shingles(normalized: str) -> List[int]:
+    words = normalized.split(" ")
+    if len(words) < DEDUP_SHINGLE_WORDS:
+        return [zlib.crc32(normalized.encode("utf-8"))]
+    return list({
+        zlib.crc32(" ".join(words[i:i + DEDUP_SHINGLE_WORDS]).encode("utf-8"))
+        for i in range(len(words) - DEDUP_SHINGLE_WORDS + 1)
+    })
+
+
+def minhash(shingles: List[int]) -> np.ndarray:
+    values = np.array(shingles, dtype=np.uint64)[:, None]
+    hashed = (values * _PERM_A + _PERM_B) % _MERSENNE_PRIME
+    return hashed.min(axis=0)
+
+
+class ChunkDeduplicator:
+    """MinHash/LSH index of extracted chunks and their raw extraction results"""
+
+    def __init__(self, working_dir: str, threshold: float = DEDUP_SIMILARITY):
+        self.path = os.path.join(working_dir, FINGERPRINT_FILE)
+        self.threshold = threshold
+        self.rows = DEDUP_NUM_PERM // DEDUP_BANDS
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._bands: Dict[Tuple[int, bytes], List[str]] = {}
+        # exact chunk hash -> entry id whose result was reused for it
+        self._reused: Dict[str, str] = {}
+        self.stats = {key: 0 for key in _STAT_KEYS}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if "glean_for" in record:
+                        if record["glean_for"] in self._entries:
+                            self._entries[record["glean_for"]]["glean"] = record["result"]
+                    else:
+                        self._index(record["id"], np.array(record["sig"], dtype=np.uint64), record["result"], record.get("near", True), record.get("text"))
+        except Exception as e:
+            print(f"Warning: Could not load chunk fingerprints {self.path}: {e}")
+
+    def _append(self, record: Dict[str, Any]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _index(self, entry_id: str, signature: np.ndarray, result: str, near: bool, text: Optional[str]):
+        self._entries[entry_id] = {"sig": signature, "result": result, "glean": None, "text": text}
+        # Entries recorded without their text can only be matched exactly
+        if near and text is not None:
+            for band in range(DEDUP_BANDS):
+                key = (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                self._bands.setdefault(key, []).append(entry_id)
+
+    def _find(self, entry_id: str, signature: np.ndarray, near: bool) -> Tuple[Optional[str], bool]:
+        """Return (matching entry id, is_exact)"""
+        if entry_id in self._entries:
+            return entry_id, True
+        if not near:
+            return None, False
+        candidates = set()
+        for band in range(DEDUP_BANDS):
+            key = (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            candidates.update(self._bands.get(key, ()))
+        best_id, best_score = None, 0.0
+        for candidate in candidates:
+            score = float(np.mean(self._entries[candidate]["sig"] == signature))
+            if score > best_score:
+                best_id, best_score = candidate, score
+        if best_id is not None and best_score >= self.threshold:
+            return best_id, False
+        return None, False
+
+    def counting(self) -> Dict[str, int]:
+        """Count the extraction calls of the ingest running in the current context; pass the result to report()"""
+        counts = {key: 0 for key in _STAT_KEYS}
+        _ingest_counts.set(counts)
+        return counts
+
+    def report(self, counts: Dict[str, int]) -> Dict[str, Any]:
+        """Extraction calls seen/saved by one ingest"""
+        report = dict(counts)
+        saved = report["extraction_calls"] - report["llm_calls"]
+        report["saved_fraction"] = round(saved / report["extraction_calls"], 4) if report["extraction_calls"] else 0.0
+        return report
+
+    def _count(self, counts: Optional[Dict[str, int]], key: str):
+        self.stats[key] += 1
+        if counts is not None:
+            counts[key] += 1
+
+    def wrap(self, llm_func: Callable) -> Callable:
+        """Wrap an LLM function so extraction calls for duplicate chunks are answered from the index"""
+
+        async def dedup_llm_func(prompt: str, system_prompt: Optional[str] = None, history_messages: List = [], keyword_extraction: bool = False, **kwargs) -> str:
+            counts = kwargs.pop("dedup_counts", None)
+            if not DEDUP_ENABLED or keyword_extraction:
+                return await llm_func(prompt, system_prompt=system_prompt, history_messages=history_messages, keyword_extraction=keyword_extraction, **kwargs)
+
+            chunk_text = extract_input_text(prompt)
+            glean_text = None
+            if chunk_text is None and history_messages:
+                # Gleaning pass: the original extraction prompt is the first history message
+                glean_text = extract_input_text(history_messages[0].get("content", ""))
+            if chunk_text is None and glean_text is None:
+                return await llm_func(prompt, system_prompt=system_prompt, history_messages=history_messages, keyword_extraction=keyword_extraction, **kwargs)
+
+            self._count(counts, "extraction_calls")
+            normalized = _normalize(chunk_text if chunk_text is not None else glean_text)
+            entry_id = hashlib.md5(normalized.encode("utf-8")).hexdigest()
+
+            if glean_text is not None:
+                reused_from = self._reused.get(entry_id)
+                if reused_from is not None:
+                    glean = self._entries[reused_from]["glean"]
+                    return glean if glean is not None else PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+                self._count(counts, "llm_calls")
+                result = await llm_func(prompt, system_prompt=system_prompt, history_messages=history_messages, **kwargs)
+                if entry_id in self._entries and result:
+                    self._entries[entry_id]["glean"] = result
+                    self._append({"glean_for": entry_id, "result": result})
+                return result
+
+            shingles = _shingles(normalized)
+            near = len(shingles) >= DEDUP_MIN_SHINGLES
+            signature = minhash(shingles)
+            text = _clean(chunk_text)
+            match_id, exact = self._find(entry_id, signature, near)
+            if match_id is not None and not exact and _carries_entities(text, self._entries[match_id]["text"]):
+                self._count(counts, "near_reextracted")
+                match_id = None
+            if match_id is not None:
+                self._count(counts, "reused_exact" if exact else "reused_near")
+                self._reused[entry_id] = match_id
+                return self._entries[match_id]["result"]
+
+            self._count(counts, "llm_calls")
+            result = await llm_func(prompt, system_prompt=system_prompt, history_messages=history_messages, **kwargs)
+            if result:
+                self._index(entry_id, signature, result, near, text)
+                self._append({"id": entry_id, "sig": signature.tolist(), "result": result, "near": near, "text": text})
+            return result
+
+        return dedup_llm_func
@@ -0,0 +1,262 @@
+"""
+Structured fast-path index for the GAFTA defaulters list
+Parses the converted defaulters PDF text into rows (company, country,
+award number, date) and serves fuzzy name lookups from a trigram index,
+so "is company X on the defaulters list" does not need an LLM query.
+
+Standard library only: convert_all_pdfs.py imports the parser from here.
+"""
+
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Set
+
+DEFAULTERS_FILE = "defaulters_index.json"
+
+# doc_ids (comma-separated, exact) whose ingestion replaces the defaulters table; the defaults
+# are the ids used by convert_all_pdfs.py's output, ingest_all_files.py and bulk_ingest.py
+DEFAULTERS_DOC_IDS = {
+    doc_id.strip().lower()
+    for doc_id in os.getenv("DEFAULTERS_DOC_ID", "defaulters_list,gafta_defaulters,gafta_defaulters_2023").split(",")
+    if doc_id.strip()
+}
+
+DEFAULTERS_MIN_SCORE = float(os.getenv("DEFAULTERS_MIN_SCORE", "0.5"))
+# Matches at or above this score (or with the same normalized name) count as the listed company;
+# lower-scoring ones are only reported as possible matches
+DEFAULTERS_EXACT_SCORE = float(os.getenv("DEFAULTERS_EXACT_SCORE", "0.9"))
+
+DATE_RE = re.compile(
+    r"\b(\d{1,2}[./-]\d{1,2}[./-]\d{2,4}"
+    r"|\d{4}-\d{2}-\d{2}"
+    r"|\d{1,2}(?:st|nd|rd|th)?\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec)[a-z]*\.?,?\s+\d{4}"
+    r"|(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec)[a-z]*\.?\s+\d{1,2},?\s+\d{4})\b",
+    re.IGNORECASE,
+)
+AWARD_RE = re.compile(r"\b(?:No\.?\s*)?([A-Z]{0,3}\s?\d{1,6}(?:[/-]\d{1,6}){0,2}[A-Z]?)\b")
+PAGE_MARKER_RE = re.compile(r"^\s*--- Page \d+ ---\s*$")
+HEADER_RE = re.compile(r"\b(name|country|award|date|defaulters?|page \d+ of)\b", re.IGNORECASE)
+
+COUNTRIES = [
+    "Afghanistan", "Albania", "Algeria", "Angola", "Argentina", "Armenia", "Australia", "Austria",
+    "Azerbaijan", "Bahrain", "Bangladesh", "Belarus", "Belgium", "Benin", "Bolivia",
+    "Bosnia and Herzegovina", "Brazil", "Bulgaria", "Burkina Faso", "Cambodia", "Cameroon", "Canada",
+    "Chad", "Chile", "China", "Colombia", "Congo", "Costa Rica", "Cote d'Ivoire", "Ivory Coast",
+    "Croatia", "Cuba", "Cyprus", "Czech Republic", "Denmark", "Djibouti", "Dominican Republic",
+    "Ecuador", "Egypt", "El Salvador", "Eritrea", "Estonia", "Ethiopia", "Finland", "France", "Gabon",
+    "Gambia", "Georgia", "Germany", "Ghana", "Greece", "Guatemala", "Guinea", "Haiti", "Honduras",
+    "Hong Kong", "Hungary", "Iceland", "India", "Indonesia", "Iran", "Iraq", "Ireland", "Israel",
+    "Italy", "Jamaica", "Japan", "Jordan", "Kazakhstan", "Kenya", "Korea", "South Korea", "Kuwait",
+    "Kyrgyzstan", "Latvia", "Lebanon", "Liberia", "Libya", "Lithuania", "Luxembourg", "Madagascar",
+    "Malawi", "Malaysia", "Mali", "Malta", "Mauritania", "Mauritius", "Mexico", "Moldova", "Mongolia",
+    "Montenegro", "Morocco", "Mozambique", "Myanmar", "Namibia", "Nepal", "Netherlands", "Holland",
+    "New Zealand", "Nicaragua", "Niger", "Nigeria", "North Macedonia", "Norway", "Oman", "Pakistan",
+    "Panama", "Paraguay", "Peru", "Philippines", "Poland", "Portugal", "Qatar", "Romania", "Russia",
+    "Russian Federation", "Rwanda", "Saudi Arabia", "Senegal", "Serbia", "Sierra Leone", "Singapore",
+    "Slovakia", "Slovenia", "Somalia", "South Africa", "Spain", "Sri Lanka", "Sudan", "Sweden",
+    "Switzerland", "Syria", "Taiwan", "Tajikistan", "Tanzania", "Thailand", "Togo", "Tunisia",
+    "Turkey", "Turkiye", "Turkmenistan", "Uganda", "Ukraine", "United Arab Emirates", "UAE",
+    "United Kingdom", "UK", "England", "Scotland", "United States", "USA", "Uruguay", "Uzbekistan",
+    "Venezuela", "Vietnam", "Yemen", "Zambia", "Zimbabwe",
+]
+_COUNTRY_RE = re.compile(
+    r"\b(" + "|".join(re.escape(c) for c in sorted(COUNTRIES, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+
+# Legal-form suffixes ignored when comparing company names
+_LEGAL_FORMS = {
+    "ltd", "limited", "llc", "llp", "plc", "inc", "corp", "corporation", "co", "company", "sa", "sas",
+    "sarl", "srl", "spa", "gmbh", "ag", "bv", "nv", "as", "a/s", "ab", "oy", "jsc", "ojsc", "cjsc",
+    "pjsc", "ooo", "tov", "pte", "pvt", "sdn", "bhd", "dmcc", "fze", "fzco", "fzc", "lda", "ltda",
+    "sl", "sro", "kft", "the", "and", "of",
+}
+
+
+def is_defaulters_doc(doc_id: str) -> bool:
+    return doc_id.strip().lower() in DEFAULTERS_DOC_IDS
+
+
+def normalize_name(name: str) -> str:
+    words = re.sub(r"[^\w\s/]", " ", name.lower()).split()
+    kept = [w for w in words if w not in _LEGAL_FORMS]
+    return " ".join(kept or words)
+
+
+def trigrams(name: str) -> Set[str]:
+    padded = f"  {normalize_name(name)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def parse_defaulters_text(text: str) -> List[Dict[str, str]]:
+    """
+    Parse defaulters list text (one row per line as extracted from the PDF)
+
+    A row needs a date; the award number is the last award-like token
+    outside the date, the country is a known country name, and the company
+    is everything before the country. Lines without a date are treated as
+    wrapped company names and prefixed to the next row.
+    """
+    rows = []
+    pending = ""
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line or PAGE_MARKER_RE.match(line):
+            continue
+        dates = list(DATE_RE.finditer(line))
+        if not dates:
+            if not HEADER_RE.search(line):
+                pending = f"{pending} {line}".strip()
+            continue
+
+        date_match = dates[-1]
+        rest = (line[:date_match.start()] + " " + line[date_match.end():]).strip()
+
+        country_match = None
+        for match in _COUNTRY_RE.finditer(rest):
+            country_match = match
+            if match.start() > 0:
+                break
+        award = ""
+        award_scope = rest[country_match.end():] if country_match else rest
+        award_matches = [m for m in AWARD_RE.finditer(award_scope) if any(ch.isdigit() for ch in m.group(1))]
+        if award_matches:
+            award = award_matches[-1].group(1).strip()
+
+        if country_match:
+            company = rest[:country_match.start()]
+            country = country_match.group(1)
+        else:
+            company = rest[:award_matches[-1].start()] if award_matches else rest
+            country = ""
+        company = re.sub(r"^\d+[.)]?\s+", "", company).strip(" ,;-\t")
+        if pending and (not company or company[:1].islower() or company[:1] in "(&-"):
+            company = f"{pending} {company}".strip()
+        pending = ""
+        if not company or HEADER_RE.fullmatch(company):
+            continue
+
+        rows.append({
+            "company": company,
+            "country": country,
+            "award_number": award,
+            "date": date_match.group(1),
+        })
+    return rows
+
+
+class DefaultersIndex:
+    """Rows of the defaulters list with a trigram inverted index over company names"""
+
+    def __init__(self, working_dir: str):
+        self.path = os.path.join(working_dir, DEFAULTERS_FILE)
+        self.rows: List[Dict[str, str]] = []
+        self.source_doc_id: Optional[str] = None
+        self._postings: Dict[str, List[int]] = {}
+        self._grams: List[Set[str]] = []
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self._build(data.get("rows", []), data.get("source_doc_id"))
+            except Exception as e:
+                print(f"Warning: Could not load defaulters index {self.path}: {e}")
+
+    def _build(self, rows: List[Dict[str, str]], source_doc_id: Optional[str]):
+        self.rows = rows
+        self.source_doc_id = source_doc_id
+        self._grams = [trigrams(row["company"]) for row in rows]
+        self._postings = {}
+        for i, grams in enumerate(self._grams):
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(i)
+
+    def load_text(self, doc_id: str, text: str) -> int:
+        """Replace the index with rows parsed from a (new revision of the) defaulters document"""
+        self._build(parse_defaulters_text(text), doc_id)
+        self.save()
+        return len(self.rows)
+
+    def clear(self):
+        self._build([], None)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"source_doc_id": self.source_doc_id, "rows": self.rows}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, name: str, limit: int = 5, min_score: float = DEFAULTERS_MIN_SCORE) -> List[Dict[str, Any]]:
+        """Fuzzy company-name lookup; score is the Jaccard similarity of name trigrams"""
+        query_grams = trigrams(name)
+        if not query_grams or not self.rows:
+            return []
+        overlap: Dict[int, int] = {}
+        for gram in query_grams:
+            for i in self._postings.get(gram, ()):
+                overlap[i] = overlap.get(i, 0) + 1
+        scored = []
+        for i, shared in overlap.items():
+            score = shared / len(query_grams | self._grams[i])
+            if score >= min_score:
+                scored.append((score, i))
+        scored.sort(reverse=True)
+        return [{**self.rows[i], "score": round(score, 3)} for score, i in scored[:limit]]
+
+
+_QUESTION_PATTERNS = [
+    re.compile(r"\b(?:is|are|was|were)\s+(.+?)\s+(?:on|in|listed|included)\b.*\bdefault", re.IGNORECASE),
+    re.compile(r"\b(?:has|have|did)\s+(.+?)\s+default", re.IGNORECASE),
+    re.compile(r"\bdefaulters?\b.*\b(?:for|about|named|called|include|includes|contain|contains)\s+(.+?)\??$", re.IGNORECASE),
+]
+# A bare quoted name only counts when the question is about the list itself
+_QUOTED_RE = re.compile(r"[\"“'‘](.+?)[\"”'’]")
+_LIST_RE = re.compile(r"\bdefaulters\b|\bdefault(?:ers?)?\s+list\b|\blisted\b", re.IGNORECASE)
+
+
+def extract_company_query(question: str) -> Optional[str]:
+    """Return the company name asked about if the question is a defaulters-list lookup"""
+    if not re.search(r"\bdefault(?:er|ers|ed)?\b", question, re.IGNORECASE):
+        return None
+    patterns = _QUESTION_PATTERNS + ([_QUOTED_RE] if _LIST_RE.search(question) else [])
+    for pattern in patterns:
+        match = pattern.search(question.strip())
+        if match:
+            name = match.group(1).strip(" ?.,\"'“”‘’")
+            name = re.sub(r"^(?:the\s+)?(?:company|firm|buyer|seller)\s+", "", name, flags=re.IGNORECASE)
+            if name and not re.fullmatch(r"(?:it|they|there|any|anyone|someone|this|that)", name, re.IGNORECASE):
+                return name
+    return None
+
+
+def is_exact_match(name: str, match: Dict[str, Any]) -> bool:
+    return match["score"] >= DEFAULTERS_EXACT_SCORE or normalize_name(match["company"]) == normalize_name(name)
+
+
+def format_answer(name: str, matches: List[Dict[str, Any]]) -> str:
+    """
+    Answer text for lookup matches
+
+    Only an exact or near-exact name is reported as listed; similar names
+    are reported as possible matches for the reader to check.
+    """
+    exact = [match for match in matches if is_exact_match(name, match)]
+    if exact:
+        matches = exact
+        lines = [f"Yes. The GAFTA defaulters list has {len(matches)} entr{'y' if len(matches) == 1 else 'ies'} matching \"{name}\":"]
+    else:
+        lines = [
+            f"The GAFTA defaulters list has no exact entry for \"{name}\". "
+            f"{len(matches)} entr{'y has' if len(matches) == 1 else 'ies have'} a similar name; check whether one is the same company:"
+        ]
+    for match in matches:
+        details = ", ".join(part for part in (
+            match["country"],
+            f"award {match['award_number']}" if match["award_number"] else "",
+            f"dated {match['date']}" if match["date"] else "",
+        ) if part)
+        lines.append(f"- {match['company']}" + (f" ({details})" if details else ""))
+    return "\n".join(lines)
@@ -0,0 +1,383 @@
+"""
+Section-level document tracking for incremental updates
+Splits documents into page/section units, hashes them and diffs revisions
+so only new or changed sections go through LightRAG entity extraction
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from lightrag.utils import compute_mdhash_id
+
+# Page delimiters written by convert_pdf_to_text.py / convert_all_pdfs.py
+PAGE_MARKER_RE = re.compile(r"^[ \t]*--- Page (\d+) ---[ \t]*$", re.MULTILINE)
+
+# Target size for sections of documents without page markers (roughly one LightRAG chunk)
+SECTION_MAX_CHARS = int(os.getenv("SECTION_MAX_CHARS", "4000"))
+
+MANIFEST_FILE = "doc_manifest.json"
+
+SECTION_HEADER_RE = re.compile(r"\A\[[^\]\n]*\]\n")
+
+PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+
+# Streamed uploads: sections per LightRAG insert, the longest single section
+# (page or paragraph) held while waiting for its end, and how far into the
+# body a first page marker may appear for the document to be split per page
+STREAM_BATCH_SECTIONS = int(os.getenv("INGEST_STREAM_BATCH_SECTIONS", "16"))
+STREAM_MAX_SECTION_CHARS = int(os.getenv("INGEST_MAX_SECTION_CHARS", str(8 * 1024 * 1024)))
+STREAM_MARKER_LOOKAHEAD = 1024 * 1024
+
+
+class DocumentUpdateError(Exception):
+    """Raised when LightRAG refuses or fails a section insert/delete"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _pack_paragraphs(text: str) -> List[str]:
+    """Pack blank-line separated paragraphs into sections of at most SECTION_MAX_CHARS"""
+    sections = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > SECTION_MAX_CHARS:
+            sections.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        sections.append(current)
+    return sections
+
+
+def split_sections(text: str) -> List[Dict[str, Any]]:
+    """
+    Split a document into sections
+
+    Text with `--- Page N ---` markers is split per page (the marker itself is
+    dropped so renumbered but otherwise unchanged pages keep the same hash).
+    Other text is split into paragraph-packed sections.
+
+    Returns:
+        List of {"page": int | None, "text": str}
+    """
+    markers = list(PAGE_MARKER_RE.finditer(text))
+    if not markers:
+        return [{"page": None, "text": s} for s in _pack_paragraphs(text)]
+
+    sections = []
+    preamble = text[:markers[0].start()].strip()
+    if preamble:
+        sections.append({"page": None, "text": preamble})
+    for i, match in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        page_text = text[match.end():end].strip()
+        if page_text:
+            sections.append({"page": int(match.group(1)), "text": page_text})
+    return sections
+
+
+def section_content(doc_id: str, text: str) -> str:
+    """Content stored in LightRAG for a section (prefixed so identical pages in different documents stay distinct)"""
+    return f"[{doc_id}]\n{text}"
+
+
+def strip_section_header(text: str) -> str:
+    """Remove the `[doc_id]` prefix added by section_content, if present"""
+    return SECTION_HEADER_RE.sub("", text, count=1)
+
+
+def build_sections(doc_id: str, text: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Build the section map for a document revision
+
+    Returns:
+        Ordered dict of LightRAG doc id -> {"content": str, "pages": [int], "chars": int}
+        Repeated identical sections within one document are stored once.
+    """
+    sections: Dict[str, Dict[str, Any]] = {}
+    for section in split_sections(text):
+        content = section_content(doc_id, section["text"])
+        section_id = compute_mdhash_id(content, prefix="doc-")
+        entry = sections.setdefault(section_id, {"content": content, "pages": [], "chars": len(section["text"])})
+        if section["page"] is not None:
+            entry["pages"].append(section["page"])
+    return sections
+
+
+class SectionStream:
+    """
+    Incremental split_sections(): feed() text as it arrives and get back the
+    sections completed so far; close() returns the rest
+
+    Produces the same sections (and so the same section ids) as split_sections
+    on the whole text, provided the first page marker, if any, appears within
+    the first STREAM_MARKER_LOOKAHEAD characters (converter output starts with
+    one). Only the unfinished page or paragraph is held in memory.
+    """
+
+    def __init__(self, max_section_chars: int = STREAM_MAX_SECTION_CHARS):
+        self.max_section_chars = max_section_chars
+        self.mode: Optional[str] = None  # "pages" | "paragraphs" once decided
+        self._buffer = ""
+        self._page: Optional[int] = None
+        self._current = ""  # paragraph packing accumulator
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        self._buffer += text
+        sections: List[Dict[str, Any]] = []
+        if self.mode is None:
+            # Undecided until a page marker shows up or the lookahead runs out
+            if PAGE_MARKER_RE.search(self._complete_lines()):
+                self.mode = "pages"
+            elif len(self._buffer) > STREAM_MARKER_LOOKAHEAD:
+                self.mode = "paragraphs"
+            else:
+                return sections
+        if self.mode == "pages":
+            self._split_pages(sections, final=False)
+        else:
+            self._split_paragraphs(sections, final=False)
+        if len(self._buffer) > self.max_section_chars:
+            raise DocumentUpdateError(
+                f"A single section exceeds {self.max_section_chars} characters; "
+                "add page markers or paragraph breaks, or raise INGEST_MAX_SECTION_CHARS",
+                status_code=413,
+            )
+        return sections
+
+    def close(self) -> List[Dict[str, Any]]:
+        sections: List[Dict[str, Any]] = []
+        if self.mode is None:
+            self.mode = "pages" if PAGE_MARKER_RE.search(self._buffer) else "paragraphs"
+        if self.mode == "pages":
+            self._split_pages(sections, final=True)
+        else:
+            self._split_paragraphs(sections, final=True)
+        return sections
+
+    def _complete_lines(self) -> str:
+        # A marker is only trusted once its line has ended
+        return self._buffer[:self._buffer.rfind("\n") + 1]
+
+    def _split_pages(self, sections: List[Dict[str, Any]], final: bool):
+        region = self._buffer if final else self._complete_lines()
+        consumed = 0
+        for match in PAGE_MARKER_RE.finditer(region):
+            page_text = region[consumed:match.start()].strip()
+            if page_text:
+                sections.append({"page": self._page, "text": page_text})
+            self._page, consumed = int(match.group(1)), match.end()
+        if final:
+            page_text = self._buffer[consumed:].strip()
+            if page_text:
+                sections.append({"page": self._page, "text": page_text})
+            self._buffer = ""
+        else:
+            self._buffer = self._buffer[consumed:]
+
+    def _split_paragraphs(self, sections: List[Dict[str, Any]], final: bool):
+        if final:
+            region, self._buffer = self._buffer, ""
+        else:
+            last_break = None
+            for last_break in PARAGRAPH_BREAK_RE.finditer(self._buffer):
+                pass
+            if last_break is None:
+                return
+            region, self._buffer = self._buffer[:last_break.end()], self._buffer[last_break.end():]
+        for paragraph in PARAGRAPH_BREAK_RE.split(region):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            # Same packing as _pack_paragraphs
+            if self._current and len(self._current) + len(paragraph) + 2 > SECTION_MAX_CHARS:
+                sections.append({"page": None, "text": self._current})
+                self._current = ""
+            self._current = f"{self._current}\n\n{paragraph}" if self._current else paragraph
+        if final and self._current:
+            sections.append({"page": None, "text": self._current})
+            self._current = ""
+
+
+class DocumentManifest:
+    """Persistent map of external doc_id -> LightRAG section documents"""
+
+    def __init__(self, working_dir: str):
+        self.path = os.path.join(working_dir, MANIFEST_FILE)
+        self.lock = asyncio.Lock()
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._docs = json.load(f)
+            except Exception as e:
+                print(f"Warning: Could not load document manifest {self.path}: {e}")
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self._docs.get(doc_id)
+
+    def items(self):
+        return self._docs.items()
+
+    def set(self, doc_id: str, sections: Dict[str, Dict[str, Any]]):
+        self._docs[doc_id] = {
+            "sections": {sid: {"pages": s["pages"], "chars": s["chars"]} for sid, s in sections.items()},
+            "updated_at": time.time(),
+        }
+        self.save()
+
+    def remove(self, doc_id: str):
+        if self._docs.pop(doc_id, None) is not None:
+            self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._docs, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+async def _delete_sections(rag, section_ids: List[str]) -> int:
+    deleted = 0
+    for section_id in section_ids:
+        result = await rag.adelete_by_doc_id(section_id)
+        if result.status == "not_found":
+            continue
+        if result.status != "success":
+            raise DocumentUpdateError(
+                f"Failed to delete section {section_id}: {result.message}",
+                status_code=409 if result.status_code == 403 else 500,
+            )
+        deleted += 1
+    return deleted
+
+
+async def sync_document(rag, manifest: DocumentManifest, doc_id: str, text: str) -> Dict[str, Any]:
+    """
+    Bring LightRAG in line with a new revision of a document
+
+    New or changed sections are inserted (and extracted); sections that no
+    longer exist are deleted, which retracts entities and relations that only
+    they contributed. Unchanged sections are left untouched.
+    """
+    async with manifest.lock:
+        new_sections = build_sections(doc_id, text)
+        previous = manifest.get(doc_id)
+        old_sections = previous["sections"] if previous else {}
+
+        to_insert = [sid for sid in new_sections if sid not in old_sections]
+        to_delete = [sid for sid in old_sections if sid not in new_sections]
+
+        if to_insert:
+            await rag.ainsert(
+                [new_sections[sid]["content"] for sid in to_insert],
+                ids=to_insert,
+                file_paths=[doc_id] * len(to_insert),
+            )
+        # Record inserted sections before deleting so a failed delete leaves an accurate manifest
+        manifest.set(doc_id, {**old_sections, **new_sections})
+
+        deleted = await _delete_sections(rag, to_delete)
+        manifest.set(doc_id, new_sections)
+
+        return {
+            "previously_tracked": previous is not None,
+            "sections_total": len(new_sections),
+            "sections_inserted": len(to_insert),
+            "sections_deleted": deleted,
+            "sections_unchanged": len(new_sections) - len(to_insert),
+        }
+
+
+async def sync_document_stream(
+    rag,
+    manifest: DocumentManifest,
+    doc_id: str,
+    chunks: AsyncIterator[str],
+    batch_sections: int = STREAM_BATCH_SECTIONS,
+) -> Dict[str, Any]:
+    """
+    sync_document for a document that arrives in pieces
+
+    Sections are split as the text comes in and new ones are inserted in
+    batches of batch_sections while the rest is still being read, so neither
+    the body nor the section contents are ever held whole. The manifest is
+    updated after every batch; if the stream fails part-way, the sections
+    already inserted stay recorded and re-posting the document skips them.
+    """
+    async with manifest.lock:
+        previous = manifest.get(doc_id)
+        old_sections = previous["sections"] if previous else {}
+        # Section id -> {"pages", "chars"}; contents are dropped once inserted
+        new_sections: Dict[str, Dict[str, Any]] = {}
+        pending: List[Tuple[str, str]] = []
+        inserted = batches = 0
+
+        def take(section: Dict[str, Any]):
+            content = section_content(doc_id, section["text"])
+            section_id = compute_mdhash_id(content, prefix="doc-")
+            entry = new_sections.get(section_id)
+            if entry is None:
+                entry = new_sections[section_id] = {"pages": [], "chars": len(section["text"])}
+                if section_id not in old_sections:
+                    pending.append((section_id, content))
+            if section["page"] is not None:
+                entry["pages"].append(section["page"])
+
+        async def insert_pending():
+            nonlocal inserted, batches
+            if not pending:
+                return
+            await rag.ainsert([c for _, c in pending], ids=[sid for sid, _ in pending], file_paths=[doc_id] * len(pending))
+            inserted += len(pending)
+            batches += 1
+            pending.clear()
+            manifest.set(doc_id, {**old_sections, **new_sections})
+
+        splitter = SectionStream()
+        async for text in chunks:
+            for section in splitter.feed(text):
+                take(section)
+            if len(pending) >= batch_sections:
+                await insert_pending()
+        for section in splitter.close():
+            take(section)
+        if not new_sections:
+            # An empty revision would otherwise delete every existing section
+            raise DocumentUpdateError("Document has no text", status_code=400)
+        await insert_pending()
+        manifest.set(doc_id, {**old_sections, **new_sections})
+
+        deleted = await _delete_sections(rag, [sid for sid in old_sections if sid not in new_sections])
+        manifest.set(doc_id, new_sections)
+
+        return {
+            "previously_tracked": previous is not None,
+            "sections_total": len(new_sections),
+            "sections_inserted": inserted,
+            "sections_deleted": deleted,
+            "sections_unchanged": len(new_sections) - inserted,
+            "split": splitter.mode,
+            "insert_batches": batches,
+        }
+
+
+async def delete_document(rag, manifest: DocumentManifest, doc_id: str) -> Optional[Dict[str, Any]]:
+    """Delete every section of a tracked document; returns None if doc_id is unknown"""
+    async with manifest.lock:
+        previous = manifest.get(doc_id)
+        if previous is None:
+            return None
+        section_ids = list(previous["sections"].keys())
+        deleted = await _delete_sections(rag, section_ids)
+        manifest.remove(doc_id)
+        return {"sections_deleted": deleted}
@@ -0,0 +1,165 @@
+"""
+Micro-batching of concurrent embedding calls
+Concurrent queries each embed a handful of strings (the question, keyword
+lists); sent separately, that is many tiny HTTP requests to the embedding
+host. EmbeddingBatcher sits in front of the embedding function, holds
+calls for up to EMBEDDING_BATCH_WINDOW_MS, and sends everything collected
+in that window (identical texts once) as one backend request, then scatters
+the vectors back to the callers.
+
+A batch is sent early once EMBEDDING_BATCH_MAX_TEXTS texts are waiting, and
+at most EMBEDDING_MAX_ASYNC batches are in flight. metrics() reports batch
+sizes and the wait added by the window so it can be tuned against GPU
+throughput.
+
+With a scheduler, batches take its slots (by traffic class, scheduler.py)
+instead of the EMBEDDING_MAX_ASYNC semaphore. A batch that coalesced calls
+of several classes runs at the most urgent one.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from scheduler import TRAFFIC_CLASSES, PriorityScheduler, current_traffic_class
+
+EMBEDDING_BATCH_MAX_TEXTS = int(os.getenv("EMBEDDING_BATCH_MAX_TEXTS", "64"))
+EMBEDDING_MAX_ASYNC = int(os.getenv("EMBEDDING_MAX_ASYNC", "4"))
+_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32]
+_SAMPLES = 1000
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def _bucket_label(size: int) -> str:
+    i = _SIZE_BUCKETS.index(size)
+    if i == len(_SIZE_BUCKETS) - 1:
+        return f"{size}+"
+    upper = _SIZE_BUCKETS[i + 1] - 1
+    return str(size) if upper == size else f"{size}-{upper}"
+
+
+class EmbeddingBatcher:
+    """Coalesces embedding calls arriving within a short window into one backend call"""
+
+    def __init__(self, func: Callable, window_ms: float, max_texts: int = EMBEDDING_BATCH_MAX_TEXTS, max_async: int = EMBEDDING_MAX_ASYNC, scheduler: Optional[PriorityScheduler] = None):
+        self.func = func
+        self.window = window_ms / 1000.0
+        self.max_texts = max_texts
+        self.max_async = max_async
+        self._semaphore = asyncio.Semaphore(max_async)
+        self.scheduler = scheduler
+        self._pending: List[Tuple[List[str], asyncio.Future, float, str]] = []
+        self._pending_texts = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Batches sent from the timer; the loop only keeps weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"calls": 0, "texts": 0, "batches": 0, "backend_texts": 0, "errors": 0}
+        self._batch_sizes = {size: 0 for size in _SIZE_BUCKETS}
+        self._waits_ms = deque(maxlen=_SAMPLES)
+        self._backend_ms = deque(maxlen=_SAMPLES)
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    @property
+    def max_callers(self) -> int:
+        """Concurrent callers worth admitting (LightRAG's embedding_func_max_async) so batches can fill"""
+        # With a scheduler the waiting calls must reach it, not queue in LightRAG, for its order to apply
+        return max(self.max_texts, self.max_async) if self.enabled or self.scheduler is not None else self.max_async
+
+    async def __call__(self, texts: List[str], traffic_class: Optional[str] = None, **kwargs) -> np.ndarray:
+        texts = list(texts)
+        traffic_class = traffic_class or current_traffic_class() or "ingest"
+        self.stats["calls"] += 1
+        self.stats["texts"] += len(texts)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self.enabled:
+            await self._send([(texts, future, time.perf_counter(), traffic_class)])
+            return await future
+
+        self._pending.append((texts, future, time.perf_counter(), traffic_class))
+        self._pending_texts += len(texts)
+        if self._pending_texts >= self.max_texts:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    async def embed_batch(self, texts: List[str], traffic_class: Optional[str] = None) -> np.ndarray:
+        """Embed a set of texts known up front as one backend request, without waiting for the window"""
+        texts = list(texts)
+        self.stats["calls"] += 1
+        self.stats["texts"] += len(texts)
+        future = asyncio.get_running_loop().create_future()
+        await self._send([(texts, future, time.perf_counter(), traffic_class or current_traffic_class() or "ingest")])
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_texts = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _slot(self, batch: List[Tuple[List[str], asyncio.Future, float, str]]):
+        if self.scheduler is None:
+            return self._semaphore
+        return self.scheduler.slot(min((entry[3] for entry in batch), key=TRAFFIC_CLASSES.index))
+
+    async def _send(self, batch: List[Tuple[List[str], asyncio.Future, float, str]]):
+        unique = list(dict.fromkeys(text for texts, _, _, _ in batch for text in texts))
+        async with self._slot(batch):
+            start = time.perf_counter()
+            for _, _, queued, _ in batch:
+                self._waits_ms.append((start - queued) * 1000)
+            try:
+                vectors = np.asarray(await self.func(unique), dtype=np.float32)
+            except BaseException as e:
+                self.stats["errors"] += 1
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self._backend_ms.append((time.perf_counter() - start) * 1000)
+
+        self.stats["batches"] += 1
+        self.stats["backend_texts"] += len(unique)
+        bucket = max(size for size in _SIZE_BUCKETS if size <= len(batch))
+        self._batch_sizes[bucket] += 1
+        position = {text: i for i, text in enumerate(unique)}
+        for texts, future, _, _ in batch:
+            if not future.done():
+                future.set_result(vectors[[position[text] for text in texts]])
+
+    def metrics(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "max_texts": self.max_texts,
+            "max_async": self.max_async,
+            **self.stats,
+            "avg_calls_per_batch": round(self.stats["calls"] / batches, 2) if batches else 0.0,
+            "avg_texts_per_batch": round(self.stats["backend_texts"] / batches, 2) if batches else 0.0,
+            # Histogram of calls coalesced per backend request
+            "calls_per_batch": {_bucket_label(size): count for size, count in self._batch_sizes.items()},
+            "added_wait_ms": {
+                "avg": round(sum(self._waits_ms) / len(self._waits_ms), 3) if self._waits_ms else 0.0,
+                "p95": round(_percentile(self._waits_ms, 0.95), 3),
+                "max": round(max(self._waits_ms), 3) if self._waits_ms else 0.0,
+            },
+            "backend_ms_avg": round(sum(self._backend_ms) / len(self._backend_ms), 1) if self._backend_ms else 0.0,
+        }
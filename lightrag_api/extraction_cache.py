@@ -0,0 +1,219 @@
+"""
+Durable entity-extraction cache
+Stores raw LLM extraction output (first pass and gleaning) in a SQLite file
+keyed by chunk content hash, extraction model and prompt version. The file
+lives outside WORKING_DIR, so wiping the graph and vector stores for a
+rebuild replays extraction from disk instead of the GPU.
+
+The prompt version is a hash of the extraction prompts as actually sent
+(system prompt plus user prompt with the chunk removed), so changing
+LightRAG's templates, entity types or language invalidates old entries
+automatically. EXTRACTION_CACHE_PROMPT_TAG can be bumped to force it.
+
+New entries are buffered and written EXTRACTION_CACHE_BATCH at a time
+(and when an ingest finishes), so the ingest path does not commit to
+SQLite on the event loop for every chunk. The database is opened on first
+use, so importing the API does not need the cache directory.
+
+Export/import (gzipped JSONL) ship the cache between environments:
+    python extraction_cache.py export cache.jsonl.gz
+    python extraction_cache.py import cache.jsonl.gz
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from typing import Any, Callable, Dict, IO, Iterator, List, Optional, Tuple
+
+from chunk_dedup import extract_input_text
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "/app/extraction_cache/extraction_cache.sqlite")
+EXTRACTION_CACHE_PROMPT_TAG = os.getenv("EXTRACTION_CACHE_PROMPT_TAG", "")
+# Buffered entries written per SQLite transaction
+EXTRACTION_CACHE_BATCH = int(os.getenv("EXTRACTION_CACHE_BATCH", "32"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    chunk_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    result BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (chunk_hash, model, prompt_version, kind)
+) WITHOUT ROWID
+"""
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def prompt_version(system_prompt: Optional[str], prompt: str, chunk_text: str) -> str:
+    """Hash of everything in an extraction call except the chunk itself"""
+    template = (system_prompt or "") + "\0" + prompt.replace(chunk_text, "") + "\0" + EXTRACTION_CACHE_PROMPT_TAG
+    return _hash(template)[:16]
+
+
+class ExtractionCache:
+    """SQLite-backed extraction results, shared across rebuilds"""
+
+    def __init__(self, path: str = EXTRACTION_CACHE_PATH, batch: int = EXTRACTION_CACHE_BATCH):
+        self.path = path
+        self.batch = max(1, batch)
+        self._connection: Optional[sqlite3.Connection] = None
+        # Entries not yet written, by key
+        self._pending: Dict[Tuple[str, str, str, str], Tuple[bytes, float]] = {}
+        self.stats = {"lookups": 0, "hits": 0, "stores": 0}
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(_SCHEMA)
+            self._connection.commit()
+        return self._connection
+
+    def get(self, chunk_hash: str, model: str, version: str, kind: str) -> Optional[str]:
+        pending = self._pending.get((chunk_hash, model, version, kind))
+        if pending is not None:
+            return zlib.decompress(pending[0]).decode("utf-8")
+        row = self._conn.execute(
+            "SELECT result FROM extractions WHERE chunk_hash=? AND model=? AND prompt_version=? AND kind=?",
+            (chunk_hash, model, version, kind),
+        ).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def put(self, chunk_hash: str, model: str, version: str, kind: str, result: str):
+        self._pending[(chunk_hash, model, version, kind)] = (zlib.compress(result.encode("utf-8")), time.time())
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered entries in one transaction"""
+        if not self._pending:
+            return
+        rows = [(*key, result, created_at) for key, (result, created_at) in self._pending.items()]
+        self._pending.clear()
+        self._conn.executemany("INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._conn.commit()
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+    def report(self, before: Dict[str, int]) -> Dict[str, Any]:
+        """Lookups/hits since a snapshot()"""
+        delta = {k: self.stats[k] - before.get(k, 0) for k in self.stats}
+        delta["hit_rate"] = round(delta["hits"] / delta["lookups"], 4) if delta["lookups"] else 0.0
+        return delta
+
+    def describe(self) -> Dict[str, Any]:
+        self.flush()
+        entries, models, versions = self._conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT model), COUNT(DISTINCT prompt_version) FROM extractions"
+        ).fetchone()
+        return {
+            "path": self.path,
+            "enabled": EXTRACTION_CACHE_ENABLED,
+            "entries": entries,
+            "models": models,
+            "prompt_versions": versions,
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            **self.stats,
+        }
+
+    def export_records(self) -> Iterator[Dict[str, Any]]:
+        self.flush()
+        cursor = self._conn.execute(
+            "SELECT chunk_hash, model, prompt_version, kind, result, created_at FROM extractions ORDER BY chunk_hash"
+        )
+        for chunk_hash, model, version, kind, result, created_at in cursor:
+            yield {
+                "chunk_hash": chunk_hash,
+                "model": model,
+                "prompt_version": version,
+                "kind": kind,
+                "result": zlib.decompress(result).decode("utf-8"),
+                "created_at": created_at,
+            }
+
+    def export_jsonl(self, out: IO[bytes]) -> int:
+        """Write all entries as gzipped JSONL to a binary stream; returns the entry count"""
+        count = 0
+        with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+            for record in self.export_records():
+                gz.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                count += 1
+        return count
+
+    def import_jsonl(self, data: bytes, replace: bool = False) -> Dict[str, int]:
+        """Load entries from (optionally gzipped) JSONL; existing keys are kept unless replace=True"""
+        if data[:2] == b"\x1f\x8b":
+            data = gzip.decompress(data)
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        self.flush()
+        read, before = 0, self._conn.total_changes
+        rows = []
+        for line in data.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            rows.append((
+                record["chunk_hash"], record["model"], record["prompt_version"], record["kind"],
+                zlib.compress(record["result"].encode("utf-8")), record.get("created_at", time.time()),
+            ))
+            read += 1
+        self._conn.executemany(f"{verb} INTO extractions VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._conn.commit()
+        return {"read": read, "imported": self._conn.total_changes - before}
+
+    def wrap(self, llm_func: Callable, model_for: Callable[[], str]) -> Callable:
+        """Wrap an LLM function so extraction and gleaning calls are served from / stored in the cache"""
+
+        async def cached_llm_func(prompt: str, system_prompt: Optional[str] = None, history_messages: List = [], keyword_extraction: bool = False, **kwargs) -> str:
+            chunk_text = None if keyword_extraction else extract_input_text(prompt)
+            kind = "extract"
+            extraction_prompt = prompt
+            if chunk_text is None and not keyword_extraction and history_messages:
+                # Gleaning pass: the original extraction prompt is the first history message
+                extraction_prompt = history_messages[0].get("content", "")
+                chunk_text = extract_input_text(extraction_prompt)
+                kind = "glean"
+            if not EXTRACTION_CACHE_ENABLED or chunk_text is None:
+                return await llm_func(prompt, system_prompt=system_prompt, history_messages=history_messages, keyword_extraction=keyword_extraction, **kwargs)
+
+            key = (_hash(chunk_text), model_for(), prompt_version(system_prompt, extraction_prompt, chunk_text), kind)
+            self.stats["lookups"] += 1
+            cached = self.get(*key)
+            if cached is not None:
+                self.stats["hits"] += 1
+                return cached
+            result = await llm_func(prompt, system_prompt=system_prompt, history_messages=history_messages, keyword_extraction=keyword_extraction, **kwargs)
+            if result:
+                self.put(*key, result)
+                self.stats["stores"] += 1
+            return result
+
+        return cached_llm_func
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("export", "import"):
+        print(f"Usage: {sys.argv[0]} export|import FILE  (cache: EXTRACTION_CACHE_PATH={EXTRACTION_CACHE_PATH})")
+        sys.exit(1)
+    cache = ExtractionCache()
+    if sys.argv[1] == "export":
+        with open(sys.argv[2], "wb") as f:
+            print(f"✓ Exported {cache.export_jsonl(f)} entries to {sys.argv[2]}")
+    else:
+        with open(sys.argv[2], "rb") as f:
+            print(f"✓ Imported {cache.import_jsonl(f.read())} from {sys.argv[2]}")
@@ -0,0 +1,292 @@
+"""
+Server-side layout and level-of-detail views of the knowledge graph
+After the graph changes, the whole graph is laid out once in a worker
+thread:
+
+    1. degree and Louvain communities (isolated entities share one community)
+    2. a spring layout of the community graph (supernodes, edge weight =
+       summed weight of the relations between two communities)
+    3. a spring layout of every community, scaled to a disc around its
+       supernode
+
+The result is saved to graph_layout.json in WORKING_DIR and served by
+view() at increasing detail: community supernodes, the highest-degree
+entities, then full neighbourhoods (one community, an entity's ego graph or
+a viewport box). Views are cached until the next layout.
+
+networkx's spring layout needs scipy above ~500 nodes; each layout is
+capped at LAYOUT_SPRING_MAX_NODES (highest degree first) and the remaining
+nodes are placed next to their strongest laid-out neighbour.
+"""
+
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import networkx as nx
+import numpy as np
+
+GRAPH_LAYOUT_FILE = "graph_layout.json"
+LAYOUT_SPRING_MAX_NODES = int(os.getenv("LAYOUT_SPRING_MAX_NODES", "400"))
+LAYOUT_SEED = 42
+# Output coordinates span roughly [-LAYOUT_SCALE, LAYOUT_SCALE]
+LAYOUT_SCALE = 1000.0
+VIEW_LEVELS = ["communities", "hubs", "detail"]
+_DESCRIPTION_CHARS = 200
+_MAX_CACHED_VIEWS = 256
+
+
+def _weight(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def _spring(graph: nx.Graph, rng: np.random.RandomState) -> Dict[Any, np.ndarray]:
+    """Spring layout in [-1, 1]; beyond LAYOUT_SPRING_MAX_NODES the tail is placed beside laid-out neighbours"""
+    if graph.number_of_nodes() == 0:
+        return {}
+    if graph.number_of_nodes() == 1:
+        return {next(iter(graph)): np.zeros(2)}
+    by_degree = sorted(graph, key=lambda n: graph.degree(n, weight="weight"), reverse=True)
+    core = by_degree[:LAYOUT_SPRING_MAX_NODES]
+    pos = nx.spring_layout(graph.subgraph(core), weight="weight", seed=LAYOUT_SEED)
+    for node in by_degree[LAYOUT_SPRING_MAX_NODES:]:
+        placed = [nbr for nbr in graph[node] if nbr in pos]
+        if placed:
+            anchor = max(placed, key=lambda nbr: graph[node][nbr].get("weight", 1.0))
+            pos[node] = pos[anchor] + rng.normal(0, 0.05, 2)
+        else:
+            angle, radius = rng.uniform(0, 2 * math.pi), math.sqrt(rng.uniform(0, 1))
+            pos[node] = np.array([radius * math.cos(angle), radius * math.sin(angle)])
+    return pos
+
+
+def compute_layout(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Degree, communities and coordinates for the whole graph (CPU-bound; run in a thread)"""
+    rng = np.random.RandomState(LAYOUT_SEED)
+    graph = nx.Graph()
+    for node in nodes:
+        graph.add_node(node["id"], type=node.get("entity_type", "entity"), description=(node.get("description") or "")[:_DESCRIPTION_CHARS])
+    for edge in edges:
+        if edge.get("source") in graph and edge.get("target") in graph:
+            graph.add_edge(edge["source"], edge["target"], weight=_weight(edge.get("weight")), keywords=edge.get("keywords", ""))
+
+    connected = graph.subgraph([n for n in graph if graph.degree(n) > 0])
+    groups = [set(c) for c in nx.community.louvain_communities(connected, weight="weight", seed=LAYOUT_SEED)] if connected.number_of_nodes() else []
+    isolated = {n for n in graph if graph.degree(n) == 0}
+    if isolated:
+        groups.append(isolated)
+    groups.sort(key=len, reverse=True)
+    community_of = {node: cid for cid, group in enumerate(groups) for node in group}
+
+    supergraph = nx.Graph()
+    supergraph.add_nodes_from(range(len(groups)))
+    for u, v, data in graph.edges(data=True):
+        cu, cv = community_of[u], community_of[v]
+        if cu != cv:
+            previous = supergraph.get_edge_data(cu, cv, {"weight": 0.0})["weight"]
+            supergraph.add_edge(cu, cv, weight=previous + data["weight"])
+    centers = _spring(supergraph, rng)
+
+    # Disc radius grows with sqrt(size); the largest community gets about half the typical spacing
+    spacing = 2.0 / math.sqrt(max(len(groups), 1))
+    largest = len(groups[0]) if groups else 1
+    out_nodes: Dict[str, List[Any]] = {}
+    communities = []
+    for cid, group in enumerate(groups):
+        radius = 0.5 * spacing * math.sqrt(len(group) / largest)
+        center = centers[cid] * LAYOUT_SCALE
+        local = _spring(graph.subgraph(group), rng)
+        for node, offset in local.items():
+            x, y = center + offset * radius * LAYOUT_SCALE
+            out_nodes[node] = [round(float(x), 2), round(float(y), 2), graph.degree(node), cid, graph.nodes[node]["type"], graph.nodes[node]["description"]]
+        top = sorted(group, key=graph.degree, reverse=True)[:3]
+        communities.append({
+            "id": cid,
+            "size": len(group),
+            "x": round(float(center[0]), 2),
+            "y": round(float(center[1]), 2),
+            "radius": round(radius * LAYOUT_SCALE, 2),
+            "label": ", ".join(top) if group is not isolated else "Unconnected entities",
+            "top": top,
+        })
+
+    return {
+        "nodes": out_nodes,
+        "edges": [[u, v, round(d["weight"], 3), d["keywords"]] for u, v, d in graph.edges(data=True)],
+        "communities": communities,
+        "community_edges": [[u, v, round(d["weight"], 3)] for u, v, d in supergraph.edges(data=True)],
+    }
+
+
+class GraphLayout:
+    """Cached layout of the entity graph plus memoized level-of-detail views"""
+
+    def __init__(self, working_dir: str):
+        self.path = os.path.join(working_dir, GRAPH_LAYOUT_FILE)
+        self.lock = asyncio.Lock()
+        self.data: Dict[str, Any] = {"nodes": {}, "edges": [], "communities": [], "community_edges": []}
+        self.version = 0
+        self.dirty = True
+        self.computed_at: Optional[float] = None
+        self.compute_ms: Optional[float] = None
+        self._adjacency: Dict[str, set] = {}
+        self._views: Dict[Tuple, Dict[str, Any]] = {}
+        # Background refreshes; the loop only keeps weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    saved = json.load(f)
+                self._install(saved["layout"], saved.get("computed_at"), saved.get("compute_ms"))
+                self.dirty = False
+            except Exception as e:
+                print(f"Warning: Could not load graph layout {self.path}: {e}")
+
+    def _install(self, data: Dict[str, Any], computed_at: Optional[float], compute_ms: Optional[float]):
+        adjacency: Dict[str, set] = {}
+        for u, v, _, _ in data["edges"]:
+            adjacency.setdefault(u, set()).add(v)
+            adjacency.setdefault(v, set()).add(u)
+        self.data, self._adjacency = data, adjacency
+        self.computed_at, self.compute_ms = computed_at, compute_ms
+        self.version += 1
+        self._views.clear()
+
+    def invalidate(self):
+        """Mark the layout stale (call after the graph changes)"""
+        self.dirty = True
+
+    def refresh(self, rag):
+        """Recompute in the background so the next view is already current"""
+        task = asyncio.ensure_future(self._refresh_logged(rag))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh_logged(self, rag):
+        try:
+            await self.ensure_current(rag)
+        except Exception as e:
+            print(f"Warning: Graph layout failed: {e}")
+
+    async def ensure_current(self, rag):
+        async with self.lock:
+            if not self.dirty:
+                return
+            # Changes arriving while this layout runs mark it dirty again
+            self.dirty = False
+            start = time.perf_counter()
+            graph = rag.chunk_entity_relation_graph
+            try:
+                nodes, edges = await graph.get_all_nodes(), await graph.get_all_edges()
+                data = await asyncio.to_thread(compute_layout, nodes, edges)
+            except BaseException:
+                # Retry on the next view rather than serving the old layout as current
+                self.dirty = True
+                raise
+            compute_ms = round((time.perf_counter() - start) * 1000, 1)
+            self._install(data, time.time(), compute_ms)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"layout": data, "computed_at": self.computed_at, "compute_ms": compute_ms}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            print(f"✓ Graph layout: {len(nodes)} nodes, {len(data['communities'])} communities in {compute_ms:.0f}ms")
+
+    def _node(self, name: str) -> Dict[str, Any]:
+        x, y, degree, community, entity_type, description = self.data["nodes"][name]
+        return {"id": name, "x": x, "y": y, "degree": degree, "community": community, "type": entity_type, "description": description}
+
+    def _subgraph(self, names: List[str]) -> Dict[str, Any]:
+        selected = set(names)
+        edges = [
+            {"from": u, "to": v, "weight": w, "relation": keywords}
+            for u, v, w, keywords in self.data["edges"] if u in selected and v in selected
+        ]
+        return {"nodes": [self._node(name) for name in names], "edges": edges}
+
+    def _by_degree(self, names) -> List[str]:
+        return sorted(names, key=lambda name: self.data["nodes"][name][2], reverse=True)
+
+    def _ego(self, node: str, depth: int, limit: int) -> List[str]:
+        seen, frontier = [node], deque([(node, 0)])
+        visited = {node}
+        while frontier and len(seen) < limit:
+            current, distance = frontier.popleft()
+            if distance >= depth:
+                continue
+            for neighbour in self._by_degree(self._adjacency.get(current, ())):
+                if neighbour not in visited and len(seen) < limit:
+                    visited.add(neighbour)
+                    seen.append(neighbour)
+                    frontier.append((neighbour, distance + 1))
+        return seen
+
+    def view(
+        self,
+        level: str,
+        limit: int,
+        community: Optional[int] = None,
+        node: Optional[str] = None,
+        depth: int = 1,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+    ) -> Dict[str, Any]:
+        """A level-of-detail slice of the cached layout; raises KeyError/ValueError for bad arguments"""
+        key = (level, limit, community, node, depth, bbox)
+        cached = self._views.get(key)
+        if cached is not None:
+            return {**cached, "cached": True}
+
+        nodes = self.data["nodes"]
+        if level == "communities":
+            shown = self.data["communities"][:limit]
+            ids = {c["id"] for c in shown}
+            result = {
+                "communities": shown,
+                "edges": [{"from": u, "to": v, "weight": w} for u, v, w in self.data["community_edges"] if u in ids and v in ids],
+            }
+        elif level == "hubs":
+            result = self._subgraph(self._by_degree(nodes)[:limit])
+        elif node is not None:
+            if node not in nodes:
+                raise KeyError(node)
+            result = self._subgraph(self._ego(node, depth, limit))
+        elif community is not None:
+            if not 0 <= community < len(self.data["communities"]):
+                raise KeyError(community)
+            result = self._subgraph(self._by_degree(n for n, v in nodes.items() if v[3] == community)[:limit])
+        elif bbox is not None:
+            x0, y0, x1, y1 = bbox
+            inside = (n for n, v in nodes.items() if x0 <= v[0] <= x1 and y0 <= v[1] <= y1)
+            result = self._subgraph(self._by_degree(inside)[:limit])
+        else:
+            raise ValueError("detail level needs community, node or bbox")
+
+        result.update({
+            "level": level,
+            "layout_version": self.version,
+            "computed_at": self.computed_at,
+            "total_nodes": len(nodes),
+            "total_edges": len(self.data["edges"]),
+            "total_communities": len(self.data["communities"]),
+        })
+        if len(self._views) >= _MAX_CACHED_VIEWS:
+            self._views.clear()
+        self._views[key] = result
+        return {**result, "cached": False}
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "dirty": self.dirty,
+            "computed_at": self.computed_at,
+            "compute_ms": self.compute_ms,
+            "nodes": len(self.data["nodes"]),
+            "communities": len(self.data["communities"]),
+            "cached_views": len(self._views),
+        }
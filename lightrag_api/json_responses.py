@@ -0,0 +1,185 @@
+"""
+Compact, compressed and cacheable JSON responses
+Graph payloads run to megabytes and FastAPI's default path (jsonable_encoder,
+then json.dumps) is slow for them and sends them uncompressed. JSONResponder:
+
+    - serializes with orjson when installed (stdlib json otherwise)
+    - compresses with brotli or gzip, per the request's Accept-Encoding, once
+      the body exceeds RESPONSE_COMPRESS_MIN_BYTES
+    - for cacheable endpoints, tags the response with a weak ETag derived
+      from the corpus version, answers a matching If-None-Match with 304
+      before the payload is even built, and keeps the encoded bodies of the
+      most recent ETags so repeat downloads skip serialization
+
+ETags embed a per-process boot id, so a restart invalidates them once
+rather than risking a stale match.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+_MAX_CACHED_BODIES = 64
+# Changing on every start keeps ETags from a previous process from matching
+BOOT_ID = f"{time.time_ns():x}"
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+    return body
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """br if accepted and available, then gzip, else identity (q=0 refusals honoured)"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name] = quality
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def make_etag(*parts: Any) -> str:
+    """Weak ETag over the boot id and the given version/parameter parts"""
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{BOOT_ID}-{digest}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+class JSONResponder:
+    """Builds encoded JSON responses and counts what serialization and compression cost and saved"""
+
+    def __init__(self):
+        # (etag, accepted encoding) -> (body, applied encoding, uncompressed size)
+        self._bodies: "OrderedDict[Tuple[str, str], Tuple[bytes, str, int]]" = OrderedDict()
+        self.stats = {
+            "responses": 0,
+            "not_modified": 0,
+            "body_cache_hits": 0,
+            "raw_bytes": 0,
+            "sent_bytes": 0,
+            "serialize_ms": 0.0,
+            "compress_ms": 0.0,
+        }
+
+    def _encode(self, payload: Any, encoding: str) -> Tuple[bytes, str, int]:
+        start = time.perf_counter()
+        body = dumps(payload)
+        encoded = time.perf_counter()
+        self.stats["serialize_ms"] += (encoded - start) * 1000
+        raw_size = len(body)
+        # Small bodies are not worth compressing
+        if encoding == "identity" or raw_size < RESPONSE_COMPRESS_MIN_BYTES:
+            return body, "identity", raw_size
+        body = compress(body, encoding)
+        self.stats["compress_ms"] += (time.perf_counter() - encoded) * 1000
+        return body, encoding, raw_size
+
+    def _response(self, encoded: Tuple[bytes, str, int], status_code: int = 200, etag: Optional[str] = None) -> Response:
+        body, encoding, raw_size = encoded
+        headers = {"Vary": "Accept-Encoding"}
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if etag is not None:
+            headers["ETag"] = etag
+            # Cache, but revalidate every time (answered with 304 while the corpus is unchanged)
+            headers["Cache-Control"] = "no-cache"
+        self.stats["responses"] += 1
+        self.stats["raw_bytes"] += raw_size
+        self.stats["sent_bytes"] += len(body)
+        return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+    def respond(self, request: Request, payload: Any, status_code: int = 200) -> Response:
+        """Uncached JSON response (query answers, retrieval contexts)"""
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        return self._response(self._encode(payload, encoding), status_code)
+
+    async def cached(self, request: Request, etag: str, build: Callable[[], Awaitable[Any]]) -> Response:
+        """304 when If-None-Match matches, else the (possibly memoized) encoded payload"""
+        if _etag_matches(request, etag):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"})
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        key = (etag, encoding)
+        encoded = self._bodies.get(key)
+        if encoded is not None:
+            self.stats["body_cache_hits"] += 1
+            self._bodies.move_to_end(key)
+        else:
+            # Megabyte graphs take a few hundred ms to compress; keep that off the event loop
+            encoded = await asyncio.to_thread(self._encode, await build(), encoding)
+            self._bodies[key] = encoded
+            if len(self._bodies) > _MAX_CACHED_BODIES:
+                self._bodies.popitem(last=False)
+        return self._response(encoded, etag=etag)
+
+    def metrics(self) -> Dict[str, Any]:
+        raw, sent = self.stats["raw_bytes"], self.stats["sent_bytes"]
+        return {
+            "serializer": "orjson" if orjson is not None else "json",
+            "encodings": ["br", "gzip"] if brotli is not None else ["gzip"],
+            **self.stats,
+            "serialize_ms": round(self.stats["serialize_ms"], 1),
+            "compress_ms": round(self.stats["compress_ms"], 1),
+            "sent_raw_ratio": round(sent / raw, 3) if raw else 1.0,
+            "cached_bodies": len(self._bodies),
+        }
@@ -0,0 +1,160 @@
+"""
+Local (no LLM) keyword extraction for local/global/hybrid queries
+LightRAG normally asks the LLM for high-level (themes) and low-level
+(entities, specific terms) keywords before retrieval. This extractor builds
+both lists in-process from the graph's entity names and IDF statistics over
+the stored chunks, and hands them to LightRAG via QueryParam.hl_keywords /
+ll_keywords so the keyword round-trip is skipped.
+
+KEYWORD_EXTRACTION selects the strategy:
+    llm   - always let LightRAG call the LLM (default)
+    local - always use the local extractor
+    auto  - local, falling back to the LLM when the query mentions no graph
+            entity and too few terms known to the corpus
+"""
+
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import json_repair
+from lightrag.base import DocStatus
+from lightrag.constants import DEFAULT_SUMMARY_LANGUAGE
+from lightrag.prompt import PROMPTS
+from lightrag.utils import remove_think_tags
+
+from documents import strip_section_header
+
+KEYWORD_EXTRACTION = os.getenv("KEYWORD_EXTRACTION", "llm").lower()
+KEYWORD_MODES = ["llm", "local", "auto"]
+# Minimum number of corpus terms (besides entity matches) for "auto" to trust the local result
+KEYWORD_MIN_TERMS = int(os.getenv("KEYWORD_MIN_TERMS", "2"))
+_MAX_LL = 8
+_MAX_HL = 5
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z'-]+|\d+(?:[._/-]\d+)*")
+# Identifiers such as form numbers (48_2025), clause references or award numbers
+_CODE_RE = re.compile(r"\b(?:\d+[._/-]\d+(?:[._/-]\d+)*|(?:clause|section|article|form|award)\s+(?:no\.?\s*)?\d+[a-z]?)\b", re.IGNORECASE)
+_CAPITALIZED_RE = re.compile(r"\b([A-Z][\w&'.-]*(?:\s+(?:[A-Z][\w&'.-]*|of|and|&|de|du))*\s+[A-Z][\w&'.-]*|[A-Z]{2,}[\w&.-]*)\b")
+
+STOPWORDS = set("""
+a about above after again against all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her here
+hers herself him himself his how i if in into is it its itself just me more most my myself no nor not now of off
+on once only or other our ours ourselves out over own same she should so some such than that the their theirs
+them themselves then there these they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours yourself yourselves tell explain describe give list show
+please know find according regarding say says said mean means document documents text information details detail
+""".split())
+
+
+def _words(text: str) -> List[str]:
+    return [w.lower() for w in _WORD_RE.findall(text)]
+
+
+class LocalKeywordExtractor:
+    """Builds LightRAG hl/ll keyword lists from graph entity names and chunk IDF"""
+
+    def __init__(self, router):
+        # QueryRouter already caches the graph's entity vocabulary
+        self.router = router
+        self._df: Optional[Counter] = None
+        self._num_chunks = 0
+
+    def invalidate(self):
+        """Drop cached corpus statistics (call after documents change)"""
+        self._df = None
+
+    async def _document_frequencies(self, rag) -> Counter:
+        if self._df is None:
+            docs = await rag.doc_status.get_docs_by_status(DocStatus.PROCESSED)
+            chunk_ids = [chunk_id for status in docs.values() for chunk_id in (status.chunks_list or [])]
+            df: Counter = Counter()
+            chunks = await rag.text_chunks.get_by_ids(chunk_ids) if chunk_ids else []
+            for chunk in chunks:
+                if chunk:
+                    df.update(set(_words(strip_section_header(chunk.get("content", "")))))
+            self._df = df
+            self._num_chunks = sum(1 for chunk in chunks if chunk)
+        return self._df
+
+    def _idf(self, word: str) -> float:
+        return math.log((self._num_chunks + 1) / (self._df.get(word, 0) + 1)) + 1.0
+
+    async def extract(self, rag, query: str) -> Dict[str, Any]:
+        """Return {"hl_keywords", "ll_keywords", "entities", "known_terms", "ms"}"""
+        start = time.perf_counter()
+        df = await self._document_frequencies(rag)
+        entities = await self.router.match_entities(rag, query)
+        entity_words = {w for name in entities for w in _words(name)}
+
+        ll: List[str] = list(entities)
+        for match in _CODE_RE.finditer(query):
+            ll.append(match.group(0))
+        for match in _CAPITALIZED_RE.finditer(query):
+            phrase = match.group(1).strip()
+            if phrase.lower() not in STOPWORDS and not set(_words(phrase)) <= entity_words:
+                ll.append(phrase)
+
+        content = [w for w in _words(query) if w not in STOPWORDS and len(w) > 2 and w not in entity_words]
+        known = [w for w in dict.fromkeys(content) if df.get(w)]
+        # Rare corpus terms are specific (low-level); common ones describe themes (high-level)
+        ranked = sorted(known, key=self._idf, reverse=True)
+        median_idf = sorted(self._idf(w) for w in known)[len(known) // 2] if known else 0.0
+        ll.extend(w for w in ranked if self._idf(w) >= median_idf)
+
+        # Adjacent content-word pairs known to the corpus read as topics ("arbitration disputes")
+        hl: List[str] = []
+        words = _words(query)
+        for first, second in zip(words, words[1:]):
+            if first in content and second in content and df.get(first) and df.get(second):
+                hl.append(f"{first} {second}")
+        hl.extend(w for w in sorted(known, key=self._idf) if w not in " ".join(hl).split())
+        if not hl and ll:
+            hl = [entities[0]] if entities else ll[:1]
+
+        return {
+            "hl_keywords": list(dict.fromkeys(hl))[:_MAX_HL],
+            "ll_keywords": list(dict.fromkeys(ll))[:_MAX_LL],
+            "entities": entities,
+            "known_terms": len(known),
+            "ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+
+    async def keywords_for(self, rag, query: str, mode: str, strategy: str = KEYWORD_EXTRACTION) -> Optional[Dict[str, Any]]:
+        """Local keywords for the strategy and query mode, or None to let LightRAG ask the LLM"""
+        if strategy == "llm" or mode not in ("local", "global", "hybrid"):
+            return None
+        try:
+            result = await self.extract(rag, query)
+        except Exception as e:
+            print(f"Warning: Local keyword extraction failed, falling back to LLM: {e}")
+            return None
+        # local mode retrieves by low-level keywords only, global by high-level only
+        if (mode == "local" and not result["ll_keywords"]) or (mode == "global" and not result["hl_keywords"]):
+            return None
+        if not result["ll_keywords"] and not result["hl_keywords"]:
+            return None
+        if strategy == "auto" and not result["entities"] and result["known_terms"] < KEYWORD_MIN_TERMS:
+            return None
+        return result
+
+
+async def llm_keywords(rag, llm_func: Callable, query: str) -> Tuple[List[str], List[str]]:
+    """LightRAG's own LLM keyword extraction (same prompt and parsing), bypassing its cache"""
+    prompt = PROMPTS["keywords_extraction"].format(
+        query=query,
+        examples="\n".join(PROMPTS["keywords_extraction_examples"]),
+        language=rag.addon_params.get("language", DEFAULT_SUMMARY_LANGUAGE),
+    )
+    result = await llm_func(prompt, keyword_extraction=True)
+    try:
+        data = json_repair.loads(remove_think_tags(result or "")) or {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    return data.get("high_level_keywords", []), data.get("low_level_keywords", [])
@@ -0,0 +1,264 @@
+"""
+BM25 lexical index over LightRAG chunks
+Exact strings - clause numbers, form numbers (48_2025), award references,
+company names - are where embedding retrieval is weakest. This keeps an
+inverted index over the same chunks LightRAG stores, updated per document
+on ingest/update/delete, and exposes it to naive-style retrieval:
+
+    lexical - BM25 only; the query is never embedded
+    fusion  - BM25 and vector rankings merged with reciprocal-rank fusion
+    vector  - vector search restricted to metadata-filtered candidates
+
+The index persists only each chunk's term frequencies (bm25_index.json in
+WORKING_DIR); postings are rebuilt in memory on load. Chunk text is read
+back from LightRAG's text_chunks store when results are returned.
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from lightrag.operate import naive_query
+
+from documents import strip_section_header
+from metadata_index import filtered_vector_search
+
+LEXICAL_INDEX_FILE = "bm25_index.json"
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Reciprocal-rank fusion constant: score = sum(1 / (RRF_K + rank))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Identifiers (48_2025, 14-123, 3.2.1, ICC/2019/07) stay whole; their parts are indexed too
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._/-][a-z0-9]+)*")
+_PART_RE = re.compile(r"[._/-]")
+_STOPWORDS = set("""
+a an and are as at be by for from has have in is it its of on or that the this to was were which with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if _PART_RE.search(token):
+            tokens.extend(part for part in _PART_RE.split(token) if part and part not in _STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """Incrementally maintained BM25 index of chunk ids, grouped by external doc_id"""
+
+    def __init__(self, working_dir: str):
+        self.path = os.path.join(working_dir, LEXICAL_INDEX_FILE)
+        self.lock = asyncio.Lock()
+        self._chunks: Dict[str, Dict[str, int]] = {}  # chunk_id -> term -> tf
+        self._docs: Dict[str, List[str]] = {}  # doc_id -> chunk_ids
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> chunk_id -> tf
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self.loaded = False
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self._docs = data.get("docs", {})
+                for chunk_id, terms in data.get("chunks", {}).items():
+                    self._add_chunk(chunk_id, terms)
+                self.loaded = True
+            except Exception as e:
+                print(f"Warning: Could not load BM25 index {self.path}: {e}")
+
+    def _add_chunk(self, chunk_id: str, terms: Dict[str, int]):
+        self._chunks[chunk_id] = terms
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[chunk_id] = tf
+        self._lengths[chunk_id] = sum(terms.values())
+        self._total_length += self._lengths[chunk_id]
+
+    def _drop_chunk(self, chunk_id: str):
+        terms = self._chunks.pop(chunk_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(chunk_id, 0)
+
+    def _referenced(self) -> set:
+        return {chunk_id for chunk_ids in self._docs.values() for chunk_id in chunk_ids}
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"docs": self._docs, "chunks": self._chunks}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def _section_chunks(self, rag, section_ids: Iterable[str]) -> Dict[str, str]:
+        """chunk_id -> text for the given LightRAG section documents"""
+        statuses = await rag.doc_status.get_by_ids(list(section_ids))
+        chunk_ids = [chunk_id for status in statuses if status for chunk_id in (status.get("chunks_list") or [])]
+        chunks = await rag.text_chunks.get_by_ids(chunk_ids) if chunk_ids else []
+        return {chunk_id: strip_section_header(chunk.get("content", "")) for chunk_id, chunk in zip(chunk_ids, chunks) if chunk}
+
+    async def sync_document(self, rag, doc_id: str, section_ids: Iterable[str]) -> Dict[str, int]:
+        """Re-index a document's current chunks; unchanged chunks keep their entries"""
+        chunk_texts = await self._section_chunks(rag, section_ids)
+        async with self.lock:
+            old = set(self._docs.get(doc_id, []))
+            self._docs[doc_id] = list(chunk_texts)
+            added = 0
+            for chunk_id, text in chunk_texts.items():
+                if chunk_id not in self._chunks:
+                    self._add_chunk(chunk_id, dict(Counter(tokenize(text))))
+                    added += 1
+            referenced = self._referenced()
+            removed = [chunk_id for chunk_id in old - set(chunk_texts) if chunk_id not in referenced]
+            for chunk_id in removed:
+                self._drop_chunk(chunk_id)
+            self.save()
+        return {"chunks": len(chunk_texts), "added": added, "removed": len(removed)}
+
+    async def remove_document(self, doc_id: str):
+        async with self.lock:
+            old = self._docs.pop(doc_id, None)
+            if old is None:
+                return
+            referenced = self._referenced()
+            for chunk_id in old:
+                if chunk_id not in referenced:
+                    self._drop_chunk(chunk_id)
+            self.save()
+
+    async def ensure_built(self, rag, manifest):
+        """Build the index from the document manifest the first time (existing deployments)"""
+        if self.loaded:
+            return
+        self.loaded = True
+        start = time.perf_counter()
+        missing = [(doc_id, entry) for doc_id, entry in manifest.items() if doc_id not in self._docs]
+        for doc_id, entry in missing:
+            await self.sync_document(rag, doc_id, entry["sections"])
+        if missing:
+            print(f"✓ BM25 index built for {len(missing)} existing documents in {time.perf_counter() - start:.1f}s")
+
+    def search(self, query: str, top_k: int, candidates: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Top chunk ids by BM25 score, optionally only among candidate chunk ids"""
+        if not self._chunks:
+            return []
+        n = len(self._chunks)
+        avg_length = self._total_length / n or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                if candidates is not None and chunk_id not in candidates:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "documents": len(self._docs),
+            "chunks": len(self._chunks),
+            "terms": len(self._postings),
+            "avg_chunk_terms": round(self._total_length / len(self._chunks), 1) if self._chunks else 0,
+        }
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class ChunkStore:
+    """
+    Stand-in for LightRAG's chunks_vdb in naive_query. query() answers from
+    the BM25 index (lexical), BM25 fused with vector search (fusion) or vector
+    search alone (vector), optionally restricted to candidate chunk ids from
+    metadata filters.
+    """
+
+    STRATEGIES = ["lexical", "fusion", "vector"]
+
+    def __init__(self, index: BM25Index, rag, strategy: str = "lexical", candidates: Optional[Set[str]] = None, chunks_vdb=None):
+        self.index = index
+        self.rag = rag
+        self.strategy = strategy
+        self.candidates = candidates
+        # /query/batch passes a stand-in whose searches were run for the whole batch at once
+        self.chunks_vdb = chunks_vdb or rag.chunks_vdb
+        self.cosine_better_than_threshold = self.chunks_vdb.cosine_better_than_threshold
+        self.last_ranking: List[Dict[str, Any]] = []
+
+    async def _vector_hits(self, query: str, top_k: int, query_embedding) -> List[Dict[str, Any]]:
+        if self.candidates is None:
+            return await self.chunks_vdb.query(query, top_k=top_k, query_embedding=query_embedding)
+        return await filtered_vector_search(self.chunks_vdb, query, self.candidates, top_k, query_embedding)
+
+    async def query(self, query: str, top_k: int, query_embedding=None) -> List[Dict[str, Any]]:
+        pool_size = top_k * 2 if self.strategy == "fusion" else top_k
+        lexical = self.index.search(query, pool_size, self.candidates) if self.strategy != "vector" else []
+        bm25 = dict(lexical)
+        vector: Dict[str, Dict[str, Any]] = {}
+        if self.strategy != "lexical":
+            for hit in await self._vector_hits(query, pool_size, query_embedding):
+                vector[hit["id"]] = hit
+        if self.strategy == "fusion":
+            ranked = reciprocal_rank_fusion([[chunk_id for chunk_id, _ in lexical], list(vector)])[:top_k]
+        elif self.strategy == "vector":
+            ranked = [(chunk_id, hit.get("distance", 0.0)) for chunk_id, hit in vector.items()]
+        else:
+            ranked = lexical
+
+        missing = [chunk_id for chunk_id, _ in ranked if chunk_id not in vector]
+        stored = dict(zip(missing, await self.rag.text_chunks.get_by_ids(missing))) if missing else {}
+        results = []
+        self.last_ranking = []
+        for chunk_id, score in ranked:
+            hit = vector.get(chunk_id)
+            if hit is None:
+                chunk = stored.get(chunk_id)
+                if not chunk:
+                    continue
+                hit = {
+                    "id": chunk_id,
+                    "content": chunk.get("content", ""),
+                    "file_path": chunk.get("file_path", "unknown_source"),
+                    "created_at": chunk.get("create_time"),
+                }
+            results.append(hit)
+            self.last_ranking.append({
+                "chunk_id": chunk_id,
+                "score": round(score, 5),
+                "bm25": round(bm25[chunk_id], 4) if chunk_id in bm25 else None,
+                "vector": chunk_id in vector,
+            })
+        return results
+
+
+async def chunk_query(rag, store: ChunkStore, query: str, param, global_config: Dict[str, Any]):
+    """LightRAG's naive_query (same prompt and token budget) over a lexical/fusion/filtered store"""
+    # The mode names the LLM cache namespace, so lexical/fusion answers never collide with vector-only ones.
+    # Filtered answers depend on the filters, which the cache key does not cover, so they are not cached.
+    param.mode = store.strategy
+    hashing_kv = rag.llm_response_cache if store.candidates is None else None
+    return await naive_query(query, store, param, global_config, hashing_kv=hashing_kv, system_prompt=None)
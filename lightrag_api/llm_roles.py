@@ -0,0 +1,261 @@
+"""
+Per-role LLM routing
+LightRAG sends every call (entity extraction, keyword extraction, description
+summarization, answer generation) through one llm_model_func. This module
+classifies each call by role from its arguments and prompt, and dispatches it
+to that role's own endpoint, model, context size and concurrency limit, so
+ingestion can run on a small fast model while answers stay on the big one.
+
+Configuration (each falls back to the global LLM_* setting):
+    LLM_<ROLE>_BINDING, LLM_<ROLE>_HOST, LLM_<ROLE>_MODEL,
+    LLM_<ROLE>_NUM_CTX, LLM_<ROLE>_MAX_ASYNC, LLM_<ROLE>_MAX_OUTPUT
+with ROLE in EXTRACT, KEYWORDS, SUMMARY, ANSWER. Hosts may be comma-separated
+lists; roles with the same binding and hosts share one balanced backend pool.
+
+Every call is sized from its tokenized prompt: the output limit is the
+role's MAX_OUTPUT (shrunk if the prompt leaves less room), and the context
+window sent to Ollama is the smallest power-of-two bucket that fits prompt
+plus output, capped at the role's NUM_CTX. Buckets keep the number of
+distinct KV-cache sizes (and Ollama model reloads) small.
+
+With a scheduler attached, every call takes a slot from it by traffic class
+(scheduler.py), and the scheduler also enforces the role's MAX_ASYNC, so a
+call waiting for its role never holds a slot: keyword and answer calls
+default to interactive, extraction and summaries to ingest. Without one,
+each role's semaphore is the only limit.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from lightrag.prompt import PROMPTS
+
+from backend_pool import BackendPool, parse_hosts
+from chunk_dedup import extract_input_text
+from scheduler import PriorityScheduler, current_traffic_class
+
+LLM_ROLES = ["extract", "keywords", "summary", "answer"]
+
+_ROLE_DEFAULT_NUM_CTX = {"extract": 16384, "keywords": 4096, "summary": 8192, "answer": 16384}
+_ROLE_DEFAULT_MAX_ASYNC = {"extract": 4, "keywords": 4, "summary": 2, "answer": 4}
+_ROLE_DEFAULT_MAX_OUTPUT = {"extract": 4096, "keywords": 512, "summary": 1200, "answer": 4096}
+# Traffic class of calls that arrive without one
+_ROLE_TRAFFIC_CLASS = {"extract": "ingest", "keywords": "interactive", "summary": "ingest", "answer": "interactive"}
+
+# Smallest context bucket and headroom for chat-template tokens around the messages
+_MIN_NUM_CTX = 2048
+_CTX_MARGIN = 256
+# Never shrink the output limit below this to squeeze an oversized prompt in
+_MIN_OUTPUT = 256
+
+
+def _static_head(template: Optional[str]) -> str:
+    """Leading static text of a prompt template (up to its first placeholder)"""
+    if not template:
+        return ""
+    head = template.split("{", 1)[0].strip()
+    return head[:200]
+
+
+_SUMMARY_HEAD = _static_head(PROMPTS.get("summarize_entity_descriptions"))
+
+
+def classify_role(prompt: str, history_messages: Optional[List] = None, keyword_extraction: bool = False) -> str:
+    """Infer which LightRAG stage issued an LLM call"""
+    if keyword_extraction:
+        return "keywords"
+    if extract_input_text(prompt) is not None:
+        return "extract"
+    if history_messages and extract_input_text(history_messages[0].get("content", "")) is not None:
+        # Gleaning pass after an extraction
+        return "extract"
+    if _SUMMARY_HEAD and prompt.lstrip().startswith(_SUMMARY_HEAD):
+        return "summary"
+    return "answer"
+
+
+class RoleConfig:
+    def __init__(self, role: str, binding: str, host: str, model: str, pool_for: Callable[[str, List[str]], BackendPool]):
+        prefix = f"LLM_{role.upper()}_"
+        self.role = role
+        self.binding = os.getenv(prefix + "BINDING", binding).lower()
+        self.hosts = parse_hosts(os.getenv(prefix + "HOST", host))
+        self.pool = pool_for(self.binding, self.hosts)
+        self.model = os.getenv(prefix + "MODEL", model)
+        self.num_ctx = int(os.getenv(prefix + "NUM_CTX", str(_ROLE_DEFAULT_NUM_CTX[role])))
+        self.max_async = int(os.getenv(prefix + "MAX_ASYNC", str(_ROLE_DEFAULT_MAX_ASYNC[role])))
+        self.max_output = int(os.getenv(prefix + "MAX_OUTPUT", str(_ROLE_DEFAULT_MAX_OUTPUT[role])))
+        self.semaphore = asyncio.Semaphore(self.max_async)
+        self.stats = {
+            "calls": 0, "errors": 0, "in_flight": 0, "total_ms": 0.0, "max_ms": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0, "max_prompt_tokens": 0, "truncated_output": 0,
+        }
+        self.num_ctx_used: Dict[int, int] = {}
+
+    def size_call(self, prompt_tokens: int, requested_output: Optional[int] = None) -> Dict[str, int]:
+        """Output limit and context window for a call with this many prompt tokens"""
+        max_output = min(self.max_output, requested_output or self.max_output)
+        needed = prompt_tokens + max_output + _CTX_MARGIN
+        num_ctx = _MIN_NUM_CTX
+        while num_ctx < needed and num_ctx < self.num_ctx:
+            num_ctx *= 2
+        num_ctx = min(num_ctx, self.num_ctx)
+        if needed > num_ctx:
+            max_output = max(num_ctx - prompt_tokens - _CTX_MARGIN, _MIN_OUTPUT)
+            self.stats["truncated_output"] += 1
+            if prompt_tokens + _MIN_OUTPUT + _CTX_MARGIN > num_ctx:
+                print(f"Warning: {self.role} prompt of {prompt_tokens} tokens exceeds num_ctx {num_ctx}; the backend will truncate it")
+        return {"max_tokens": max_output, "num_ctx": num_ctx}
+
+    @property
+    def context_budget(self) -> int:
+        """Tokens left for the prompt once the output limit is reserved"""
+        return self.num_ctx - self.max_output - _CTX_MARGIN
+
+    def describe(self) -> Dict[str, Any]:
+        calls = self.stats["calls"]
+        return {
+            "binding": self.binding,
+            "hosts": self.hosts,
+            "model": self.model,
+            "num_ctx": self.num_ctx,
+            "max_async": self.max_async,
+            "max_output": self.max_output,
+            "calls": calls,
+            "errors": self.stats["errors"],
+            "in_flight": self.stats["in_flight"],
+            "avg_ms": round(self.stats["total_ms"] / calls, 1) if calls else 0.0,
+            "max_ms": round(self.stats["max_ms"], 1),
+            "prompt_tokens": self.stats["prompt_tokens"],
+            "completion_tokens": self.stats["completion_tokens"],
+            "avg_prompt_tokens": round(self.stats["prompt_tokens"] / calls) if calls else 0,
+            "max_prompt_tokens": self.stats["max_prompt_tokens"],
+            "truncated_output": self.stats["truncated_output"],
+            "num_ctx_used": dict(sorted(self.num_ctx_used.items())),
+        }
+
+
+class TokenUsage:
+    """Per-request accumulator of LLM calls and token counts (passed as llm_usage=...)"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.by_role: Dict[str, Dict[str, int]] = {}
+
+    def add(self, role: str, prompt_tokens: int, completion_tokens: int, num_ctx: int, max_tokens: int):
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        entry = self.by_role.setdefault(role, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        entry["calls"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+        entry["num_ctx"] = max(entry.get("num_ctx", 0), num_ctx)
+        entry["max_tokens"] = max(entry.get("max_tokens", 0), max_tokens)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "llm_calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "by_role": self.by_role,
+        }
+
+
+class LLMRoleRouter:
+    """Dispatches LightRAG LLM calls to per-role backends"""
+
+    def __init__(self, binding_funcs: Dict[str, Callable], binding: str, host: str, model: str, pool_for: Callable[[str, List[str]], BackendPool]):
+        self.binding_funcs = binding_funcs
+        self.roles = {role: RoleConfig(role, binding, host, model, pool_for) for role in LLM_ROLES}
+        # Set to LightRAG's tokenizer once it exists; until then tokens are estimated from characters
+        self.tokenizer = None
+        # Shared-GPU slots by traffic class; None = only the per-role limits apply
+        self.scheduler: Optional[PriorityScheduler] = None
+
+    def count_tokens(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            try:
+                return len(self.tokenizer.encode(text))
+            except Exception:
+                pass
+        return len(text) // 4 + 1
+
+    @property
+    def total_max_async(self) -> int:
+        return sum(config.max_async for config in self.roles.values())
+
+    @property
+    def role_limits(self) -> Dict[str, int]:
+        return {role: config.max_async for role, config in self.roles.items()}
+
+    def model_for(self, role: str) -> str:
+        return self.roles[role].model
+
+    def metrics(self) -> Dict[str, Any]:
+        return {role: config.describe() for role, config in self.roles.items()}
+
+    def _slot(self, traffic_class: str, config: RoleConfig):
+        if self.scheduler is None:
+            return config.semaphore
+        return self.scheduler.slot(traffic_class, group=config.role)
+
+    async def dispatch(self, prompt: str, system_prompt: Optional[str] = None, history_messages: List = [], keyword_extraction: bool = False, **kwargs) -> str:
+        role = kwargs.pop("llm_role", None) or classify_role(prompt, history_messages, keyword_extraction)
+        usage_sink: Optional[TokenUsage] = kwargs.pop("llm_usage", None)
+        traffic_class = kwargs.pop("traffic_class", None) or current_traffic_class() or _ROLE_TRAFFIC_CLASS[role]
+        config = self.roles[role]
+        func = self.binding_funcs.get(config.binding)
+        if func is None:
+            raise ValueError(f"Unknown LLM binding for role {role}: {config.binding}")
+
+        prompt_tokens = self.count_tokens(system_prompt or "") + self.count_tokens(prompt) + sum(
+            self.count_tokens(message.get("content", "")) for message in history_messages
+        )
+        sizing = config.size_call(prompt_tokens, kwargs.pop("max_tokens", None))
+        config.num_ctx_used[sizing["num_ctx"]] = config.num_ctx_used.get(sizing["num_ctx"], 0) + 1
+        usage: Dict[str, int] = {}
+
+        async with self._slot(traffic_class, config):
+            config.stats["in_flight"] += 1
+            start = time.perf_counter()
+            result = ""
+            try:
+                result = await func(
+                    prompt,
+                    system_prompt=system_prompt,
+                    history_messages=history_messages,
+                    keyword_extraction=keyword_extraction,
+                    pool=config.pool,
+                    model=config.model,
+                    num_ctx=sizing["num_ctx"],
+                    max_tokens=sizing["max_tokens"],
+                    usage=usage,
+                    **kwargs,
+                )
+                if not result:
+                    config.stats["errors"] += 1
+                return result
+            except Exception:
+                config.stats["errors"] += 1
+                raise
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                config.stats["in_flight"] -= 1
+                config.stats["calls"] += 1
+                config.stats["total_ms"] += elapsed_ms
+                config.stats["max_ms"] = max(config.stats["max_ms"], elapsed_ms)
+                # Prefer the backend's own counts; fall back to the local tokenizer
+                used_prompt = usage.get("prompt_tokens") or prompt_tokens
+                used_completion = usage.get("completion_tokens") or (self.count_tokens(result) if isinstance(result, str) else 0)
+                config.stats["prompt_tokens"] += used_prompt
+                config.stats["completion_tokens"] += used_completion
+                config.stats["max_prompt_tokens"] = max(config.stats["max_prompt_tokens"], used_prompt)
+                if usage_sink is not None:
+                    usage_sink.add(role, used_prompt, used_completion, sizing["num_ctx"], sizing["max_tokens"])
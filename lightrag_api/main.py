@@ -9,19 +9,49 @@ Provides endpoints for document ingestion and graph-based queries
 import nest_asyncio
 nest_asyncio.apply()
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
+import time
 import asyncio
+import io
+import hmac
+from functools import partial
+from dataclasses import asdict
 from lightrag import LightRAG, QueryParam
 from lightrag.utils import EmbeddingFunc
+from lightrag.constants import GRAPH_FIELD_SEP
+from lightrag.prompt import PROMPTS
+from lightrag.operate import kg_query, naive_query
 import httpx
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, AsyncIterator, List
 import json
 import numpy as np
+from documents import DocumentUpdateError, sync_document, sync_document_stream, delete_document
+from upload_stream import INGEST_MAX_BYTES, UploadMeter, content_kind, pdf_chunks, text_chunks
+from chunk_dedup import ChunkDeduplicator, carry_counts
+from extraction_cache import ExtractionCache
+from embedding_batcher import EMBEDDING_MAX_ASYNC, EmbeddingBatcher
+from wal_storage import STORAGE_WAL, wal_registry
+from lexical_index import ChunkStore, chunk_query
+from graph_layout import VIEW_LEVELS
+from metadata_index import DOC_TYPES, doc_metadata
+from keyword_extractor import KEYWORD_EXTRACTION, KEYWORD_MODES, llm_keywords
+from workspaces import Workspace, WorkspaceError, WorkspaceManager
+from json_responses import JSONResponder, dumps, make_etag
+from batch_query import BatchRetrieval
+from snapshots import SnapshotError, SnapshotStore
+from profiling import MemoryTracer, Profiler, ProfilingError, format_task_dump, task_dump
+from llm_roles import LLMRoleRouter, TokenUsage
+from scheduler import (
+    SCHEDULER_EMBEDDING_RESERVED, SCHEDULER_EMBEDDING_SLOTS, SCHEDULER_LLM_RESERVED, SCHEDULER_LLM_SLOTS,
+    PriorityScheduler, tag_traffic_class, use_traffic_class,
+)
+from backend_pool import BACKEND_CONNECT_TIMEOUT, BackendPool, BackendRegistry, BackendUnavailableError, parse_hosts
+from defaulters import is_defaulters_doc, extract_company_query, format_answer as format_defaulters_answer
 
 # Try to import built-in Ollama functions
 try:
@@ -45,6 +75,7 @@ app.add_middleware(
 # Environment variables
 
 # Environment variables - Support for both Ollama and OpenAI bindings
+# *_BINDING_HOST may be a comma-separated list of hosts to balance across
 LLM_BINDING = os.getenv("LLM_BINDING", "ollama")
 LLM_BINDING_HOST = os.getenv("LLM_BINDING_HOST", os.getenv("OLLAMA_BASE_URL", "http://ollama:11434"))
 LLM_MODEL = os.getenv("LLM_MODEL", "llama3.3:70b")
@@ -54,16 +85,60 @@ EMBEDDING_BINDING_HOST = os.getenv("EMBEDDING_BINDING_HOST", os.getenv("OLLAMA_B
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "bge-m3")
 
 LIGHTRAG_API_KEY = os.getenv("LIGHTRAG_API_KEY", "")
+# Shared secret for the /debug endpoints (sent as X-Debug-Token); unset = endpoints disabled
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+CONTEXT_BATCH_CONCURRENCY = int(os.getenv("CONTEXT_BATCH_CONCURRENCY", "8"))
+# /query/batch: answers generated at once, and questions accepted per request
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "8"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "1000"))
 WORKING_DIR = os.getenv("WORKING_DIR", "/data/rag_storage")
+# Named workspaces (/workspaces/{name}/...) each keep their corpus in WORKSPACES_DIR/<name>
+WORKSPACES_DIR = os.getenv("WORKSPACES_DIR", os.path.join(WORKING_DIR, "workspaces"))
 MAX_TOKENS = int(os.getenv("MAX_TOKENS", "32000"))
+# Token budget for retrieved context in a query prompt (0 = what the answer role's num_ctx leaves after its output limit)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
 
 os.makedirs(WORKING_DIR, exist_ok=True)
 
+# MinHash/LSH index that lets near-duplicate chunks reuse prior extraction results
+chunk_dedup = ChunkDeduplicator(WORKING_DIR)
+
+# Durable extraction results keyed by chunk hash/model/prompt version (kept outside WORKING_DIR so rebuilds replay from disk)
+extraction_cache = ExtractionCache()
+
+# Balanced, health-checked pools of inference hosts (one per binding + host list)
+backend_pools = BackendRegistry()
+
+
+def _auth_headers() -> Dict[str, str]:
+    return {"Authorization": f"Bearer {LIGHTRAG_API_KEY}"} if LIGHTRAG_API_KEY else {}
+
+def _openai_url(host: str, path: str) -> str:
+    """Endpoint URL for an OpenAI-compatible host that may already include an endpoint path"""
+    for suffix in ("/chat/completions", "/embeddings", "/models"):
+        if host.endswith(suffix):
+            host = host[:-len(suffix)]
+    return f"{host}{path}"
+
+async def _probe_openai(client: httpx.AsyncClient, host: str) -> bool:
+    response = await client.get(_openai_url(host, "/models"), headers=_auth_headers())
+    return response.status_code == 200
+
+async def _probe_ollama(client: httpx.AsyncClient, host: str) -> bool:
+    response = await client.get(f"{host}/api/tags")
+    return response.status_code == 200
+
+def _backend_pool(binding: str, hosts: List[str]) -> BackendPool:
+    probe = _probe_openai if binding.lower() == "openai" else _probe_ollama
+    return backend_pools.get(binding.lower(), hosts, probe)
+
+embedding_pool = _backend_pool(EMBEDDING_BINDING, parse_hosts(EMBEDDING_BINDING_HOST))
+
 
 # Custom embedding function
 
 async def _ollama_embedding_func_custom(texts: List[str]) -> List:
-    async with httpx.AsyncClient(timeout=300.0) as client:
+    async with httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=BACKEND_CONNECT_TIMEOUT)) as client:
         embeddings = []
         max_retries = 3
         retry_delay = 1.0  # seconds
@@ -74,12 +149,14 @@ async def _ollama_embedding_func_custom(texts: List[str]) -> List:
             
             for attempt in range(max_retries):
                 try:
-                    response = await client.post(
-                        f"{OLLAMA_BASE_URL}/api/embeddings",
-                        json={"model": EMBEDDING_MODEL, "prompt": text}
-                    )
-                    response.raise_for_status()
-                    result = response.json()
+                    async def _request(host: str):
+                        response = await client.post(
+                            f"{host}/api/embeddings",
+                            json={"model": EMBEDDING_MODEL, "prompt": text}
+                        )
+                        response.raise_for_status()
+                        return response.json()
+                    result = await embedding_pool.run(_request)
                     embedding = result.get("embedding", [])
                     if embedding and len(embedding) > 0:
                         embeddings.append(np.array(embedding, dtype=np.float32))
@@ -87,6 +164,8 @@ async def _ollama_embedding_func_custom(texts: List[str]) -> List:
                         break
                     else:
                         last_error = "Empty embedding returned"
+                except BackendUnavailableError:
+                    raise
                 except httpx.HTTPStatusError as e:
                     last_error = f"HTTP {e.response.status_code}: {e.response.text[:100]}"
                     if e.response.status_code >= 500 and attempt < max_retries - 1:
@@ -123,31 +202,45 @@ async def _ollama_llm_async_custom(
     **kwargs
 ) -> str:
     hashing_kv = kwargs.pop("hashing_kv", None)
+    pool = kwargs.get("pool") or _backend_pool("ollama", parse_hosts(LLM_BINDING_HOST))
+    model = kwargs.get("model") or LLM_MODEL
+    num_ctx = kwargs.get("num_ctx") or 16384
+    max_tokens = min(kwargs.get("max_tokens") or MAX_TOKENS, MAX_TOKENS)
+    usage = kwargs.get("usage")
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
     
-    try:
-        async with httpx.AsyncClient(timeout=180.0) as client:  # Reduced timeout from 300s to 180s (3 min)
+    async def _request(host: str):
+        # Reduced timeout from 300s to 180s (3 min); dead hosts fail at connect time
+        async with httpx.AsyncClient(timeout=httpx.Timeout(180.0, connect=BACKEND_CONNECT_TIMEOUT)) as client:
             response = await client.post(
-                f"{OLLAMA_BASE_URL}/api/chat",
+                f"{host}/api/chat",
                 json={
-                    "model": LLM_MODEL,
+                    "model": model,
                     "messages": messages,
                     "stream": False,
                     "options": {
-                        "num_ctx": 16384,  # Reduced from 32768 to 16384 for faster processing (still large enough)
+                        "num_ctx": num_ctx,  # Sized per call from the prompt length (capped at the role's LLM_<ROLE>_NUM_CTX)
+                        "num_predict": max_tokens,
                         "temperature": 0.7,  # Add temperature for consistency
                         "top_p": 0.9,  # Nucleus sampling
                     }
                 }
             )
             response.raise_for_status()
-            result = response.json()  # NOT awaitable - synchronous call
-            content = result.get("message", {}).get("content", "")
-            return content if content else ""
+            return response.json()  # NOT awaitable - synchronous call
+
+    try:
+        result = await pool.run(_request)
+        if usage is not None:
+            usage.update(prompt_tokens=result.get("prompt_eval_count", 0), completion_tokens=result.get("eval_count", 0))
+        content = result.get("message", {}).get("content", "")
+        return content if content else ""
+    except BackendUnavailableError:
+        raise
     except Exception as e:
         print(f"Error in LLM call: {e}")
         import traceback
@@ -163,33 +256,44 @@ async def _openai_llm_async_custom(
     keyword_extraction: bool = False,
     **kwargs
 ) -> str:
+    pool = kwargs.get("pool") or _backend_pool("openai", parse_hosts(LLM_BINDING_HOST))
+    model = kwargs.get("model") or LLM_MODEL
+    # Right-sized per call by llm_roles; MAX_TOKENS is the upper bound
+    max_tokens = min(kwargs.get("max_tokens") or MAX_TOKENS, MAX_TOKENS)
+    usage = kwargs.get("usage")
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
 
-    try:
-        headers = {"Authorization": f"Bearer {LIGHTRAG_API_KEY}"} if LIGHTRAG_API_KEY else {}
-        async with httpx.AsyncClient(timeout=180.0) as client:
+    async def _request(host: str):
+        async with httpx.AsyncClient(timeout=httpx.Timeout(180.0, connect=BACKEND_CONNECT_TIMEOUT)) as client:
             response = await client.post(
-                f"{LLM_BINDING_HOST}/chat/completions" if not LLM_BINDING_HOST.endswith("/chat/completions") else LLM_BINDING_HOST,
-                headers=headers,
+                _openai_url(host, "/chat/completions"),
+                headers=_auth_headers(),
                 json={
-                    "model": LLM_MODEL,
+                    "model": model,
                     "messages": messages,
                     "stream": False,
-                    "max_tokens": MAX_TOKENS,
+                    "max_tokens": max_tokens,
                     "temperature": kwargs.get("temperature", 0.7),
                     "top_p": kwargs.get("top_p", 0.9),
                 }
             )
             response.raise_for_status()
-            result = response.json()
-            choices = result.get("choices", [])
-            if choices:
-                return choices[0].get("message", {}).get("content", "")
-            return ""
+            return response.json()
+
+    try:
+        result = await pool.run(_request)
+        if usage is not None:
+            usage.update({k: v for k, v in (result.get("usage") or {}).items() if k in ("prompt_tokens", "completion_tokens")})
+        choices = result.get("choices", [])
+        if choices:
+            return choices[0].get("message", {}).get("content", "")
+        return ""
+    except BackendUnavailableError:
+        raise
     except Exception as e:
         print(f"Error in OpenAI LLM call: {e}")
         import traceback
@@ -198,27 +302,28 @@ async def _openai_llm_async_custom(
 
 # OpenAI-compatible Embedding function
 async def _openai_embedding_func_custom(texts: List[str]) -> List[np.ndarray]:
-    headers = {"Authorization": f"Bearer {LIGHTRAG_API_KEY}"} if LIGHTRAG_API_KEY else {}
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        try:
-            # Check if using Azure or standard OpenAI format
-            # Standard: /embeddings
-            url = f"{EMBEDDING_BINDING_HOST}/embeddings" if not EMBEDDING_BINDING_HOST.endswith("/embeddings") else EMBEDDING_BINDING_HOST
-            
+    async with httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=BACKEND_CONNECT_TIMEOUT)) as client:
+        async def _request(host: str):
+            # Standard OpenAI format (/embeddings); the host may already include the endpoint path
             response = await client.post(
-                url,
-                headers=headers,
+                _openai_url(host, "/embeddings"),
+                headers=_auth_headers(),
                 json={
                     "model": EMBEDDING_MODEL,
                     "input": texts
                 }
             )
             response.raise_for_status()
-            result = response.json()
+            return response.json()
+
+        try:
+            result = await embedding_pool.run(_request)
             data = result.get("data", [])
             # Sort by index to ensure order matches input
             data.sort(key=lambda x: x.get("index", 0))
             return np.array([item["embedding"] for item in data], dtype=np.float32)
+        except BackendUnavailableError:
+            raise
         except Exception as e:
             print(f"Error in OpenAI Embedding call: {e}")
             # Fallback to zeros if everything fails
@@ -226,30 +331,94 @@ async def _openai_embedding_func_custom(texts: List[str]) -> List[np.ndarray]:
 
 # Use custom functions (built-in may not work with HTTP endpoints in Docker)
 # Select functions based on binding
+# Each LLM role (extract/keywords/summary/answer) can use its own binding, host, model and concurrency
+llm_roles = LLMRoleRouter(
+    {"openai": _openai_llm_async_custom, "ollama": _ollama_llm_async_custom},
+    binding=LLM_BINDING, host=LLM_BINDING_HOST, model=LLM_MODEL, pool_for=_backend_pool,
+)
+llm_func = chunk_dedup.wrap(extraction_cache.wrap(llm_roles.dispatch, lambda: llm_roles.model_for("extract")))
 if LLM_BINDING.lower() == "openai":
-    llm_func = _openai_llm_async_custom
     print(f"Using OpenAI-compatible LLM binding: {LLM_BINDING_HOST} ({LLM_MODEL})")
 else:
-    llm_func = _ollama_llm_async_custom
     print(f"Using Ollama LLM binding: {LLM_BINDING_HOST} ({LLM_MODEL})")
+for role, role_config in llm_roles.metrics().items():
+    print(f"  LLM role {role}: {role_config['binding']} {','.join(role_config['hosts'])} ({role_config['model']}, num_ctx={role_config['num_ctx']}, max_async={role_config['max_async']})")
+
+# Interactive queries, ingestion and maintenance jobs share the GPU: slots are granted by weighted
+# fair queuing across the three classes, with SCHEDULER_*_RESERVED slots kept for interactive calls.
+# The LLM scheduler also enforces each role's MAX_ASYNC, so a call waiting on its role holds no slot.
+llm_roles.scheduler = PriorityScheduler("llm", SCHEDULER_LLM_SLOTS or llm_roles.total_max_async, SCHEDULER_LLM_RESERVED, limits=llm_roles.role_limits)
+if llm_roles.scheduler.slots >= llm_roles.total_max_async:
+    print(f"Warning: SCHEDULER_LLM_SLOTS ({llm_roles.scheduler.slots}) >= the roles' combined MAX_ASYNC ({llm_roles.total_max_async}); "
+          "LLM calls are never queued by traffic class. Set it to the GPU's parallelism (OLLAMA_NUM_PARALLEL)")
+embedding_scheduler = PriorityScheduler("embedding", SCHEDULER_EMBEDDING_SLOTS or EMBEDDING_MAX_ASYNC, SCHEDULER_EMBEDDING_RESERVED)
+for scheduler in (llm_roles.scheduler, embedding_scheduler):
+    print(f"  Scheduler {scheduler.name}: {scheduler.slots} slots, {scheduler.reserved} reserved for interactive, weights {scheduler.weights}")
+
+# Concurrent embedding calls within EMBEDDING_BATCH_WINDOW_MS go to the backend as one request.
+# Ollama's /api/embeddings takes one prompt per request, so batching is off by default there.
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5" if EMBEDDING_BINDING.lower() == "openai" else "0"))
 
 if EMBEDDING_BINDING.lower() == "openai":
+    embedding_batcher = EmbeddingBatcher(_openai_embedding_func_custom, EMBEDDING_BATCH_WINDOW_MS, scheduler=embedding_scheduler)
     embedding_func = EmbeddingFunc(
-        func=_openai_embedding_func_custom,
+        func=embedding_batcher,
         embedding_dim=768, # Common for noms/bert, but adjust if needed
         max_token_size=8192
     )
     print(f"Using OpenAI-compatible Embedding binding: {EMBEDDING_BINDING_HOST} ({EMBEDDING_MODEL})")
 else:
+    embedding_batcher = EmbeddingBatcher(_ollama_embedding_func_custom, EMBEDDING_BATCH_WINDOW_MS, scheduler=embedding_scheduler)
     embedding_func = EmbeddingFunc(
-        func=_ollama_embedding_func_custom,
+        func=embedding_batcher,
         embedding_dim=1024,
         max_token_size=8192
     )
     print(f"Using Ollama Embedding binding: {EMBEDDING_BINDING_HOST} ({EMBEDDING_MODEL})")
+if embedding_batcher.enabled:
+    print(f"  Embedding micro-batching: {EMBEDDING_BATCH_WINDOW_MS:g} ms window, up to {embedding_batcher.max_texts} texts, {embedding_batcher.max_async} concurrent requests")
 
 
-lightrag = None
+def _create_lightrag(working_dir: str, workspace: str) -> LightRAG:
+    """A LightRAG instance for one workspace; all instances share the LLM and embedding backends"""
+    try:
+        rag = LightRAG(
+            working_dir=working_dir,
+            workspace=workspace,
+            llm_model_func=llm_func,
+            llm_model_name=llm_roles.model_for("extract"),
+            # llm_roles' scheduler enforces the real per-role limits
+            llm_model_max_async=llm_roles.total_max_async,
+            embedding_func=embedding_func,
+            default_embedding_timeout=300,
+            # The batcher limits backend concurrency; admit enough callers for batches to fill
+            embedding_func_max_async=embedding_batcher.max_callers,
+            # Write-ahead-logged JSON/GraphML storage (STORAGE_WAL)
+            **wal_registry.storage_classes(),
+        )
+        llm_roles.tokenizer = rag.tokenizer
+        # LightRAG's worker queues drop the request's context; tag each call with its traffic class
+        # (and the ingest's dedup counters) on the way in
+        rag.llm_model_func = tag_traffic_class(carry_counts(rag.llm_model_func))
+        rag.embedding_func.func = tag_traffic_class(rag.embedding_func.func)
+        print(f"✓ LightRAG instance created for workspace {workspace or 'default'} with increased embedding timeout (300s)")
+        return rag
+    except Exception as e:
+        import traceback
+        print(f"✗ LightRAG initialization error:\n{traceback.format_exc()}")
+        raise
+
+# One LightRAG instance plus side indexes (document manifest, BM25, metadata, graph layout,
+# defaulters table, query router, keyword extractor) per corpus; WORKING_DIR is the default workspace
+workspaces = WorkspaceManager(WORKSPACES_DIR, WORKING_DIR, _create_lightrag, embed=embedding_func)
+# orjson + gzip/brotli for large payloads; graph endpoints answer If-None-Match with 304 until the corpus changes
+responder = JSONResponder()
+# On-demand CPU profiles and tracemalloc snapshots for /debug (nothing runs until requested)
+profiler = Profiler()
+memory_tracer = MemoryTracer()
+# Content-addressed, incremental snapshots of workspace storage under SNAPSHOT_DIR
+snapshots = SnapshotStore()
+
 print(f"LightRAG will be initialized on first request.")
 print(f"  Binding: {LLM_BINDING}, URL: {LLM_BINDING_HOST}, Model: {LLM_MODEL}")
 
@@ -257,6 +426,17 @@ class IngestRequest(BaseModel):
     text: str
     doc_id: str
 
+class DocumentUpdateRequest(BaseModel):
+    text: str
+
+class QueryFilters(BaseModel):
+    # Each list matches any of its values; all given filters must match
+    doc_ids: Optional[List[str]] = None
+    forms: Optional[List[str]] = None
+    years: Optional[List[int]] = None
+    doc_type: Optional[str] = None  # "contract" or "defaulters"
+    pages: Optional[List[int]] = None
+
 class QueryRequest(BaseModel):
     query: str
     mode: str = "hybrid"
@@ -268,108 +448,497 @@ class QueryRequest(BaseModel):
     chunk_top_k: Optional[int] = None
     chunk_cosine: Optional[float] = None
     enable_rerank: Optional[bool] = None
+    # Answer "is X on the defaulters list" questions from the structured index
+    fast_path: bool = True
+    # "llm", "local" or "auto" (default: KEYWORD_EXTRACTION)
+    keyword_extraction: Optional[str] = None
+    # naive mode only: fuse BM25 and vector chunk rankings (reciprocal-rank fusion)
+    fusion: bool = False
+    # Restrict naive/lexical chunk retrieval to matching documents and pages
+    filters: Optional[QueryFilters] = None
+
+class ContextRequest(BaseModel):
+    # Either a single query or a batch of queries
+    query: Optional[str] = None
+    queries: Optional[List[str]] = None
+    mode: str = "hybrid"
+    top_k: int = 20
+    chunk_top_k: int = 10
+    keyword_extraction: Optional[str] = None
+    fusion: bool = False
+    filters: Optional[QueryFilters] = None
+
+class QueryBatchRequest(BaseModel):
+    queries: List[str]
+    mode: str = "hybrid"
+    top_k: int = 20
+    chunk_top_k: int = 10
+    keyword_extraction: Optional[str] = None
+    fusion: bool = False
+    filters: Optional[QueryFilters] = None
+    fast_path: bool = True
+    # Answers generated at once (capped at QUERY_BATCH_CONCURRENCY)
+    concurrency: Optional[int] = None
+
+class KeywordCompareRequest(BaseModel):
+    queries: List[str]
+    mode: str = "hybrid"
+    top_k: int = 20
+    chunk_top_k: int = 10
+
+@app.get("/metrics")
+async def get_metrics():
+    """Runtime counters for the inference backends"""
+    return {
+        "llm_roles": llm_roles.metrics(),
+        "embedding_batcher": embedding_batcher.metrics(),
+        "scheduler": {"llm": llm_roles.scheduler.metrics(), "embedding": embedding_scheduler.metrics()},
+        "storage_wal": wal_registry.describe(),
+        "workspaces": workspaces.describe(),
+        "responses": responder.metrics(),
+        "backends": backend_pools.describe(),
+    }
+
+@app.on_event("startup")
+async def start_backend_probes():
+    backend_pools.start()
+    wal_registry.start()
+    workspaces.start()
+
+@app.on_event("shutdown")
+async def stop_backend_probes():
+    await backend_pools.stop()
+    await workspaces.stop()
+    extraction_cache.flush()
+    # Compacts every write-ahead log so the next start replays nothing
+    await wal_registry.stop()
 
 @app.get("/health")
 async def health_check():
-    backend_status = False
-    backend_error = None
-    
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            if LLM_BINDING.lower() == "openai":
-                # For OpenAI check models endpoint
-                url = f"{LLM_BINDING_HOST}/models" if not LLM_BINDING_HOST.endswith("/chat/completions") else LLM_BINDING_HOST.replace("/chat/completions", "/models")
-                response = await client.get(url, headers={"Authorization": f"Bearer {LIGHTRAG_API_KEY}"} if LIGHTRAG_API_KEY else {})
-            else:
-                # For Ollama check tags
-                response = await client.get(f"{LLM_BINDING_HOST}/api/tags")
-                
-            backend_status = response.status_code == 200
-            if not backend_status:
-                backend_error = f"HTTP {response.status_code}"
-    except Exception as e:
-        backend_status = False
-        backend_error = str(e)
+    """Report cached backend state from the background prober (no outbound calls)"""
+    answer_pool = llm_roles.roles["answer"].pool
+    backend_status = answer_pool.available
     
     status = {
         "api": "healthy",
         "llm_binding": LLM_BINDING,
         "backend": "healthy" if backend_status else "unhealthy",
-        "lightrag_initialized": lightrag is not None,
+        "breaker": answer_pool.breaker.state,
+        "lightrag_initialized": workspaces.default.rag is not None,
         "working_dir": WORKING_DIR,
         "llm_host": LLM_BINDING_HOST,
+        "last_probe_age_s": round(time.time() - backend_pools.last_probe, 1) if backend_pools.last_probe else None,
+        "backends": backend_pools.describe(),
         "nest_asyncio": "enabled"
     }
     if not backend_status:
-        status["backend_error"] = backend_error
+        status["backend_error"] = answer_pool.breaker.open_reason or "; ".join(
+            f"{b.url}: {b.last_error}" for b in answer_pool.backends if not b.healthy
+        )
     return status
 
-def _initialize_lightrag():
-    global lightrag
-    if lightrag is None:
+async def _open_workspace(workspace: Optional[str], create: bool):
+    try:
+        ws = workspaces.get(workspace, create=create)
+    except WorkspaceError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    async with workspaces.use(ws):
         try:
-            lightrag = LightRAG(
-                working_dir=WORKING_DIR,
-                llm_model_func=llm_func,
-                llm_model_name=LLM_MODEL,
-                embedding_func=embedding_func,
-                default_embedding_timeout=300,
-                embedding_func_max_async=4,
-            )
-            print("✓ LightRAG instance created with increased embedding timeout (300s)")
+            await workspaces.open(ws)
         except Exception as e:
             import traceback
-            print(f"✗ LightRAG initialization error:\n{traceback.format_exc()}")
-            raise
+            raise HTTPException(status_code=500, detail=f"Failed to initialize LightRAG: {str(e)}\n\n{traceback.format_exc()}")
+        yield ws
+
+async def _workspace(workspace: Optional[str] = None):
+    """The request's workspace (/workspaces/{workspace}/... or the default corpus), open and pinned"""
+    async for ws in _open_workspace(workspace, create=False):
+        yield ws
+
+async def _ingest_workspace(workspace: Optional[str] = None):
+    """Like _workspace, but ingesting into an unknown workspace creates it"""
+    async for ws in _open_workspace(workspace, create=True):
+        yield ws
+
+def _context_token_limits() -> Dict[str, int]:
+    """QueryParam token budgets so the assembled prompt fits the answer model's context window
+
+    LightRAG fills entities, then relations, then chunks, each in relevance
+    order, until its budget is used; the split keeps LightRAG's default
+    6000/8000/30000 proportions. Without CONTEXT_TOKEN_BUDGET the budget
+    comes from the answer role's NUM_CTX, which only the Ollama binding
+    sends; other bindings keep LightRAG's defaults.
+    """
+    answer = llm_roles.roles["answer"]
+    if not CONTEXT_TOKEN_BUDGET and answer.binding != "ollama":
+        return {}
+    total = CONTEXT_TOKEN_BUDGET or answer.context_budget
+    return {
+        "max_total_tokens": total,
+        "max_entity_tokens": total // 5,
+        "max_relation_tokens": total * 4 // 15,
+    }
+
+def _keyword_strategy(requested: Optional[str]) -> str:
+    strategy = (requested or KEYWORD_EXTRACTION).lower()
+    if strategy not in KEYWORD_MODES:
+        raise HTTPException(status_code=400, detail=f"keyword_extraction must be one of: {', '.join(KEYWORD_MODES)}")
+    return strategy
+
+def _ensure_backends(*roles: str, embedding: bool = True):
+    """Raise BackendUnavailableError if the embedding pool or a role's LLM pool has an open circuit breaker"""
+    if embedding:
+        embedding_pool.ensure_available()
+    for role in roles:
+        llm_roles.roles[role].pool.ensure_available()
+
+async def _filter_candidates(ws: Workspace, filters: Optional[QueryFilters], mode: str) -> Optional[set]:
+    """Chunk ids allowed by a request's metadata filters (None when nothing is filtered)"""
+    if filters is None or not any([filters.doc_ids, filters.forms, filters.years, filters.doc_type, filters.pages]):
+        return None
+    if mode not in ("naive", "lexical", "auto"):
+        raise HTTPException(status_code=400, detail="filters apply to chunk retrieval: use mode naive, lexical or auto")
+    if filters.doc_type and filters.doc_type not in DOC_TYPES:
+        raise HTTPException(status_code=400, detail=f"doc_type must be one of: {', '.join(DOC_TYPES)}")
+    await ws.metadata_index.ensure_built(ws.rag, ws.doc_manifest)
+    return ws.metadata_index.candidates(
+        doc_ids=filters.doc_ids, forms=filters.forms, years=filters.years, doc_type=filters.doc_type, pages=filters.pages,
+    )
+
+def _chunk_strategy(mode: str, fusion: bool, candidates: Optional[set]) -> Optional[str]:
+    """ChunkStore strategy for a request, or None for LightRAG's own retrieval"""
+    if mode == "lexical":
+        return "lexical"
+    if mode == "naive" and fusion:
+        return "fusion"
+    if mode == "naive" and candidates is not None:
+        return "vector"
+    return None
+
+async def _sync_document(ws: Workspace, doc_id: str, text: Optional[str] = None, chunks: Optional[AsyncIterator[str]] = None) -> Dict[str, Any]:
+    """Sync a document revision (whole text, or streamed chunks) into LightRAG and the side indexes; returns the per-ingest report"""
+    # Refuse up front rather than letting every chunk fail against a dead backend
+    _ensure_backends("extract")
+    use_traffic_class("ingest")
+    dedup_counts = chunk_dedup.counting()
+    cache_before = extraction_cache.snapshot()
+    writes_before = wal_registry.snapshot()
+    rag = ws.rag
+    # Snapshots wait for in-progress writes and hold new ones back
+    async with ws.writing():
+        if chunks is not None:
+            report = {"sections": await sync_document_stream(rag, ws.doc_manifest, doc_id, chunks)}
+        else:
+            report = {"sections": await sync_document(rag, ws.doc_manifest, doc_id, text)}
+        report["extraction_dedup"] = chunk_dedup.report(dedup_counts)
+        report["extraction_cache"] = extraction_cache.report(cache_before)
+        # Write the entries buffered by this ingest in one transaction
+        extraction_cache.flush()
+        if STORAGE_WAL:
+            report["storage_writes"] = wal_registry.report(writes_before)
+        entry = ws.doc_manifest.get(doc_id)
+        if entry is not None:
+            report["lexical_index"] = await ws.bm25_index.sync_document(rag, doc_id, entry["sections"])
+            report["metadata"] = await ws.metadata_index.sync_document(rag, doc_id, entry["sections"])
+        ws.invalidate()
+        if text is not None and is_defaulters_doc(doc_id):
+            report["defaulters_rows"] = ws.defaulters_index.load_text(doc_id, text)
+    return report
 
 @app.post("/ingest")
-async def ingest_document(request: IngestRequest):
-    global lightrag
-    if lightrag is None:
-        try:
-            _initialize_lightrag()
-            await lightrag.initialize_storages()
-            print("✓ LightRAG initialized and storages ready!")
-        except Exception as e:
-            import traceback
-            raise HTTPException(status_code=500, detail=f"Failed to initialize LightRAG: {str(e)}\n\n{traceback.format_exc()}")
-    
+@app.post("/workspaces/{workspace}/ingest")
+async def ingest_document(request: IngestRequest, ws: Workspace = Depends(_ingest_workspace)):
+    """Ingest a document; re-posting an existing doc_id only reprocesses changed sections"""
     if not request.text or not request.text.strip():
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     if not request.doc_id or not request.doc_id.strip():
         raise HTTPException(status_code=400, detail="doc_id cannot be empty")
+    if len(request.text) > INGEST_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Text exceeds INGEST_MAX_BYTES ({INGEST_MAX_BYTES}); use /ingest/stream for large documents")
     
     try:
-        if asyncio.iscoroutinefunction(lightrag.insert):
-            result = await lightrag.insert(request.text, request.doc_id)
-        else:
-            result = await asyncio.to_thread(lightrag.insert, request.text, request.doc_id)
-        return {"message": "Document ingested successfully", "doc_id": request.doc_id, "text_length": len(request.text)}
+        report = await _sync_document(ws, request.doc_id, request.text)
+        return {"message": "Document ingested successfully", "doc_id": request.doc_id, "text_length": len(request.text), **report}
+    except DocumentUpdateError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except BackendUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         import traceback
         print(f"Ingest error:\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Failed to ingest document: {str(e)}")
 
-@app.post("/query")
-async def query_document(request: QueryRequest):
-    global lightrag
-    if lightrag is None:
+@app.post("/ingest/stream")
+@app.post("/workspaces/{workspace}/ingest/stream")
+async def ingest_document_stream(request: Request, doc_id: str, ws: Workspace = Depends(_ingest_workspace)):
+    """
+    Ingest a large document sent as the raw body (text/plain or application/pdf, chunked or not)
+
+    Sections are split and inserted while the body is still arriving, so
+    memory stays flat in the document size; the report adds the bytes read,
+    elapsed time and peak RSS under "upload".
+    """
+    if not doc_id.strip():
+        raise HTTPException(status_code=400, detail="doc_id cannot be empty")
+    meter = UploadMeter()
+    try:
+        meter.check_declared(request.headers.get("content-length"))
+        kind = content_kind(request.headers.get("content-type"))
+        if kind == "text" and is_defaulters_doc(doc_id):
+            # The defaulters table is parsed from the whole text; it is a few pages, so read it in full
+            text = "".join([chunk async for chunk in text_chunks(request.stream(), meter)])
+            if not text.strip():
+                raise HTTPException(status_code=400, detail="Text cannot be empty")
+            report = await _sync_document(ws, doc_id, text)
+        else:
+            chunks = text_chunks(request.stream(), meter) if kind == "text" else pdf_chunks(request.stream(), meter)
+            report = await _sync_document(ws, doc_id, chunks=chunks)
+        upload = meter.report()
+        print(f"✓ Streamed ingest of {doc_id}: {upload['bytes']} bytes in {upload['elapsed_ms']} ms (peak RSS {upload['peak_rss_mb']} MB)")
+        return {"message": "Document ingested successfully", "doc_id": doc_id, "upload": upload, **report}
+    except DocumentUpdateError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except BackendUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        print(f"Streamed ingest error:\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Failed to ingest document: {str(e)}")
+
+@app.get("/documents")
+@app.get("/workspaces/{workspace}/documents")
+async def list_documents(ws: Workspace = Depends(_workspace)):
+    """List tracked documents and their section counts"""
+    return {
+        "documents": [
+            {"doc_id": doc_id, **doc_metadata(doc_id), "sections": len(entry["sections"]), "updated_at": entry.get("updated_at")}
+            for doc_id, entry in ws.doc_manifest.items()
+        ],
+        "metadata_index": ws.metadata_index.describe(),
+    }
+
+@app.put("/documents/{doc_id}")
+@app.put("/workspaces/{workspace}/documents/{doc_id}")
+async def update_document(doc_id: str, request: DocumentUpdateRequest, ws: Workspace = Depends(_workspace)):
+    """Replace a document, re-extracting only new or changed sections"""
+    if not request.text or not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    
+    try:
+        report = await _sync_document(ws, doc_id, request.text)
+        return {"message": "Document updated successfully", "doc_id": doc_id, "text_length": len(request.text), **report}
+    except DocumentUpdateError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except BackendUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        import traceback
+        print(f"Update error:\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Failed to update document: {str(e)}")
+
+@app.delete("/documents/{doc_id}")
+@app.delete("/workspaces/{workspace}/documents/{doc_id}")
+async def remove_document(doc_id: str, ws: Workspace = Depends(_workspace)):
+    """Delete a document; entities and relations only it contributed are retracted"""
+    use_traffic_class("ingest")
+    async with ws.writing():
         try:
-            _initialize_lightrag()
-            await lightrag.initialize_storages()
-            print("✓ LightRAG initialized and storages ready!")
+            result = await delete_document(ws.rag, ws.doc_manifest, doc_id)
+        except DocumentUpdateError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
         except Exception as e:
             import traceback
-            raise HTTPException(status_code=500, detail=f"Failed to initialize LightRAG: {str(e)}\n\n{traceback.format_exc()}")
-    
+            print(f"Delete error:\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail=f"Failed to delete document: {str(e)}")
+        if result is None:
+            raise HTTPException(status_code=404, detail=f"Document not found: {doc_id}")
+        await ws.bm25_index.remove_document(doc_id)
+        await ws.metadata_index.remove_document(doc_id)
+        ws.invalidate()
+        if ws.defaulters_index.source_doc_id == doc_id:
+            ws.defaulters_index.clear()
+    return {"message": "Document deleted successfully", "doc_id": doc_id, **result}
+
+@app.get("/workspaces")
+async def list_workspaces():
+    """Open and on-disk workspaces with memory estimates, request counts and LRU/eviction counters"""
+    return workspaces.describe()
+
+@app.post("/workspaces/{workspace}/close")
+async def close_workspace(workspace: str):
+    """Flush a workspace's storage to disk and release its memory (it reopens on the next request)"""
+    try:
+        ws = workspaces.get(workspace)
+    except WorkspaceError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if ws.in_flight:
+        raise HTTPException(status_code=409, detail=f"Workspace {workspace} has {ws.in_flight} requests in flight")
+    await workspaces.close(ws)
+    return {"message": "Workspace closed", **ws.describe()}
+
+@app.get("/snapshots")
+async def list_snapshots():
+    """Snapshots of every workspace, newest last, with their size and block reuse"""
+    return {**snapshots.describe(), "snapshots": snapshots.list()}
+
+@app.post("/snapshots")
+@app.post("/workspaces/{workspace}/snapshots")
+async def create_snapshot(label: Optional[str] = None, ws: Workspace = Depends(_workspace)):
+    """Flush and snapshot a workspace's stores; only blocks not already stored are written"""
+    # Ingests/updates/deletes wait while the files are copied; queries keep running
+    async with ws.quiesced():
+        await ws.flush()
+        with wal_registry.hold_compaction():
+            try:
+                manifest = await asyncio.to_thread(snapshots.create, ws.data_dir, ws.name, label)
+            except SnapshotError as e:
+                raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"message": "Snapshot created", "id": manifest["id"], "workspace": ws.name or "default", **manifest["stats"]}
+
+@app.post("/snapshots/{snapshot_id}/restore")
+async def restore_snapshot(snapshot_id: str, workspace: Optional[str] = None, mmap: bool = True):
+    """Replace a workspace's stores with a snapshot (default: the workspace it was taken from) and reopen it"""
+    try:
+        manifest = snapshots.get(snapshot_id)
+        ws = workspaces.get(manifest["workspace"] if workspace is None else workspace, create=True)
+    except (SnapshotError, WorkspaceError) as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    async with ws.quiesced():
+        if ws.in_flight:
+            raise HTTPException(status_code=409, detail=f"Workspace {ws.name or 'default'} has {ws.in_flight} requests in flight")
+        await workspaces.close(ws)
+        # Requests arriving now wait in open() until the files are in place
+        async with ws.lock:
+            if ws.rag is not None:
+                raise HTTPException(status_code=409, detail="Workspace was reopened during the restore; retry")
+            try:
+                report = await asyncio.to_thread(snapshots.restore, snapshot_id, ws.data_dir, mmap)
+            except SnapshotError as e:
+                raise HTTPException(status_code=e.status_code, detail=str(e))
+            ws.version += 1
+    start = time.perf_counter()
+    await workspaces.open(ws)
+    return {"message": "Snapshot restored", "workspace": ws.name or "default", **report, "open_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+@app.delete("/snapshots/{snapshot_id}")
+async def delete_snapshot(snapshot_id: str):
+    """Delete a snapshot and the blocks no other snapshot uses"""
+    try:
+        return await asyncio.to_thread(snapshots.delete, snapshot_id)
+    except SnapshotError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.get("/extraction-cache")
+async def get_extraction_cache():
+    """Size and hit counters of the durable extraction cache"""
+    return extraction_cache.describe()
+
+@app.get("/extraction-cache/export")
+async def export_extraction_cache():
+    """Download the extraction cache as gzipped JSONL"""
+    buffer = io.BytesIO()
+    count = extraction_cache.export_jsonl(buffer)
+    return Response(
+        content=buffer.getvalue(),
+        media_type="application/gzip",
+        headers={
+            "Content-Disposition": "attachment; filename=extraction_cache.jsonl.gz",
+            "X-Entry-Count": str(count),
+        },
+    )
+
+@app.post("/extraction-cache/import")
+async def import_extraction_cache(request: Request, replace: bool = False):
+    """Load an exported cache (gzipped or plain JSONL request body); existing entries win unless replace=true"""
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="Request body must be an exported extraction cache")
+    try:
+        result = extraction_cache.import_jsonl(data, replace=replace)
+    except (ValueError, KeyError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid extraction cache export: {e}")
+    return {"message": "Extraction cache imported", **result, "entries": extraction_cache.describe()["entries"]}
+
+@app.get("/defaulters/lookup")
+@app.get("/workspaces/{workspace}/defaulters/lookup")
+async def lookup_defaulter(name: str, limit: int = 5, ws: Workspace = Depends(_workspace)):
+    """Fuzzy company-name lookup against the structured defaulters list"""
+    if not name or not name.strip():
+        raise HTTPException(status_code=400, detail="name cannot be empty")
+    start = time.perf_counter()
+    matches = ws.defaulters_index.lookup(name, limit=limit)
+    return {
+        "name": name,
+        "matches": matches,
+        "rows_indexed": len(ws.defaulters_index.rows),
+        "source_doc_id": ws.defaulters_index.source_doc_id,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+@app.get("/search")
+@app.get("/workspaces/{workspace}/search")
+async def lexical_search(q: str, limit: int = 10, ws: Workspace = Depends(_workspace)):
+    """BM25 chunk lookup for exact strings; touches neither the LLM nor the embedding backend"""
+    if not q or not q.strip():
+        raise HTTPException(status_code=400, detail="q cannot be empty")
+    rag = ws.rag
+    await ws.bm25_index.ensure_built(rag, ws.doc_manifest)
+    start = time.perf_counter()
+    hits = ws.bm25_index.search(q, limit)
+    chunks = await rag.text_chunks.get_by_ids([chunk_id for chunk_id, _ in hits]) if hits else []
+    return {
+        "query": q,
+        "results": [
+            {"chunk_id": chunk_id, "score": round(score, 4), "file_path": chunk.get("file_path"), "content": chunk.get("content", "")}
+            for (chunk_id, score), chunk in zip(hits, chunks) if chunk
+        ],
+        "index": ws.bm25_index.describe(),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+@app.post("/query")
+@app.post("/workspaces/{workspace}/query")
+async def query_document(request: QueryRequest, http_request: Request, ws: Workspace = Depends(_workspace)):
+    lightrag = ws.rag
     if not request.query or not request.query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty")
+    use_traffic_class("interactive")
     
-    valid_modes = ["hybrid", "naive", "local", "global"]
+    valid_modes = ["hybrid", "naive", "local", "global", "auto", "lexical"]
     if request.mode not in valid_modes:
         raise HTTPException(status_code=400, detail=f"Mode must be one of: {', '.join(valid_modes)}")
     
+    # Fast path: defaulters-list lookups are answered from the structured index
+    if request.fast_path and ws.defaulters_index.rows:
+        company = extract_company_query(request.query)
+        if company:
+            start = time.perf_counter()
+            matches = ws.defaulters_index.lookup(company)
+            if matches:
+                return responder.respond(http_request, {
+                    "answer": format_defaulters_answer(company, matches),
+                    "query": request.query,
+                    "mode": "defaulters_index",
+                    "matches": matches,
+                    "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                })
+    
+    keyword_strategy = _keyword_strategy(request.keyword_extraction)
+    candidates = await _filter_candidates(ws, request.filters, request.mode)
+    
     try:
+        # mode="auto": pick the cheapest adequate retrieval mode without an LLM call
+        routing = None
+        mode = request.mode
+        if mode == "auto" and candidates is not None:
+            # Filters narrow chunk retrieval, so filtered auto queries run as naive
+            mode = "naive"
+        elif mode == "auto":
+            routing = await ws.query_router.classify(lightrag, request.query)
+            mode = routing["mode"]
+        
         # Default optimized parameters (if not provided by user)
         default_params = {
             "query_edges_top_k": 20,
@@ -398,231 +967,550 @@ async def query_document(request: QueryRequest):
         
         # Prepare QueryParam
         qp = QueryParam(
-            mode=request.mode,
+            mode=mode,
             top_k=query_params.get("query_nodes_top_k", 20),
             chunk_top_k=query_params.get("chunk_top_k", 10),
-            enable_rerank=query_params.get("enable_rerank", False)
+            enable_rerank=query_params.get("enable_rerank", False),
+            **_context_token_limits(),
         )
+        # Calling through model_func (instead of LightRAG's shared worker queue) lets this request's LLM calls be counted
+        token_usage = TokenUsage()
+        qp.model_func = partial(llm_func, llm_usage=token_usage)
+        # Local keywords skip LightRAG's LLM keyword-extraction round-trip
+        keywords = await ws.keyword_extractor.keywords_for(lightrag, request.query, mode, keyword_strategy)
+        if keywords is not None:
+            qp.hl_keywords, qp.ll_keywords = keywords["hl_keywords"], keywords["ll_keywords"]
         
-        # Execute query
-        if asyncio.iscoroutinefunction(lightrag.query):
-            response = await lightrag.query(request.query, param=qp)
+        # Execute query on the server loop (LightRAG's storage locks and workers are bound to it)
+        chunk_store = None
+        strategy = _chunk_strategy(mode, request.fusion, candidates)
+        query_start = time.perf_counter()
+        if strategy is not None:
+            # BM25 and/or filtered vector chunk retrieval; "lexical" never contacts the embedding backend
+            await ws.bm25_index.ensure_built(lightrag, ws.doc_manifest)
+            _ensure_backends("answer", embedding=mode != "lexical")
+            chunk_store = ChunkStore(ws.bm25_index, lightrag, strategy, candidates)
+            query_result = await chunk_query(lightrag, chunk_store, request.query.strip(), qp, asdict(lightrag))
+            response = query_result.content if query_result is not None else PROMPTS["fail_response"]
         else:
-            response = await asyncio.to_thread(lightrag.query, request.query, param=qp)
+            if mode == "naive" or keywords is not None:
+                _ensure_backends("answer")
+            else:
+                _ensure_backends("keywords", "answer")
+            response = await lightrag.aquery(request.query, param=qp)
+        if not response:
+            # LightRAG turns LLM errors into an empty answer; report an open breaker as such
+            _ensure_backends("answer", embedding=mode != "lexical")
+        query_ms = round((time.perf_counter() - query_start) * 1000, 1)
         
-        return {
+        result = {
             "answer": response, 
             "query": request.query, 
-            "mode": request.mode,
+            "mode": mode,
             "parameters_used": {
                 "top_k": qp.top_k,
                 "chunk_top_k": qp.chunk_top_k,
                 "enable_rerank": qp.enable_rerank,
-                "mode": qp.mode
-            }
+                "mode": qp.mode,
+                "max_total_tokens": qp.max_total_tokens,
+            },
+            "token_usage": token_usage.report(),
         }
+        if mode in ("local", "global", "hybrid"):
+            result["keywords"] = {"source": "local", **keywords} if keywords is not None else {"source": "llm"}
+        if chunk_store is not None:
+            result["chunk_ranking"] = chunk_store.last_ranking
+        if candidates is not None:
+            result["filters"] = {**request.filters.model_dump(exclude_none=True), "candidate_chunks": len(candidates)}
+        if routing is not None:
+            ws.query_router.record(request.query, routing, query_ms)
+            result["routing"] = routing
+        return responder.respond(http_request, result)
+    except BackendUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
         print(f"Query error:\n{error_trace}")
         raise HTTPException(status_code=500, detail=f"Failed to process query: {str(e)}\n\n{error_trace}")
 
-@app.get("/graph")
-async def get_graph(limit: int = 100):
-    """Get knowledge graph data for visualization (entities and relations)"""
-    global lightrag
-    if lightrag is None:
-        try:
-            _initialize_lightrag()
-            await lightrag.initialize_storages()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to initialize LightRAG: {str(e)}")
-    
+async def _plan_batch_query(ws: Workspace, index: int, query: str, request: QueryBatchRequest, keyword_strategy: str, candidates: Optional[set], retrieval: BatchRetrieval) -> Dict[str, Any]:
+    """Resolve one batch question's mode and keywords, and register what its retrieval will embed and search"""
+    query = query.strip()
+    plan = {"index": index, "query": query, "mode": request.mode, "routing": None, "keywords": None}
+    if request.fast_path and ws.defaulters_index.rows:
+        company = extract_company_query(query)
+        matches = ws.defaulters_index.lookup(company) if company else None
+        if matches:
+            plan.update(mode="defaulters_index", answer=format_defaulters_answer(company, matches), matches=matches)
+            return plan
+    mode = request.mode
+    if mode == "auto" and candidates is not None:
+        mode = "naive"
+    elif mode == "auto":
+        plan["routing"] = await ws.query_router.classify(ws.rag, query)
+        mode = plan["routing"]["mode"]
+    plan["mode"] = mode
+    plan["strategy"] = _chunk_strategy(mode, request.fusion, candidates)
+    plan["keywords"] = await ws.keyword_extractor.keywords_for(ws.rag, query, mode, keyword_strategy)
+    if mode == "naive":
+        if candidates is None:
+            # ChunkStore's fusion pool is twice chunk_top_k deep
+            retrieval.want(query, "chunks", request.chunk_top_k * 2 if request.fusion else request.chunk_top_k)
+        else:
+            # Filtered searches score only the candidates' vectors, but still embed the question
+            retrieval.want(query)
+    elif mode in ("local", "global", "hybrid"):
+        # kg_query embeds the question once for its vector chunk selection
+        retrieval.want(query)
+        keywords = plan["keywords"]
+        if keywords is not None:
+            if mode != "global" and keywords["ll_keywords"]:
+                retrieval.want(", ".join(keywords["ll_keywords"]), "entities", request.top_k)
+            if mode != "local" and keywords["hl_keywords"]:
+                retrieval.want(", ".join(keywords["hl_keywords"]), "relationships", request.top_k)
+    return plan
+
+async def _answer_batch_query(ws: Workspace, plan: Dict[str, Any], request: QueryBatchRequest, candidates: Optional[set], retrieval: BatchRetrieval, global_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate one batch answer with LightRAG's own query functions over the prefetched stores"""
+    rag = ws.rag
+    mode, query = plan["mode"], plan["query"]
+    qp = QueryParam(mode=mode, top_k=request.top_k, chunk_top_k=request.chunk_top_k, enable_rerank=False, **_context_token_limits())
+    token_usage = TokenUsage()
+    qp.model_func = partial(llm_func, llm_usage=token_usage)
+    keywords = plan["keywords"]
+    if keywords is not None:
+        qp.hl_keywords, qp.ll_keywords = keywords["hl_keywords"], keywords["ll_keywords"]
+    result = {"mode": mode}
+    if plan["strategy"] is not None:
+        await ws.bm25_index.ensure_built(rag, ws.doc_manifest)
+        chunk_store = ChunkStore(ws.bm25_index, rag, plan["strategy"], candidates, chunks_vdb=retrieval.chunks_vdb)
+        query_result = await chunk_query(rag, chunk_store, query, qp, global_config)
+        result["chunk_ranking"] = chunk_store.last_ranking
+    elif mode == "naive":
+        query_result = await naive_query(query, retrieval.chunks_vdb, qp, global_config, hashing_kv=rag.llm_response_cache, system_prompt=None)
+    else:
+        query_result = await kg_query(
+            query, rag.chunk_entity_relation_graph, retrieval.entities_vdb, retrieval.relationships_vdb, retrieval.text_chunks,
+            qp, global_config, hashing_kv=rag.llm_response_cache, system_prompt=None, chunks_vdb=retrieval.chunks_vdb,
+        )
+        result["keywords"] = {"source": "local", **keywords} if keywords is not None else {"source": "llm"}
+    result["answer"] = query_result.content if query_result is not None and query_result.content else PROMPTS["fail_response"]
+    result["token_usage"] = token_usage.report()
+    return result
+
+@app.post("/query/batch")
+@app.post("/workspaces/{workspace}/query/batch")
+async def query_batch(request: QueryBatchRequest, ws: Workspace = Depends(_workspace)):
+    """
+    Answer many questions with shared retrieval; streams NDJSON lines as answers complete
+
+    Lines: one {"type": "retrieval"} line once the batch is embedded and
+    searched, one {"type": "result", "index": i, ...} per question in
+    completion order, then {"type": "summary"}.
+    """
+    queries = [(i, q) for i, q in enumerate(request.queries) if q and q.strip()]
+    if not queries:
+        raise HTTPException(status_code=400, detail="Provide queries")
+    if len(queries) > QUERY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {QUERY_BATCH_MAX} queries per batch (QUERY_BATCH_MAX)")
+    valid_modes = ["hybrid", "naive", "local", "global", "auto", "lexical"]
+    if request.mode not in valid_modes:
+        raise HTTPException(status_code=400, detail=f"Mode must be one of: {', '.join(valid_modes)}")
+    keyword_strategy = _keyword_strategy(request.keyword_extraction)
+    candidates = await _filter_candidates(ws, request.filters, request.mode)
     try:
-        entities = []
-        relations = []
-        
-        # Try multiple methods to access LightRAG storage
-        try:
-            # Method 1: Try to access storage attributes directly
-            if hasattr(lightrag, 'entity_storage') and lightrag.entity_storage:
-                entity_storage = lightrag.entity_storage
-                # Check if it's a dict-like structure
-                if hasattr(entity_storage, '__iter__'):
-                    for i, (key, entity) in enumerate(list(entity_storage.items() if hasattr(entity_storage, 'items') else entity_storage)[:limit]):
-                        if isinstance(entity, dict):
-                            entities.append({
-                                "id": entity.get("entity_name", entity.get("id", key if isinstance(key, str) else f"entity_{i}")),
-                                "name": entity.get("entity_name", entity.get("name", str(key))),
-                                "description": entity.get("entity_desc", entity.get("description", "")),
-                                "type": entity.get("type", "entity")
-                            })
-            
-            if hasattr(lightrag, 'relation_storage') and lightrag.relation_storage:
-                relation_storage = lightrag.relation_storage
-                if hasattr(relation_storage, '__iter__'):
-                    for i, (key, rel) in enumerate(list(relation_storage.items() if hasattr(relation_storage, 'items') else relation_storage)[:limit]):
-                        if isinstance(rel, dict):
-                            relations.append({
-                                "from": rel.get("head_entity", rel.get("head", rel.get("from", ""))),
-                                "to": rel.get("tail_entity", rel.get("tail", rel.get("to", ""))),
-                                "relation": rel.get("relation_name", rel.get("relation", rel.get("relation_type", ""))),
-                                "description": rel.get("description", "")
-                            })
-            
-            # Method 2: Try to read from GraphML file
-            if len(entities) == 0:
-                graph_file = os.path.join(WORKING_DIR, "graph_chunk_entity_relation.graphml")
-                if os.path.exists(graph_file):
+        _ensure_backends("answer", embedding=request.mode != "lexical")
+    except BackendUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    concurrency = max(1, min(request.concurrency or QUERY_BATCH_CONCURRENCY, QUERY_BATCH_CONCURRENCY))
+    # Regression sets yield the GPU to interactive queries and ingestion
+    use_traffic_class("maintenance")
+
+    async def _lines():
+        # The response outlives the request dependency; keep the workspace pinned until the last line
+        async with workspaces.use(ws):
+            start = time.perf_counter()
+            retrieval = BatchRetrieval(ws.rag, embedding_batcher.embed_batch)
+            plans = [await _plan_batch_query(ws, i, q, request, keyword_strategy, candidates, retrieval) for i, q in queries]
+            try:
+                await retrieval.prepare()
+            except Exception as e:
+                # Questions still run; their searches fall through to the stores
+                print(f"Warning: Batch retrieval failed, searching per question: {e}")
+            yield dumps({"type": "retrieval", "questions": len(plans), "concurrency": concurrency, "plan_ms": round((time.perf_counter() - start) * 1000, 1), **retrieval.stats}) + b"\n"
+
+            global_config = asdict(ws.rag)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def _one(plan: Dict[str, Any]) -> Dict[str, Any]:
+                line = {"type": "result", "index": plan["index"], "query": plan["query"]}
+                async with semaphore:
+                    started = time.perf_counter()
                     try:
-                        import networkx as nx
-                        G = nx.read_graphml(graph_file)
-                        
-                        count = 0
-                        for node_id, data in G.nodes(data=True):
-                            if count >= limit:
-                                break
-                            
-                            # Skip chunk nodes if we only want entities
-                            # Entities usually have quotes or specific formatting, chunks are hashes
-                            if data.get('d') and 'chunk' in data.get('d', ''):
-                                continue
-                                
-                            entities.append({
-                                "id": node_id.strip('"'),
-                                "name": node_id.strip('"'),
-                                "description": data.get("description", data.get("desc", "")).strip('"'),
-                                "type": "entity"
-                            })
-                            count += 1
-                            
-                        count = 0
-                        for u, v, data in G.edges(data=True):
-                            if count >= limit:
-                                break
-                            
-                            relations.append({
-                                "from": u.strip('"'),
-                                "to": v.strip('"'),
-                                "relation": data.get("label", data.get("relation", "related")),
-                                "description": data.get("description", "")
-                            })
-                            count += 1
+                        if "answer" in plan:
+                            line.update(mode=plan["mode"], answer=plan["answer"], matches=plan["matches"])
+                        else:
+                            line.update(await _answer_batch_query(ws, plan, request, candidates, retrieval, global_config))
                     except Exception as e:
-                        print(f"Error reading GraphML: {e}")
-            
-            # Legacy JSON fallback
-            if len(entities) == 0 and len(relations) == 0:
-                entity_file = os.path.join(WORKING_DIR, "kv_store_full_entities.json")
-                relation_file = os.path.join(WORKING_DIR, "kv_store_full_relations.json")
-                
-                if os.path.exists(entity_file):
-                    with open(entity_file, 'r', encoding='utf-8') as f:
-                        entity_data = json.load(f)
-                        if isinstance(entity_data, dict):
-                            for key, entity in list(entity_data.items())[:limit]:
-                                entities.append({
-                                    "id": entity.get("entity_name", key),
-                                    "name": entity.get("entity_name", entity.get("name", key)),
-                                    "description": entity.get("entity_desc", entity.get("description", "")),
-                                    "type": entity.get("type", "entity")
-                                })
-                        elif isinstance(entity_data, list):
-                            for i, entity in enumerate(entity_data[:limit]):
-                                entities.append({
-                                    "id": entity.get("entity_name", entity.get("id", f"entity_{i}")),
-                                    "name": entity.get("entity_name", entity.get("name", f"Entity {i}")),
-                                    "description": entity.get("entity_desc", entity.get("description", "")),
-                                    "type": entity.get("type", "entity")
-                                })
-                
-                if os.path.exists(relation_file):
-                    with open(relation_file, 'r', encoding='utf-8') as f:
-                        relation_data = json.load(f)
-                        if isinstance(relation_data, dict):
-                            for key, rel in list(relation_data.items())[:limit]:
-                                relations.append({
-                                    "from": rel.get("head_entity", rel.get("head", rel.get("from", ""))),
-                                    "to": rel.get("tail_entity", rel.get("tail", rel.get("to", ""))),
-                                    "relation": rel.get("relation_name", rel.get("relation", rel.get("relation_type", ""))),
-                                    "description": rel.get("description", "")
-                                })
-                        elif isinstance(relation_data, list):
-                            for i, rel in enumerate(relation_data[:limit]):
-                                relations.append({
-                                    "from": rel.get("head_entity", rel.get("head", rel.get("from", ""))),
-                                    "to": rel.get("tail_entity", rel.get("tail", rel.get("to", ""))),
-                                    "relation": rel.get("relation_name", rel.get("relation", rel.get("relation_type", ""))),
-                                    "description": rel.get("description", "")
-                                })
-        
-        except Exception as e:
-            print(f"Warning: Could not access graph storage: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        # Ensure we have valid data (nodes need IDs, edges need from/to)
-        valid_entities = []
-        valid_relations = []
-        entity_ids = set()
-        
-        for entity in entities:
-            if entity.get("id") or entity.get("name"):
-                entity_id = entity.get("id") or entity.get("name")
-                if entity_id not in entity_ids:
-                    entity_ids.add(entity_id)
-                    valid_entities.append({
-                        "id": entity_id,
-                        "name": entity.get("name", entity_id),
-                        "description": entity.get("description", ""),
-                        "type": entity.get("type", "entity")
-                    })
-        
-        for rel in relations:
-            from_id = rel.get("from", "").strip()
-            to_id = rel.get("to", "").strip()
-            if from_id and to_id and from_id in entity_ids and to_id in entity_ids:
-                valid_relations.append({
-                    "from": from_id,
-                    "to": to_id,
-                    "relation": rel.get("relation", ""),
-                    "description": rel.get("description", "")
-                })
-        
-        return {
-            "nodes": valid_entities,
-            "edges": valid_relations,
-            "node_count": len(valid_entities),
-            "edge_count": len(valid_relations)
-        }
+                        print(f"Batch query error for {plan['query']!r}: {e}")
+                        line.update(mode=plan["mode"], error=str(e))
+                    finished = time.perf_counter()
+                if plan["routing"] is not None:
+                    ws.query_router.record(plan["query"], plan["routing"], round((finished - started) * 1000, 1))
+                    line["routing"] = plan["routing"]
+                line["timings"] = {
+                    "queued_ms": round((started - start) * 1000, 1),
+                    "generation_ms": round((finished - started) * 1000, 1),
+                    "total_ms": round((finished - start) * 1000, 1),
+                }
+                return line
+
+            errors = 0
+            for next_line in asyncio.as_completed([_one(plan) for plan in plans]):
+                line = await next_line
+                errors += "error" in line
+                yield dumps(line) + b"\n"
+            await ws.rag.llm_response_cache.index_done_callback()
+            yield dumps({
+                "type": "summary",
+                "questions": len(plans),
+                "errors": errors,
+                "retrieval": retrieval.report(),
+                "total_ms": round((time.perf_counter() - start) * 1000, 1),
+            }) + b"\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+async def _retrieve_context(ws: Workspace, query: str, mode: str, top_k: int, chunk_top_k: int, keyword_strategy: str = KEYWORD_EXTRACTION, fusion: bool = False, candidates: Optional[set] = None) -> Dict[str, Any]:
+    """Run LightRAG's context-only retrieval for one query and summarise the evidence"""
+    rag = ws.rag
+    start = time.perf_counter()
+    routing = None
+    if mode == "auto" and candidates is not None:
+        mode = "naive"
+    elif mode == "auto":
+        routing = await ws.query_router.classify(rag, query)
+        mode = routing["mode"]
+    qp = QueryParam(mode=mode, top_k=top_k, chunk_top_k=chunk_top_k, enable_rerank=False, **_context_token_limits())
+    keywords = await ws.keyword_extractor.keywords_for(rag, query, mode, keyword_strategy)
+    if keywords is not None:
+        qp.hl_keywords, qp.ll_keywords = keywords["hl_keywords"], keywords["ll_keywords"]
+    chunk_store = None
+    strategy = _chunk_strategy(mode, fusion, candidates)
+    if strategy is not None:
+        await ws.bm25_index.ensure_built(rag, ws.doc_manifest)
+        chunk_store = ChunkStore(ws.bm25_index, rag, strategy, candidates)
+        qp.only_need_context = True
+        query_result = await chunk_query(rag, chunk_store, query.strip(), qp, asdict(rag))
+        result = query_result.raw_data if query_result is not None else {"status": "failure", "message": "No relevant document chunks found.", "data": {}}
+    else:
+        result = await rag.aquery_data(query, param=qp)
+    data = result.get("data", {}) or {}
+    entities = data.get("entities", [])
+    relationships = data.get("relationships", [])
+    chunks = data.get("chunks", [])
+
+    doc_ids = set()
+    for item in entities + relationships + chunks:
+        for path in (item.get("file_path") or "").split(GRAPH_FIELD_SEP):
+            if path and path != "unknown_source":
+                doc_ids.add(path)
+
+    token_counts = {
+        "entities": len(rag.tokenizer.encode(json.dumps(entities, ensure_ascii=False))) if entities else 0,
+        "relationships": len(rag.tokenizer.encode(json.dumps(relationships, ensure_ascii=False))) if relationships else 0,
+        "chunks": len(rag.tokenizer.encode(json.dumps(chunks, ensure_ascii=False))) if chunks else 0,
+    }
+    context = {
+        "query": query,
+        "mode": mode,
+        "status": result.get("status", "failure"),
+        "entities": entities,
+        "relationships": relationships,
+        "chunks": chunks,
+        "references": data.get("references", []),
+        "doc_ids": sorted(doc_ids),
+        "token_count": sum(token_counts.values()),
+        "token_counts": token_counts,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    if result.get("status") != "success":
+        context["message"] = result.get("message", "")
+    if routing is not None:
+        context["routing"] = routing
+    if mode in ("local", "global", "hybrid"):
+        context["keywords"] = {"source": "local", **keywords} if keywords is not None else {"source": "llm"}
+    if chunk_store is not None:
+        context["chunk_ranking"] = chunk_store.last_ranking
+    if candidates is not None:
+        context["candidate_chunks"] = len(candidates)
+    return context
+
+@app.post("/context")
+@app.post("/workspaces/{workspace}/context")
+async def get_context(request: ContextRequest, http_request: Request, ws: Workspace = Depends(_workspace)):
+    """Retrieval only: return entities, relations, chunks and source doc_ids without generating an answer"""
+    queries = list(request.queries or [])
+    if request.query:
+        queries.insert(0, request.query)
+    queries = [q for q in queries if q and q.strip()]
+    if not queries:
+        raise HTTPException(status_code=400, detail="Provide query or queries")
+    
+    valid_modes = ["hybrid", "naive", "local", "global", "auto", "lexical"]
+    if request.mode not in valid_modes:
+        raise HTTPException(status_code=400, detail=f"Mode must be one of: {', '.join(valid_modes)}")
+    keyword_strategy = _keyword_strategy(request.keyword_extraction)
+    candidates = await _filter_candidates(ws, request.filters, request.mode)
+    
+    use_traffic_class("interactive")
+    semaphore = asyncio.Semaphore(CONTEXT_BATCH_CONCURRENCY)
+    
+    async def _one(query: str):
+        async with semaphore:
+            try:
+                return await _retrieve_context(ws, query, request.mode, request.top_k, request.chunk_top_k, keyword_strategy, request.fusion, candidates)
+            except Exception as e:
+                print(f"Context error for {query!r}: {e}")
+                return {"query": query, "status": "failure", "message": str(e)}
+    
+    start = time.perf_counter()
+    results = await asyncio.gather(*[_one(q) for q in queries])
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+    if request.queries is None:
+        return responder.respond(http_request, {**results[0], "total_elapsed_ms": elapsed_ms})
+    return responder.respond(http_request, {"results": results, "count": len(results), "total_elapsed_ms": elapsed_ms})
+
+def _retrieval_keys(data: Dict[str, Any]) -> Dict[str, set]:
+    return {
+        "entities": {e.get("entity_name") for e in data.get("entities", [])},
+        "relationships": {(r.get("src_id"), r.get("tgt_id")) for r in data.get("relationships", [])},
+        "chunks": {c.get("chunk_id") or c.get("content") for c in data.get("chunks", [])},
+    }
+
+def _jaccard(a: set, b: set) -> Optional[float]:
+    return round(len(a & b) / len(a | b), 3) if a or b else None
+
+@app.post("/keywords/compare")
+@app.post("/workspaces/{workspace}/keywords/compare")
+async def compare_keywords(request: KeywordCompareRequest, ws: Workspace = Depends(_workspace)):
+    """Compare local and LLM keyword extraction: latency, keywords and overlap of what each retrieves"""
+    rag = ws.rag
+    if request.mode not in ("local", "global", "hybrid"):
+        raise HTTPException(status_code=400, detail="Mode must be one of: local, global, hybrid")
+    queries = [q for q in request.queries if q and q.strip()]
+    if not queries:
+        raise HTTPException(status_code=400, detail="Provide queries")
+    _ensure_backends("keywords")
+    use_traffic_class("maintenance")
+    
+    async def _retrieve(query: str, hl: List[str], ll: List[str]) -> Dict[str, set]:
+        qp = QueryParam(
+            mode=request.mode, top_k=request.top_k, chunk_top_k=request.chunk_top_k, enable_rerank=False,
+            hl_keywords=hl, ll_keywords=ll, **_context_token_limits(),
+        )
+        result = await rag.aquery_data(query, param=qp)
+        return _retrieval_keys(result.get("data", {}) or {})
+    
+    results = []
+    for query in queries:
+        local = await ws.keyword_extractor.extract(rag, query)
+        start = time.perf_counter()
+        # Bypasses LightRAG's keyword cache so the LLM latency is real
+        llm_hl, llm_ll = await llm_keywords(rag, llm_func, query)
+        llm_ms = round((time.perf_counter() - start) * 1000, 1)
+        local_keys = await _retrieve(query, local["hl_keywords"], local["ll_keywords"])
+        llm_keys = await _retrieve(query, llm_hl, llm_ll)
+        results.append({
+            "query": query,
+            "local": {"hl_keywords": local["hl_keywords"], "ll_keywords": local["ll_keywords"], "ms": local["ms"]},
+            "llm": {"hl_keywords": llm_hl, "ll_keywords": llm_ll, "ms": llm_ms},
+            "retrieval_overlap": {kind: _jaccard(local_keys[kind], llm_keys[kind]) for kind in local_keys},
+        })
+    
+    def _mean(values):
+        values = [v for v in values if v is not None]
+        return round(sum(values) / len(values), 3) if values else None
+    
+    return {
+        "mode": request.mode,
+        "results": results,
+        "summary": {
+            "queries": len(results),
+            "local_ms_avg": _mean([r["local"]["ms"] for r in results]),
+            "llm_ms_avg": _mean([r["llm"]["ms"] for r in results]),
+            "overlap_avg": {
+                kind: _mean([r["retrieval_overlap"][kind] for r in results])
+                for kind in ("entities", "relationships", "chunks")
+            },
+        },
+    }
+
+async def _graph_payload(ws: Workspace, limit: int) -> Dict[str, Any]:
+    """Entities and relations for visualization, read from the live graph storage"""
+    graph = ws.rag.chunk_entity_relation_graph
+    nodes = []
+    entity_ids = set()
+    for node in await graph.get_all_nodes():
+        if len(nodes) >= limit:
+            break
+        entity_id = str(node["id"]).strip('"')
+        if not entity_id or entity_id in entity_ids:
+            continue
+        entity_ids.add(entity_id)
+        nodes.append({
+            "id": entity_id,
+            "name": entity_id,
+            "description": (node.get("description") or "").strip('"'),
+            "type": node.get("entity_type") or "entity"
+        })
+
+    edges = []
+    for edge in (await graph.get_all_edges())[:limit]:
+        from_id, to_id = str(edge.get("source", "")).strip('"'), str(edge.get("target", "")).strip('"')
+        if from_id in entity_ids and to_id in entity_ids:
+            edges.append({
+                "from": from_id,
+                "to": to_id,
+                "relation": edge.get("label", edge.get("relation", edge.get("keywords", "related"))),
+                "description": edge.get("description", "")
+            })
+
+    return {
+        "nodes": nodes,
+        "edges": edges,
+        "node_count": len(nodes),
+        "edge_count": len(edges)
+    }
+
+def _graph_etag(request: Request, ws: Workspace, *extra: Any) -> str:
+    """Changes whenever the workspace's corpus changes (ingest/update/delete) or the request differs"""
+    return make_etag(ws.name, ws.version, request.url.path, sorted(request.query_params.multi_items()), *extra)
+
+@app.get("/graph")
+@app.get("/workspaces/{workspace}/graph")
+async def get_graph(request: Request, limit: int = 100, ws: Workspace = Depends(_workspace)):
+    """Get knowledge graph data for visualization (entities and relations); 304 while the corpus is unchanged"""
+    try:
+        return await responder.cached(request, _graph_etag(request, ws), lambda: _graph_payload(ws, limit))
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
         print(f"Graph retrieval error:\n{error_trace}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve graph: {str(e)}")
 
+@app.get("/graph/view")
+@app.get("/workspaces/{workspace}/graph/view")
+async def get_graph_view(
+    request: Request,
+    level: str = "communities",
+    limit: int = 200,
+    community: Optional[int] = None,
+    node: Optional[str] = None,
+    depth: int = 1,
+    bbox: Optional[str] = None,
+    ws: Workspace = Depends(_workspace),
+):
+    """Level-of-detail graph with server-computed coordinates: communities -> hubs -> detail (community, node or bbox)"""
+    if level not in VIEW_LEVELS:
+        raise HTTPException(status_code=400, detail=f"level must be one of: {', '.join(VIEW_LEVELS)}")
+    box = None
+    if bbox:
+        try:
+            box = tuple(float(v) for v in bbox.split(","))
+        except ValueError:
+            box = ()
+        if len(box) != 4:
+            raise HTTPException(status_code=400, detail="bbox must be x0,y0,x1,y1")
+    start = time.perf_counter()
+    await ws.graph_layout.ensure_current(ws.rag)
+
+    async def build():
+        try:
+            view = ws.graph_layout.view(level, max(1, limit), community=community, node=node, depth=max(1, min(depth, 3)), bbox=box)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=f"Not in graph: {e}")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {**view, "elapsed_ms": round((time.perf_counter() - start) * 1000, 3)}
+
+    # A layout can finish after the corpus version was bumped, so its own version is part of the tag
+    return await responder.cached(request, _graph_etag(request, ws, ws.graph_layout.version), build)
+
 @app.get("/graph/query")
-async def get_query_graph(query: str, mode: str = "hybrid", limit: int = 50):
+@app.get("/workspaces/{workspace}/graph/query")
+async def get_query_graph(request: Request, query: str, mode: str = "hybrid", limit: int = 50, ws: Workspace = Depends(_workspace)):
     """Get graph data for a specific query (entities and relations relevant to the query)"""
-    global lightrag
-    if lightrag is None:
-        try:
-            _initialize_lightrag()
-            await lightrag.initialize_storages()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to initialize LightRAG: {str(e)}")
-    
     try:
         # Execute query to get relevant entities and relations
         # LightRAG's query internally retrieves entities/relations - we need to capture them
         # For now, return the full graph (can be enhanced later to filter by query relevance)
-        full_graph = await get_graph(limit=limit)
-        return full_graph
+        return await responder.cached(request, _graph_etag(request, ws), lambda: _graph_payload(ws, limit))
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
         raise HTTPException(status_code=500, detail=f"Failed to get query graph: {str(e)}")
 
+def _debug_access(x_debug_token: Optional[str] = Header(None)):
+    """Debug endpoints are hidden unless DEBUG_TOKEN is set, and need it in X-Debug-Token"""
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_debug_token or not hmac.compare_digest(x_debug_token.encode("utf-8"), DEBUG_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Debug-Token")
+
+@app.get("/debug/profile/cpu", dependencies=[Depends(_debug_access)])
+async def profile_cpu(seconds: float = 10.0, mode: str = "collapsed", interval_ms: float = 5.0, idle: bool = False, format: Optional[str] = None):
+    """Profile the running server for `seconds`: collapsed stacks of all threads (sampling) or a pstats dump of the event loop (cProfile)"""
+    try:
+        body = await profiler.profile_cpu(seconds, mode, interval_ms, include_idle=idle)
+    except ProfilingError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if mode == "pstats" and format == "text":
+        return PlainTextResponse(Profiler.pstats_text(body))
+    if mode == "pstats":
+        return Response(content=body, media_type="application/octet-stream", headers={"Content-Disposition": f"attachment; filename=cpu-{stamp}.pstats"})
+    return PlainTextResponse(body, headers={"Content-Disposition": f"attachment; filename=cpu-{stamp}.collapsed"})
+
+@app.post("/debug/memory/start", dependencies=[Depends(_debug_access)])
+async def start_memory_tracing(frames: int = 25):
+    """Start tracemalloc and take the baseline snapshot"""
+    try:
+        return await memory_tracer.start(frames)
+    except ProfilingError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.post("/debug/memory/stop", dependencies=[Depends(_debug_access)])
+async def stop_memory_tracing():
+    try:
+        return memory_tracer.stop()
+    except ProfilingError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.get("/debug/memory", dependencies=[Depends(_debug_access)])
+async def get_memory_snapshot(top: int = 30, key: str = "lineno", rebase: bool = False, format: str = "json"):
+    """Top allocation sites and growth since the baseline (rebase=true moves the baseline); format=raw downloads a tracemalloc dump"""
+    try:
+        if format == "raw":
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            return Response(content=await memory_tracer.dump(), media_type="application/octet-stream", headers={"Content-Disposition": f"attachment; filename=memory-{stamp}.tracemalloc"})
+        return await memory_tracer.report(max(1, top), key, rebase)
+    except ProfilingError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.get("/debug/tasks", dependencies=[Depends(_debug_access)])
+async def get_task_dump(format: str = "json"):
+    """Every pending asyncio task with its await chain, plus all thread stacks (for stuck queries/ingests)"""
+    dump = task_dump()
+    if format == "text":
+        return PlainTextResponse(format_task_dump(dump))
+    return dump
+
+@app.get("/debug", dependencies=[Depends(_debug_access)])
+async def get_debug_status():
+    return {"cpu_profile": profiler.describe(), "memory": memory_tracer.describe()}
+
 @app.get("/")
 async def root():
     static_dir = os.path.join(os.path.dirname(__file__), "static")
@@ -635,9 +1523,22 @@ async def root():
             "version": "1.0.0", 
             "endpoints": {
                 "ingest": "POST /ingest", 
+                "ingest/stream": "POST /ingest/stream?doc_id=... (raw text/plain or application/pdf body, processed while it uploads)",
+                "documents": "GET /documents, PUT/DELETE /documents/{doc_id}",
+                "workspaces": "GET /workspaces, POST /workspaces/{name}/close; /workspaces/{name}/ingest|documents|query|context|search|graph/view|... scope an endpoint to a corpus",
+                "defaulters": "GET /defaulters/lookup?name=...",
                 "query": "POST /query", 
+                "query/batch": "POST /query/batch (shared embedding and vector search, answers streamed as NDJSON)",
+                "search": "GET /search?q=... (BM25 lexical lookup, no LLM/embedding calls)",
+                "context": "POST /context (retrieval only, single or batch)",
+                "keywords/compare": "POST /keywords/compare (local vs LLM keyword extraction)",
                 "health": "GET /health",
+                "metrics": "GET /metrics",
+                "debug": "GET /debug/profile/cpu, GET /debug/memory, POST /debug/memory/start|stop, GET /debug/tasks (needs DEBUG_TOKEN)",
+                "snapshots": "GET/POST /snapshots, POST /snapshots/{id}/restore, DELETE /snapshots/{id}",
+                "extraction-cache": "GET /extraction-cache, GET /extraction-cache/export, POST /extraction-cache/import",
                 "graph": "GET /graph",
+                "graph/view": "GET /graph/view?level=communities|hubs|detail (server-side layout, cached)",
                 "graph/query": "GET /graph/query?query=...&mode=..."
             }, 
             "docs": "/docs"
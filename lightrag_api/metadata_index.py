@@ -0,0 +1,147 @@
+"""
+Chunk metadata index for filtered retrieval
+Every ingested document is recorded with metadata parsed from its doc_id
+(contract form number and year for ids like 48_2025, document type) and,
+per LightRAG chunk, the `--- Page N ---` pages it came from. Query filters
+resolve to a candidate set of chunk ids before any vector or BM25 scoring,
+so only those chunks are scored and only they can reach the prompt.
+
+Persisted as metadata_index.json in WORKING_DIR.
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from defaulters import is_defaulters_doc
+
+METADATA_INDEX_FILE = "metadata_index.json"
+DOC_TYPES = ["contract", "defaulters"]
+
+# Contract form ids: <form>_<year> (48_2025, 64-2019)
+_FORM_YEAR_RE = re.compile(r"(?<![\d])(\d{1,4})[_-]((?:19|20)\d{2})(?![\d])")
+_YEAR_RE = re.compile(r"(?<![\d])((?:19|20)\d{2})(?![\d])")
+
+
+def doc_metadata(doc_id: str) -> Dict[str, Any]:
+    """Metadata encoded in an external doc_id"""
+    form, year = None, None
+    match = _FORM_YEAR_RE.search(doc_id)
+    if match:
+        form, year = match.group(1), int(match.group(2))
+    else:
+        years = _YEAR_RE.findall(doc_id)
+        if years:
+            year = int(years[0])
+    return {"form": form, "year": year, "type": "defaulters" if is_defaulters_doc(doc_id) else "contract"}
+
+
+class MetadataIndex:
+    """doc_id -> {form, year, type, chunks: {chunk_id: [pages]}}"""
+
+    def __init__(self, working_dir: str):
+        self.path = os.path.join(working_dir, METADATA_INDEX_FILE)
+        self.lock = asyncio.Lock()
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self.loaded = False
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._docs = json.load(f)
+                self.loaded = True
+            except Exception as e:
+                print(f"Warning: Could not load metadata index {self.path}: {e}")
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._docs, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def sync_document(self, rag, doc_id: str, sections: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Record a document's metadata and its chunks' pages (sections: manifest section_id -> {"pages"})"""
+        section_ids = list(sections)
+        statuses = await rag.doc_status.get_by_ids(section_ids) if section_ids else []
+        chunks: Dict[str, List[int]] = {}
+        for section_id, status in zip(section_ids, statuses):
+            for chunk_id in (status or {}).get("chunks_list") or []:
+                chunks.setdefault(chunk_id, []).extend(sections[section_id].get("pages", []))
+        async with self.lock:
+            self._docs[doc_id] = {**doc_metadata(doc_id), "chunks": {cid: sorted(set(p)) for cid, p in chunks.items()}}
+            self.save()
+        return {**doc_metadata(doc_id), "chunks": len(chunks)}
+
+    async def remove_document(self, doc_id: str):
+        async with self.lock:
+            if self._docs.pop(doc_id, None) is not None:
+                self.save()
+
+    async def ensure_built(self, rag, manifest):
+        """Index documents ingested before the metadata index existed"""
+        if self.loaded:
+            return
+        self.loaded = True
+        start = time.perf_counter()
+        missing = [(doc_id, entry) for doc_id, entry in manifest.items() if doc_id not in self._docs]
+        for doc_id, entry in missing:
+            await self.sync_document(rag, doc_id, entry["sections"])
+        if missing:
+            print(f"✓ Metadata index built for {len(missing)} existing documents in {time.perf_counter() - start:.1f}s")
+
+    def candidates(
+        self,
+        doc_ids: Optional[List[str]] = None,
+        forms: Optional[List[str]] = None,
+        years: Optional[List[int]] = None,
+        doc_type: Optional[str] = None,
+        pages: Optional[List[int]] = None,
+    ) -> Set[str]:
+        """Chunk ids matching every given filter (a list matches any of its values)"""
+        page_set = set(pages or [])
+        result: Set[str] = set()
+        for doc_id, entry in self._docs.items():
+            if doc_ids and doc_id not in doc_ids:
+                continue
+            if forms and entry.get("form") not in forms:
+                continue
+            if years and entry.get("year") not in years:
+                continue
+            if doc_type and entry.get("type") != doc_type:
+                continue
+            for chunk_id, chunk_pages in entry["chunks"].items():
+                if not page_set or page_set.intersection(chunk_pages):
+                    result.add(chunk_id)
+        return result
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self._docs),
+            "chunks": sum(len(entry["chunks"]) for entry in self._docs.values()),
+            "forms": sorted({e["form"] for e in self._docs.values() if e.get("form")}),
+            "years": sorted({e["year"] for e in self._docs.values() if e.get("year")}),
+        }
+
+
+async def filtered_vector_search(chunks_vdb, query: str, candidates: Iterable[str], top_k: int, query_embedding=None) -> List[Dict[str, Any]]:
+    """Cosine search restricted to candidate chunk ids (only their vectors are loaded and scored)"""
+    ids = list(candidates)
+    if not ids:
+        return []
+    vectors = await chunks_vdb.get_vectors_by_ids(ids)
+    if not vectors:
+        return []
+    if query_embedding is None:
+        query_embedding = (await chunks_vdb.embedding_func([query]))[0]
+    ids = list(vectors)
+    matrix = np.asarray([vectors[chunk_id] for chunk_id in ids], dtype=np.float32)
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+    scores = matrix @ query_vector / np.where(norms == 0, 1.0, norms)
+    order = [i for i in np.argsort(-scores)[:top_k] if scores[i] >= chunks_vdb.cosine_better_than_threshold]
+    records = await chunks_vdb.get_by_ids([ids[i] for i in order])
+    return [{**record, "distance": float(scores[i])} for i, record in zip(order, records) if record]
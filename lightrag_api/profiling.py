@@ -0,0 +1,301 @@
+"""
+On-demand CPU, memory and task diagnostics for a running server
+Nothing here runs until a debug endpoint asks for it:
+
+    - profile_cpu(): samples every thread's stack (sys._current_frames) from
+      a helper thread every interval_ms for a fixed window and returns
+      collapsed stacks ("thread;outer;...;leaf count"), which flamegraph.pl,
+      speedscope and inferno open directly. mode="pstats" instead runs
+      cProfile on the event-loop thread for the window and returns a pstats
+      dump (snakeviz, `python -m pstats`).
+    - MemoryTracer: tracemalloc on demand; snapshots report the top
+      allocation sites and the diff against the baseline taken at start, and
+      can be downloaded as a tracemalloc dump (tracemalloc.Snapshot.load).
+    - task_dump(): every pending asyncio task with its await chain, plus the
+      stacks of all threads (LightRAG offloads work to thread pools).
+
+Only one CPU profile runs at a time.
+"""
+
+import asyncio
+import cProfile
+import io
+import linecache
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "120"))
+PROFILE_MODES = ["collapsed", "pstats"]
+MEMORY_KEY_TYPES = ["lineno", "filename", "traceback"]
+# Leaf frames that mean a thread is parked, not working
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilingError(Exception):
+    """Bad profiling request or a profiler already running; carries the HTTP status to return"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _frame_lines(frames) -> List[str]:
+    lines = []
+    for frame in frames:
+        code = frame.f_code
+        source = linecache.getline(code.co_filename, frame.f_lineno).strip()
+        lines.append(f'File "{code.co_filename}", line {frame.f_lineno}, in {code.co_name}' + (f": {source}" if source else ""))
+    return lines
+
+
+def _stack(frame) -> List[Any]:
+    """Frames from outermost to innermost"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames[::-1]
+
+
+class _Sampler:
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+
+    def run(self, seconds: float, interval: float, include_idle: bool):
+        own = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    self.idle_samples += 1
+                    if not include_idle:
+                        continue
+                stack = [names.get(ident, str(ident))] + [_frame_label(f) for f in _stack(frame)]
+                self.counts[";".join(label.replace(";", ":") for label in stack)] += 1
+                self.samples += 1
+            time.sleep(interval)
+
+
+class Profiler:
+    """Time-boxed CPU profiles; idle (zero overhead) between requests"""
+
+    def __init__(self):
+        self.active: Optional[str] = None
+        self.last: Optional[Dict[str, Any]] = None
+
+    def _check(self, seconds: float, mode: str):
+        if mode not in PROFILE_MODES:
+            raise ProfilingError(f"mode must be one of: {', '.join(PROFILE_MODES)}")
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ProfilingError(f"seconds must be in (0, {PROFILE_MAX_SECONDS}]")
+        if self.active is not None:
+            raise ProfilingError(f"A {self.active} profile is already running", status_code=409)
+
+    async def profile_cpu(self, seconds: float, mode: str = "collapsed", interval_ms: float = 5.0, include_idle: bool = False) -> bytes:
+        """Collapsed stacks of all threads (sampling) or a pstats dump of the event-loop thread (cProfile)"""
+        self._check(seconds, mode)
+        self.active = mode
+        start = time.time()
+        try:
+            if mode == "pstats":
+                body, info = await self._cprofile(seconds)
+            else:
+                sampler = _Sampler()
+                await asyncio.to_thread(sampler.run, seconds, max(interval_ms, 1.0) / 1000, include_idle)
+                body = "".join(f"{stack} {count}\n" for stack, count in sampler.counts.most_common()).encode("utf-8")
+                info = {"samples": sampler.samples, "idle_samples": sampler.idle_samples, "stacks": len(sampler.counts), "interval_ms": interval_ms}
+        finally:
+            self.active = None
+        self.last = {"mode": mode, "started_at": start, "seconds": seconds, "bytes": len(body), **info}
+        print(f"✓ CPU profile ({mode}, {seconds}s): {len(body)} bytes")
+        return body
+
+    async def _cprofile(self, seconds: float):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiler (sys.setprofile) is active on this thread
+            raise ProfilingError(str(e), status_code=409)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        fd, path = tempfile.mkstemp(suffix=".pstats")
+        os.close(fd)
+        try:
+            stats = pstats.Stats(profiler)
+            stats.dump_stats(path)
+            with open(path, "rb") as f:
+                body = f.read()
+        finally:
+            os.remove(path)
+        return body, {"functions": len(stats.stats), "calls": stats.total_calls}
+
+    @staticmethod
+    def pstats_text(body: bytes, limit: int = 50, sort: str = "cumulative") -> str:
+        """Human-readable top functions of a pstats dump"""
+        fd, path = tempfile.mkstemp(suffix=".pstats")
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        try:
+            out = io.StringIO()
+            pstats.Stats(path, stream=out).sort_stats(sort).print_stats(limit)
+            return out.getvalue()
+        finally:
+            os.remove(path)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"active": self.active, "last": self.last, "max_seconds": PROFILE_MAX_SECONDS}
+
+
+class MemoryTracer:
+    """tracemalloc started on demand; its overhead (roughly 2x allocation cost) applies only while tracing"""
+
+    def __init__(self):
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.started_at: Optional[float] = None
+        self.frames = 0
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    @staticmethod
+    async def _snapshot() -> tracemalloc.Snapshot:
+        snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+        return snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ])
+
+    async def start(self, frames: int = 25) -> Dict[str, Any]:
+        if self.tracing:
+            raise ProfilingError("Memory tracing is already running", status_code=409)
+        self.frames = max(1, min(frames, 100))
+        tracemalloc.start(self.frames)
+        self.started_at = time.time()
+        self.baseline = await self._snapshot()
+        print(f"✓ Memory tracing started ({self.frames} frames)")
+        return self.describe()
+
+    def stop(self) -> Dict[str, Any]:
+        if not self.tracing:
+            raise ProfilingError("Memory tracing is not running", status_code=409)
+        tracemalloc.stop()
+        self.baseline, self.started_at = None, None
+        print("✓ Memory tracing stopped")
+        return self.describe()
+
+    async def report(self, top: int = 30, key_type: str = "lineno", rebase: bool = False) -> Dict[str, Any]:
+        """Top allocation sites now and the largest changes since the baseline"""
+        if not self.tracing:
+            raise ProfilingError("Memory tracing is not running (POST /debug/memory/start first)", status_code=409)
+        if key_type not in MEMORY_KEY_TYPES:
+            raise ProfilingError(f"key must be one of: {', '.join(MEMORY_KEY_TYPES)}")
+        snapshot = await self._snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+
+        def stat_row(stat) -> Dict[str, Any]:
+            row = {"size_kb": round(stat.size / 1024, 1), "count": stat.count, "where": stat.traceback.format(limit=self.frames if key_type == "traceback" else 1)}
+            if hasattr(stat, "size_diff"):
+                row.update({"size_diff_kb": round(stat.size_diff / 1024, 1), "count_diff": stat.count_diff})
+            return row
+
+        result = {
+            **self.describe(),
+            "traced_mb": round(current / 1e6, 2),
+            "peak_mb": round(peak / 1e6, 2),
+            "top": [stat_row(s) for s in snapshot.statistics(key_type)[:top]],
+            "growth": [stat_row(s) for s in snapshot.compare_to(self.baseline, key_type)[:top]],
+        }
+        if rebase:
+            self.baseline = snapshot
+        return result
+
+    async def dump(self) -> bytes:
+        """The current snapshot as a tracemalloc dump (tracemalloc.Snapshot.load opens it)"""
+        if not self.tracing:
+            raise ProfilingError("Memory tracing is not running (POST /debug/memory/start first)", status_code=409)
+        snapshot = await self._snapshot()
+        fd, path = tempfile.mkstemp(suffix=".tracemalloc")
+        os.close(fd)
+        try:
+            snapshot.dump(path)
+            with open(path, "rb") as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"tracing": self.tracing, "frames": self.frames if self.tracing else 0, "started_at": self.started_at}
+
+
+def _await_chain(coro) -> List[Any]:
+    """Frames of a suspended coroutine and everything it is awaiting, outermost first"""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is not None:
+            frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+def task_dump() -> Dict[str, Any]:
+    """Pending asyncio tasks with their await chains, and the stack of every thread"""
+    current = asyncio.current_task()
+    tasks = []
+    for task in asyncio.all_tasks():
+        if task is current:
+            continue
+        coro = task.get_coro()
+        tasks.append({
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "state": "cancelling" if task.cancelling() else "pending",
+            "stack": _frame_lines(_await_chain(coro) or task.get_stack()),
+        })
+    tasks.sort(key=lambda t: len(t["stack"]), reverse=True)
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    threads = [
+        {"name": names.get(ident, str(ident)), "ident": ident, "stack": _frame_lines(_stack(frame))}
+        for ident, frame in sys._current_frames().items()
+    ]
+    return {"captured_at": time.time(), "task_count": len(tasks), "tasks": tasks, "thread_count": len(threads), "threads": threads}
+
+
+def format_task_dump(dump: Dict[str, Any]) -> str:
+    lines = [f"{dump['task_count']} pending tasks, {dump['thread_count']} threads"]
+    for task in dump["tasks"]:
+        lines.append(f"\nTask {task['name']} ({task['coro']}, {task['state']}):")
+        lines.extend(f"  {line}" for line in task["stack"])
+    for thread in dump["threads"]:
+        lines.append(f"\nThread {thread['name']} ({thread['ident']}):")
+        lines.extend(f"  {line}" for line in thread["stack"])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,159 @@
+"""
+Automatic query-mode router for mode="auto"
+Classifies a question without an LLM call, from entity-name matches in the
+graph, the query embedding and simple lexical heuristics, and picks the
+cheapest retrieval mode likely to answer it (naive < local/global < hybrid).
+Every decision is appended to a JSONL log for offline evaluation.
+"""
+
+import json
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+ROUTER_LOG_FILE = "query_router_log.jsonl"
+ROUTER_USE_EMBEDDING = os.getenv("ROUTER_USE_EMBEDDING", "true").lower() == "true"
+# Minimum cosine-similarity margin between prototype groups before the embedding casts a vote
+ROUTER_EMBEDDING_MARGIN = float(os.getenv("ROUTER_EMBEDDING_MARGIN", "0.03"))
+# Longest entity name (in words) matched against the query
+_MAX_NAME_WORDS = 6
+
+THEMATIC_RE = re.compile(
+    r"\b(overview|summar\w*|main (?:themes?|topics?|points?)|in general|generally|overall|compare|comparison|"
+    r"differences?|similarit\w*|trends?|patterns?|all (?:contracts|forms|documents|parties)|across|common|typical\w*|"
+    r"what (?:is|are) (?:this|these) (?:about|documents?))\b",
+    re.IGNORECASE,
+)
+RELATIONAL_RE = re.compile(
+    r"\b(who|which (?:party|parties|company|companies|buyer|seller)|relationship|related|between|involved|"
+    r"obligations? of|responsib\w+|liable|against|with whom)\b",
+    re.IGNORECASE,
+)
+SPECIFIC_RE = re.compile(
+    r"(\bclause\s+\d+|\bsection\s+\d+|\bart(?:icle)?\.?\s*\d+|\bform\s+(?:no\.?\s*)?\d+|\b\d+_\d{4}\b|"
+    r"\baward\s+(?:no\.?\s*)?\d+|[\"“].+?[\"”]|\bwhat (?:does|did) .+ (?:say|state|mean)\b|\bdefine\b|\bdefinition\b)",
+    re.IGNORECASE,
+)
+
+THEMATIC_PROTOTYPES = [
+    "Give an overview of the main themes across all contracts",
+    "Summarize the general obligations of buyers and sellers",
+    "What are the common patterns in arbitration disputes?",
+    "Compare the contract forms and their differences",
+]
+SPECIFIC_PROTOTYPES = [
+    "What does clause 12 say about the period of delivery?",
+    "What is the notice deadline in contract form 48?",
+    "Which company was named in award number 14-123?",
+    "What is the definition of force majeure in this form?",
+]
+
+
+def _cosine(vector: np.ndarray, matrix: np.ndarray) -> Optional[np.ndarray]:
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+    if not np.all(norms > 0):
+        return None
+    return matrix @ vector / norms
+
+
+class QueryRouter:
+    """Cheap question classifier that maps a query to a LightRAG retrieval mode"""
+
+    def __init__(self, working_dir: str, embed: Optional[Callable] = None):
+        self.log_path = os.path.join(working_dir, ROUTER_LOG_FILE)
+        self.embed = embed if ROUTER_USE_EMBEDDING else None
+        self._names: Optional[Dict[str, str]] = None
+        self._prototypes: Optional[Dict[str, np.ndarray]] = None
+
+    def invalidate(self):
+        """Drop the cached entity vocabulary (call after the graph changes)"""
+        self._names = None
+
+    async def _entity_names(self, rag) -> Dict[str, str]:
+        if self._names is None:
+            labels = await rag.chunk_entity_relation_graph.get_all_labels()
+            self._names = {
+                label.lower(): label for label in labels
+                if len(label) >= 3 and len(label.split()) <= _MAX_NAME_WORDS
+            }
+        return self._names
+
+    async def match_entities(self, rag, query: str) -> List[str]:
+        """Graph entity names mentioned in the query, longest first"""
+        names = await self._entity_names(rag)
+        words = re.findall(r"[\w'&./-]+", query.lower())
+        matches = []
+        for size in range(min(_MAX_NAME_WORDS, len(words)), 0, -1):
+            for i in range(len(words) - size + 1):
+                name = names.get(" ".join(words[i:i + size]))
+                if name and name not in matches:
+                    matches.append(name)
+        return matches
+
+    async def _embedding_vote(self, query: str) -> Optional[str]:
+        if self.embed is None:
+            return None
+        if self._prototypes is None:
+            vectors = np.asarray(await self.embed(THEMATIC_PROTOTYPES + SPECIFIC_PROTOTYPES), dtype=np.float32)
+            self._prototypes = {
+                "thematic": vectors[:len(THEMATIC_PROTOTYPES)],
+                "specific": vectors[len(THEMATIC_PROTOTYPES):],
+            }
+        query_vector = np.asarray(await self.embed([query]), dtype=np.float32)[0]
+        thematic = _cosine(query_vector, self._prototypes["thematic"])
+        specific = _cosine(query_vector, self._prototypes["specific"])
+        if thematic is None or specific is None:
+            return None
+        margin = float(thematic.max() - specific.max())
+        if abs(margin) < ROUTER_EMBEDDING_MARGIN:
+            return None
+        return "thematic" if margin > 0 else "specific"
+
+    async def classify(self, rag, query: str) -> Dict[str, Any]:
+        """Return {"mode", "reason", "features", "classification_ms"} for a query"""
+        start = time.perf_counter()
+        entities = await self.match_entities(rag, query)
+        features = {
+            "entities": entities[:10],
+            "thematic": bool(THEMATIC_RE.search(query)),
+            "relational": bool(RELATIONAL_RE.search(query)),
+            "specific": bool(SPECIFIC_RE.search(query)),
+            "words": len(query.split()),
+        }
+        try:
+            features["embedding_vote"] = await self._embedding_vote(query)
+        except Exception as e:
+            print(f"Warning: Router embedding vote failed: {e}")
+            features["embedding_vote"] = None
+
+        thematic = features["thematic"] or (features["embedding_vote"] == "thematic" and not features["specific"])
+        if thematic and entities:
+            mode, reason = "hybrid", "broad question about known entities"
+        elif thematic:
+            mode, reason = "global", "broad question without specific entities"
+        elif entities and (features["relational"] or len(entities) > 1):
+            mode, reason = "local", "question about specific entities and their relations"
+        elif features["specific"] or features["embedding_vote"] == "specific" or not entities:
+            mode, reason = "naive", "specific text lookup"
+        else:
+            mode, reason = "local", "single known entity"
+
+        return {
+            "mode": mode,
+            "reason": reason,
+            "features": features,
+            "classification_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+
+    def record(self, query: str, decision: Dict[str, Any], query_ms: Optional[float] = None):
+        """Append a routing decision (and the resulting query latency) to the evaluation log"""
+        entry = {"ts": time.time(), "query": query, **decision, "query_ms": query_ms}
+        print(f"Router: mode={decision['mode']} ({decision['reason']}) in {decision['classification_ms']}ms")
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"Warning: Could not write router log: {e}")
@@ -0,0 +1,222 @@
+"""
+Priority scheduling of LLM and embedding calls
+Queries, ingestion and batch jobs share the same GPU. Without an order
+between them a large upload queues dozens of extraction calls (and their
+embedding upserts) ahead of an interactive question, whose answer then
+waits for the whole backlog. PriorityScheduler sits in front of each
+backend (one for the LLM, one for embeddings) and grants its slots by
+traffic class:
+
+    - interactive   /query, /context: someone is waiting for the answer
+    - ingest        document ingestion, updates and deletions
+    - maintenance   /query/batch regression runs, /keywords/compare
+
+Waiting calls are served by weighted fair queuing (start-time fair
+queuing over per-class virtual clocks): with weights 8/2/1 and a backlog
+in every class, grants go out eight interactive to two ingest to one
+maintenance, and a class that was idle does not bank credit while away. SCHEDULER_*_RESERVED
+slots can only be used by interactive calls, so a question never waits for
+a busy GPU to drain a backlog of ingestion calls: it waits for one of the
+reserved slots at most.
+
+A call may also name a group with its own limit (the LLM role, whose
+MAX_ASYNC caps it). The limit is checked before a slot is granted, so a
+call whose group is full keeps waiting without holding a slot, and the
+next call of its class whose group has room goes first.
+
+The class of a call comes from, in order: an explicit traffic_class=...
+keyword, the request's class set with use_traffic_class() by the endpoint,
+and a default (LLM calls by role, embeddings by LightRAG's own _priority).
+LightRAG runs its queued LLM/embedding calls in worker tasks that do not
+see the request's context, so tag_traffic_class() wraps those queued
+functions and passes the class along as a keyword.
+
+Configuration:
+    SCHEDULER_LLM_SLOTS, SCHEDULER_EMBEDDING_SLOTS   concurrent calls per backend
+    SCHEDULER_LLM_RESERVED, SCHEDULER_EMBEDDING_RESERVED   slots kept for interactive calls
+    SCHEDULER_WEIGHT_INTERACTIVE, SCHEDULER_WEIGHT_INGEST, SCHEDULER_WEIGHT_MAINTENANCE
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+TRAFFIC_CLASSES = ["interactive", "ingest", "maintenance"]
+
+SCHEDULER_WEIGHTS = {
+    "interactive": float(os.getenv("SCHEDULER_WEIGHT_INTERACTIVE", "8")),
+    "ingest": float(os.getenv("SCHEDULER_WEIGHT_INGEST", "2")),
+    "maintenance": float(os.getenv("SCHEDULER_WEIGHT_MAINTENANCE", "1")),
+}
+# Calls the GPU serves in parallel; defaults to Ollama's OLLAMA_NUM_PARALLEL if set, else 4.
+# Slots at or above the sum of the LLM roles' MAX_ASYNC leave nothing to schedule.
+SCHEDULER_LLM_SLOTS = int(os.getenv("SCHEDULER_LLM_SLOTS", os.getenv("OLLAMA_NUM_PARALLEL", "4")))
+# 0 = EMBEDDING_MAX_ASYNC
+SCHEDULER_EMBEDDING_SLOTS = int(os.getenv("SCHEDULER_EMBEDDING_SLOTS", "0"))
+SCHEDULER_LLM_RESERVED = int(os.getenv("SCHEDULER_LLM_RESERVED", "1"))
+SCHEDULER_EMBEDDING_RESERVED = int(os.getenv("SCHEDULER_EMBEDDING_RESERVED", "1"))
+
+# LightRAG's _priority for query-time calls (lower is more urgent; ingestion uses 8 and 10)
+_QUERY_PRIORITY = 5
+_SAMPLES = 1000
+
+_traffic_class: ContextVar[Optional[str]] = ContextVar("traffic_class", default=None)
+
+
+def use_traffic_class(traffic_class: str):
+    """Set the class of every model call made by the current request (its task and the tasks it starts)"""
+    if traffic_class not in TRAFFIC_CLASSES:
+        raise ValueError(f"Unknown traffic class: {traffic_class}")
+    _traffic_class.set(traffic_class)
+
+
+def current_traffic_class() -> Optional[str]:
+    return _traffic_class.get()
+
+
+def tag_traffic_class(func: Callable) -> Callable:
+    """
+    Wrap one of LightRAG's queued model functions so each call carries its traffic class
+
+    The class is resolved in the caller's context, before LightRAG's queue
+    hands the call to a worker task, and forwarded as traffic_class=...
+    Untagged requests fall back to LightRAG's own priority: query calls are
+    interactive, everything else is ingestion.
+    """
+    @wraps(func)
+    async def tagged(*args, _priority: int = 10, **kwargs):
+        if not kwargs.get("traffic_class"):
+            kwargs["traffic_class"] = _traffic_class.get() or ("interactive" if _priority <= _QUERY_PRIORITY else "ingest")
+        return await func(*args, _priority=_priority, **kwargs)
+    return tagged
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class PriorityScheduler:
+    """Grants a backend's concurrency slots to waiting calls by weighted fair queuing across traffic classes"""
+
+    def __init__(self, name: str, slots: int, reserved: int = 0, weights: Optional[Dict[str, float]] = None, limits: Optional[Dict[str, int]] = None):
+        self.name = name
+        self.slots = max(1, slots)
+        # At least one slot stays open to the other classes
+        self.reserved = max(0, min(reserved, self.slots - 1))
+        self.weights = {cls: max(float((weights or SCHEDULER_WEIGHTS)[cls]), 0.001) for cls in TRAFFIC_CLASSES}
+        self._waiting: Dict[str, Deque[Tuple[asyncio.Future, float, Optional[str]]]] = {cls: deque() for cls in TRAFFIC_CLASSES}
+        self._in_flight = {cls: 0 for cls in TRAFFIC_CLASSES}
+        # Concurrent calls allowed per group (e.g. LLM role); groups without a limit only share the slots
+        self.limits = {group: max(1, limit) for group, limit in (limits or {}).items()}
+        self._group_in_flight = {group: 0 for group in self.limits}
+        # Finish tag of each class's last grant, and the start tag of the most recent grant (virtual time)
+        self._finish = {cls: 0.0 for cls in TRAFFIC_CLASSES}
+        self._virtual = 0.0
+        self.stats = {cls: {"granted": 0, "cancelled": 0, "max_queued": 0} for cls in TRAFFIC_CLASSES}
+        self._waits_ms = {cls: deque(maxlen=_SAMPLES) for cls in TRAFFIC_CLASSES}
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    def _can_start(self, traffic_class: str) -> bool:
+        if self.in_flight >= self.slots:
+            return False
+        if traffic_class == "interactive":
+            return True
+        return self.in_flight - self._in_flight["interactive"] < self.slots - self.reserved
+
+    def _group_has_room(self, group: Optional[str]) -> bool:
+        return group not in self.limits or self._group_in_flight[group] < self.limits[group]
+
+    def _next_waiter(self, traffic_class: str) -> Optional[Tuple[asyncio.Future, float, Optional[str]]]:
+        """Oldest waiter of the class whose group has room"""
+        for waiter in self._waiting[traffic_class]:
+            # A done future was cancelled while waiting; its task removes it when it resumes
+            if not waiter[0].done() and self._group_has_room(waiter[2]):
+                return waiter
+        return None
+
+    def _start_tag(self, traffic_class: str) -> float:
+        return max(self._finish[traffic_class], self._virtual)
+
+    def _dispatch(self):
+        while True:
+            ready = {}
+            for cls in TRAFFIC_CLASSES:
+                if self._can_start(cls):
+                    waiter = self._next_waiter(cls)
+                    if waiter is not None:
+                        ready[cls] = waiter
+            if not ready:
+                return
+            # Smallest start tag first; ties go to the more urgent class (TRAFFIC_CLASSES order)
+            traffic_class = min(ready, key=self._start_tag)
+            waiter = ready[traffic_class]
+            self._waiting[traffic_class].remove(waiter)
+            future, queued, group = waiter
+            start = self._start_tag(traffic_class)
+            self._virtual = start
+            self._finish[traffic_class] = start + 1.0 / self.weights[traffic_class]
+            self._in_flight[traffic_class] += 1
+            if group in self.limits:
+                self._group_in_flight[group] += 1
+            self.stats[traffic_class]["granted"] += 1
+            self._waits_ms[traffic_class].append((time.perf_counter() - queued) * 1000)
+            future.set_result(None)
+
+    def _release(self, traffic_class: str, group: Optional[str]):
+        self._in_flight[traffic_class] -= 1
+        if group in self.limits:
+            self._group_in_flight[group] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, traffic_class: Optional[str] = None, group: Optional[str] = None):
+        """Hold one of the backend's slots (and one of the group's, if it has a limit) for the duration of a call"""
+        traffic_class = traffic_class if traffic_class in self.weights else "interactive"
+        waiter = (asyncio.get_running_loop().create_future(), time.perf_counter(), group)
+        waiting = self._waiting[traffic_class]
+        waiting.append(waiter)
+        self.stats[traffic_class]["max_queued"] = max(self.stats[traffic_class]["max_queued"], len(waiting))
+        self._dispatch()
+        try:
+            await waiter[0]
+        except BaseException:
+            if waiter[0].done() and not waiter[0].cancelled():
+                # Granted just as the caller was cancelled; hand the slot on
+                self._release(traffic_class, group)
+            elif waiter in waiting:
+                waiting.remove(waiter)
+            self.stats[traffic_class]["cancelled"] += 1
+            raise
+        try:
+            yield
+        finally:
+            self._release(traffic_class, group)
+
+    def metrics(self) -> Dict[str, Any]:
+        classes = {}
+        for cls in TRAFFIC_CLASSES:
+            waits = self._waits_ms[cls]
+            classes[cls] = {
+                "weight": self.weights[cls],
+                "queued": len(self._waiting[cls]),
+                "in_flight": self._in_flight[cls],
+                **self.stats[cls],
+                "wait_ms": {
+                    "avg": round(sum(waits) / len(waits), 1) if waits else 0.0,
+                    "p95": round(_percentile(waits, 0.95), 1),
+                    "max": round(max(waits), 1) if waits else 0.0,
+                },
+            }
+        result = {"slots": self.slots, "reserved_interactive": self.reserved, "in_flight": self.in_flight, "classes": classes}
+        if self.limits:
+            result["groups"] = {group: {"limit": limit, "in_flight": self._group_in_flight[group]} for group, limit in self.limits.items()}
+        return result
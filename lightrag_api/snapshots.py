@@ -0,0 +1,373 @@
+"""
+Incremental, content-addressed snapshots of a workspace's storage files
+A snapshot is a manifest (snapshots/<id>.json) listing every storage file in
+the workspace directory as a sequence of blocks. Blocks are cut at
+content-defined boundaries (a rolling gear hash, SNAPSHOT_BLOCK_KB on
+average), zlib-compressed and stored once under blocks/<sha256>, so a later
+snapshot only writes the blocks that changed - an append to a JSON store or
+a vector matrix leaves the earlier blocks, and their hashes, untouched.
+
+Vector stores (vdb_*.json: JSON metadata plus a base64 float32 matrix) are
+stored as two block streams, the metadata and the raw matrix. A restore can
+write the matrix as a raw sidecar file (<file>.f32) next to a JSON file
+without the base64 matrix; MmapNanoVectorDB then memory-maps it
+copy-on-write instead of decoding base64, so a restored workspace answers
+queries as soon as its JSON stores are parsed. The next save of that store
+writes the stock format again and removes the sidecar.
+
+The caller quiesces document writes and flushes the stores before create()
+(see Workspace.quiesced/flush); files that still change while being read
+are re-read. The snapshot directory can be synced to object storage as is:
+only new block files appear between snapshots.
+
+    python snapshots.py create DIR [LABEL]
+    python snapshots.py restore ID DIR [--no-mmap]
+    python snapshots.py list | delete ID
+
+The CLI is for a stopped server; while it runs, use the /snapshots endpoints.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from lightrag.kg import nano_vector_db_impl
+from nano_vectordb import NanoVectorDB
+
+from chunk_dedup import FINGERPRINT_FILE
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "/app/snapshots")
+SNAPSHOT_BLOCK_KB = int(os.getenv("SNAPSHOT_BLOCK_KB", "128"))
+SNAPSHOT_COMPRESS_LEVEL = int(os.getenv("SNAPSHOT_COMPRESS_LEVEL", "3"))
+SNAPSHOT_MMAP_VECTORS = os.getenv("SNAPSHOT_MMAP_VECTORS", "true").lower() == "true"
+MATRIX_SUFFIX = ".f32"
+_VECTOR_FILE = re.compile(r"^vdb_.*\.json$")
+# Shared by all workspaces (and rebuilt on demand), so not part of any one corpus
+_EXCLUDED = {FINGERPRINT_FILE}
+_GEAR_WINDOW = 48
+_SEGMENT = 8 * 1024 * 1024
+_READ_ATTEMPTS = 3
+_GEAR = np.random.RandomState(0x5EED).randint(0, 2**32, size=256, dtype=np.uint64)
+
+
+class SnapshotError(Exception):
+    """Unknown snapshot, corrupt block or unreadable store; carries the HTTP status to return"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def cut_points(data: bytes, average: int = SNAPSHOT_BLOCK_KB * 1024) -> List[int]:
+    """Block end offsets at content-defined boundaries (between average/4 and average*4 bytes apart)"""
+    size = len(data)
+    minimum, maximum = average // 4, average * 4
+    if size <= minimum:
+        return [size] if size else []
+    mask = np.uint64((1 << max(int(average).bit_length() - 1, 1)) - 1)
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    candidates: List[int] = []
+    # Windowed sum of per-byte random values, computed per segment to bound memory
+    for start in range(0, size, _SEGMENT):
+        lo = max(0, start - _GEAR_WINDOW)
+        sums = np.cumsum(_GEAR[buffer[lo:start + _SEGMENT]], dtype=np.uint64)
+        window = sums[_GEAR_WINDOW:] - sums[:-_GEAR_WINDOW] if len(sums) > _GEAR_WINDOW else sums[:0]
+        offset = lo + _GEAR_WINDOW + 1
+        hits = np.nonzero((window & mask) == 0)[0] + offset
+        candidates.extend(int(h) for h in hits if h >= start)
+    cuts, last = [], 0
+    for point in candidates:
+        while point - last > maximum:
+            last += maximum
+            cuts.append(last)
+        if point - last >= minimum:
+            cuts.append(point)
+            last = point
+    while size - last > maximum:
+        last += maximum
+        cuts.append(last)
+    if last < size:
+        cuts.append(size)
+    return cuts
+
+
+def _read_stable(path: str) -> bytes:
+    """File contents, re-read if it changed while being read"""
+    for _ in range(_READ_ATTEMPTS):
+        before = os.stat(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        after = os.stat(path)
+        if (before.st_mtime_ns, before.st_size) == (after.st_mtime_ns, after.st_size) and len(data) == after.st_size:
+            return data
+    raise SnapshotError(f"{os.path.basename(path)} kept changing while being read", status_code=409)
+
+
+def _write_atomic(path: str, chunks) -> int:
+    tmp_path = f"{path}.tmp"
+    written = 0
+    with open(tmp_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return written
+
+
+class BlockStore:
+    """zlib-compressed blocks addressed by the SHA-256 of their content"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, block: bytes) -> Tuple[str, int]:
+        """Store a block if new; returns its hash and the bytes written (0 when already stored)"""
+        digest = hashlib.sha256(block).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return digest, _write_atomic(path, [zlib.compress(block, SNAPSHOT_COMPRESS_LEVEL)])
+
+    def get(self, digest: str) -> bytes:
+        try:
+            with open(self._path(digest), "rb") as f:
+                block = zlib.decompress(f.read())
+        except (OSError, zlib.error) as e:
+            raise SnapshotError(f"Block {digest} is missing or corrupt: {e}", status_code=500)
+        if hashlib.sha256(block).hexdigest() != digest:
+            raise SnapshotError(f"Block {digest} does not match its hash", status_code=500)
+        return block
+
+    def digests(self) -> Iterator[str]:
+        for prefix in os.listdir(self.root) if os.path.isdir(self.root) else ():
+            for name in os.listdir(os.path.join(self.root, prefix)):
+                if not name.endswith(".tmp"):
+                    yield name
+
+    def remove(self, digest: str) -> int:
+        path = self._path(digest)
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+
+
+class SnapshotStore:
+    """Snapshot manifests plus the shared block store under SNAPSHOT_DIR"""
+
+    def __init__(self, root: str = SNAPSHOT_DIR):
+        self.root = root
+        self.blocks = BlockStore(os.path.join(root, "blocks"))
+        self.manifest_dir = os.path.join(root, "snapshots")
+
+    def _manifest_path(self, snapshot_id: str) -> str:
+        if not re.match(r"^[A-Za-z0-9_.-]+$", snapshot_id):
+            raise SnapshotError(f"Invalid snapshot id: {snapshot_id}")
+        return os.path.join(self.manifest_dir, f"{snapshot_id}.json")
+
+    def _store(self, data: bytes, stats: Dict[str, int]) -> List[str]:
+        digests = []
+        start = 0
+        for end in cut_points(data):
+            digest, written = self.blocks.put(data[start:end])
+            digests.append(digest)
+            stats["blocks"] += 1
+            stats["new_blocks"] += 1 if written else 0
+            stats["stored_bytes"] += written
+            start = end
+        stats["raw_bytes"] += len(data)
+        return digests
+
+    def _vector_parts(self, data_dir: str, name: str, raw: bytes):
+        """(metadata JSON without the matrix, raw float32 matrix bytes, dim) of a vdb_*.json file"""
+        store = json.loads(raw)
+        matrix_file = store.pop("matrix_file", None)
+        encoded = store.pop("matrix", "")
+        if matrix_file:
+            matrix = _read_stable(os.path.join(data_dir, matrix_file))
+        else:
+            matrix = base64.b64decode(encoded)
+        return json.dumps(store, ensure_ascii=False).encode("utf-8"), matrix, store.get("embedding_dim")
+
+    def _files(self, data_dir: str) -> List[str]:
+        names = []
+        for entry in sorted(os.scandir(data_dir), key=lambda e: e.name):
+            if not entry.is_file() or entry.name in _EXCLUDED:
+                continue
+            if entry.name.endswith((".tmp", MATRIX_SUFFIX)):
+                continue
+            names.append(entry.name)
+        return names
+
+    def create(self, data_dir: str, workspace: str = "", label: Optional[str] = None) -> Dict[str, Any]:
+        """Snapshot every storage file of a (quiesced, flushed) workspace directory"""
+        start = time.perf_counter()
+        stats = {"files": 0, "blocks": 0, "new_blocks": 0, "raw_bytes": 0, "stored_bytes": 0}
+        files = []
+        for name in self._files(data_dir):
+            raw = _read_stable(os.path.join(data_dir, name))
+            entry: Dict[str, Any] = {"path": name, "size": len(raw)}
+            if _VECTOR_FILE.match(name):
+                try:
+                    meta, matrix, dim = self._vector_parts(data_dir, name, raw)
+                except (ValueError, KeyError) as e:
+                    raise SnapshotError(f"Could not read vector store {name}: {e}", status_code=500)
+                entry.update({"kind": "vectors", "dim": dim, "meta": self._store(meta, stats), "matrix": self._store(matrix, stats), "matrix_bytes": len(matrix)})
+            else:
+                entry.update({"kind": "file", "blocks": self._store(raw, stats)})
+            files.append(entry)
+            stats["files"] += 1
+
+        created_at = time.time()
+        digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+        snapshot_id = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(created_at))}-{workspace or 'default'}-{digest}"
+        manifest = {
+            "id": snapshot_id,
+            "workspace": workspace,
+            "label": label,
+            "created_at": created_at,
+            "files": files,
+            "stats": {**stats, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)},
+        }
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        _write_atomic(self._manifest_path(snapshot_id), [json.dumps(manifest, ensure_ascii=False).encode("utf-8")])
+        print(f"✓ Snapshot {snapshot_id}: {stats['files']} files, {stats['new_blocks']}/{stats['blocks']} new blocks, {stats['stored_bytes'] / 1e6:.1f} MB written")
+        return manifest
+
+    def get(self, snapshot_id: str) -> Dict[str, Any]:
+        path = self._manifest_path(snapshot_id)
+        if not os.path.exists(path):
+            raise SnapshotError(f"Snapshot not found: {snapshot_id}", status_code=404)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _join(self, digests: List[str]) -> bytes:
+        return b"".join(self.blocks.get(digest) for digest in digests)
+
+    def restore(self, snapshot_id: str, data_dir: str, mmap_vectors: bool = SNAPSHOT_MMAP_VECTORS) -> Dict[str, Any]:
+        """Replace the storage files of a (closed) workspace directory with a snapshot's"""
+        manifest = self.get(snapshot_id)
+        start = time.perf_counter()
+        os.makedirs(data_dir, exist_ok=True)
+        written = 0
+        keep = set()
+        for entry in manifest["files"]:
+            path = os.path.join(data_dir, entry["path"])
+            keep.add(entry["path"])
+            if entry["kind"] == "file":
+                written += _write_atomic(path, (self.blocks.get(d) for d in entry["blocks"]))
+                continue
+            store = json.loads(self._join(entry["meta"]))
+            # An empty store has nothing to map (and np.memmap refuses empty files)
+            if mmap_vectors and entry.get("matrix_bytes"):
+                matrix_name = entry["path"] + MATRIX_SUFFIX
+                keep.add(matrix_name)
+                written += _write_atomic(os.path.join(data_dir, matrix_name), (self.blocks.get(d) for d in entry["matrix"]))
+                store.update({"matrix": "", "matrix_file": matrix_name})
+            else:
+                store["matrix"] = base64.b64encode(self._join(entry["matrix"])).decode()
+            written += _write_atomic(path, [json.dumps(store, ensure_ascii=False).encode("utf-8")])
+        # Anything else (newer stores, write-ahead logs, caches) would be replayed over the snapshot
+        removed = []
+        for name in self._files(data_dir) + [n for n in os.listdir(data_dir) if n.endswith(MATRIX_SUFFIX)]:
+            if name not in keep and os.path.isfile(os.path.join(data_dir, name)):
+                os.remove(os.path.join(data_dir, name))
+                removed.append(name)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        print(f"✓ Restored snapshot {snapshot_id} into {data_dir} ({written / 1e6:.1f} MB) in {elapsed_ms:.0f}ms")
+        return {"snapshot": snapshot_id, "files": len(manifest["files"]), "bytes": written, "removed": removed, "mmap_vectors": mmap_vectors, "elapsed_ms": elapsed_ms}
+
+    def list(self) -> List[Dict[str, Any]]:
+        snapshots = []
+        for name in sorted(os.listdir(self.manifest_dir)) if os.path.isdir(self.manifest_dir) else ():
+            if name.endswith(".json"):
+                manifest = self.get(name[:-len(".json")])
+                snapshots.append({k: manifest[k] for k in ("id", "workspace", "label", "created_at", "stats")})
+        return snapshots
+
+    def delete(self, snapshot_id: str) -> Dict[str, Any]:
+        """Remove a snapshot and every block no remaining snapshot references"""
+        path = self._manifest_path(snapshot_id)
+        if not os.path.exists(path):
+            raise SnapshotError(f"Snapshot not found: {snapshot_id}", status_code=404)
+        os.remove(path)
+        referenced = set()
+        for name in os.listdir(self.manifest_dir):
+            if name.endswith(".json"):
+                for entry in self.get(name[:-len(".json")])["files"]:
+                    referenced.update(entry.get("blocks", []), entry.get("meta", []), entry.get("matrix", []))
+        freed, removed = 0, 0
+        for digest in list(self.blocks.digests()):
+            if digest not in referenced:
+                freed += self.blocks.remove(digest)
+                removed += 1
+        return {"deleted": snapshot_id, "blocks_removed": removed, "bytes_freed": freed}
+
+    def describe(self) -> Dict[str, Any]:
+        blocks = list(self.blocks.digests())
+        return {
+            "dir": self.root,
+            "count": len(self.list()),
+            "blocks": len(blocks),
+            "block_kb": SNAPSHOT_BLOCK_KB,
+            "mmap_vectors": SNAPSHOT_MMAP_VECTORS,
+        }
+
+
+class MmapNanoVectorDB(NanoVectorDB):
+    """NanoVectorDB that memory-maps a restored raw matrix (<file>.f32) instead of decoding base64"""
+
+    def __post_init__(self):
+        super().__post_init__()
+        storage = self._NanoVectorDB__storage
+        self._matrix_path = None
+        matrix_file = storage.pop("matrix_file", None)
+        if matrix_file:
+            self._matrix_path = os.path.join(os.path.dirname(self.storage_file), matrix_file)
+            if os.path.getsize(self._matrix_path) == 0:
+                storage["matrix"] = np.empty((0, self.embedding_dim), dtype=np.float32)
+            else:
+                # Copy-on-write: in-place updates stay private; snapshot vectors are already normalized
+                storage["matrix"] = np.memmap(self._matrix_path, dtype=np.float32, mode="c").reshape(-1, self.embedding_dim)
+
+    def save(self):
+        super().save()
+        # The JSON file now holds the matrix again
+        if self._matrix_path and os.path.exists(self._matrix_path):
+            os.remove(self._matrix_path)
+        self._matrix_path = None
+
+
+# LightRAG's NanoVectorDBStorage constructs its client from this module attribute; the subclass
+# only differs for files written by restore(mmap_vectors=True)
+nano_vector_db_impl.NanoVectorDB = MmapNanoVectorDB
+
+
+if __name__ == "__main__":
+    store = SnapshotStore()
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "create" and len(sys.argv) in (3, 4):
+        manifest = store.create(sys.argv[2], label=sys.argv[3] if len(sys.argv) == 4 else None)
+        print(json.dumps({"id": manifest["id"], **manifest["stats"]}))
+    elif command == "restore" and len(sys.argv) in (4, 5):
+        print(json.dumps(store.restore(sys.argv[2], sys.argv[3], mmap_vectors="--no-mmap" not in sys.argv)))
+    elif command == "list" and len(sys.argv) == 2:
+        for snapshot in store.list():
+            print(f"{snapshot['id']}  {snapshot['stats']['files']} files  {snapshot['stats']['raw_bytes'] / 1e6:.1f} MB  {snapshot.get('label') or ''}")
+    elif command == "delete" and len(sys.argv) == 3:
+        print(json.dumps(store.delete(sys.argv[2])))
+    else:
+        print(f"Usage: {sys.argv[0]} create DIR [LABEL] | restore ID DIR [--no-mmap] | list | delete ID  (SNAPSHOT_DIR={SNAPSHOT_DIR})")
+        sys.exit(1)
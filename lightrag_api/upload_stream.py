@@ -0,0 +1,128 @@
+"""
+Streaming document uploads
+/ingest takes the whole document inside a JSON body, so a 100 MB text file
+is held several times over (raw body, parsed JSON, the str, every section)
+before the first section reaches LightRAG. /ingest/stream instead reads the
+raw request body (plain text, or a PDF) chunk by chunk:
+
+    - text/plain is decoded incrementally and handed to
+      documents.sync_document_stream, which splits pages/paragraphs as they
+      complete and inserts them in batches while the upload continues
+    - application/pdf is spooled to a temporary file (a PDF's page index is
+      at its end), then extracted and fed one page at a time with the same
+      `--- Page N ---` markers convert_pdf_to_text.py writes
+
+Bodies larger than INGEST_MAX_BYTES are refused with 413, up front when the
+client sends Content-Length and mid-stream otherwise (chunked uploads).
+"""
+
+import asyncio
+import codecs
+import os
+import tempfile
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from documents import DocumentUpdateError
+from workspaces import rss_bytes
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        PdfReader = None
+
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(512 * 1024 * 1024)))
+STREAM_CONTENT_TYPES = ["text/plain", "application/pdf"]
+# Sample RSS at most once per this many bytes received
+_RSS_SAMPLE_BYTES = 1024 * 1024
+
+
+def content_kind(content_type: Optional[str]) -> str:
+    """"text" or "pdf" for a request Content-Type (missing means text)"""
+    media_type = (content_type or "text/plain").split(";")[0].strip().lower()
+    if media_type in ("text/plain", "text/markdown", "application/octet-stream"):
+        return "text"
+    if media_type == "application/pdf":
+        if PdfReader is None:
+            raise DocumentUpdateError("PDF uploads need pypdf installed (pip install pypdf)", status_code=415)
+        return "pdf"
+    raise DocumentUpdateError(f"Unsupported Content-Type {media_type}; send one of: {', '.join(STREAM_CONTENT_TYPES)}", status_code=415)
+
+
+class UploadMeter:
+    """Counts received bytes against the size limit and tracks the process's peak RSS during the upload"""
+
+    def __init__(self, max_bytes: int = INGEST_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.pages = 0
+        self.started = time.perf_counter()
+        self.rss_start = rss_bytes() or 0
+        self.rss_peak = self.rss_start
+        self._next_sample = 0
+
+    def check_declared(self, content_length: Optional[str]):
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise DocumentUpdateError(f"Body of {content_length} bytes exceeds INGEST_MAX_BYTES ({self.max_bytes})", status_code=413)
+
+    def add(self, size: int):
+        self.bytes += size
+        if self.bytes > self.max_bytes:
+            raise DocumentUpdateError(f"Body exceeds INGEST_MAX_BYTES ({self.max_bytes})", status_code=413)
+        if self.bytes >= self._next_sample:
+            self._next_sample = self.bytes + _RSS_SAMPLE_BYTES
+            self.sample()
+
+    def sample(self):
+        self.rss_peak = max(self.rss_peak, rss_bytes() or 0)
+
+    def report(self) -> Dict[str, Any]:
+        self.sample()
+        report = {
+            "bytes": self.bytes,
+            "elapsed_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "peak_rss_mb": round(self.rss_peak / 1e6, 1),
+            "rss_growth_mb": round((self.rss_peak - self.rss_start) / 1e6, 1),
+        }
+        if self.pages:
+            report["pages"] = self.pages
+        return report
+
+
+async def text_chunks(body: AsyncIterator[bytes], meter: UploadMeter) -> AsyncIterator[str]:
+    """UTF-8 text of a streamed body; multi-byte characters split across chunks are carried over"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for chunk in body:
+        meter.add(len(chunk))
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def pdf_chunks(body: AsyncIterator[bytes], meter: UploadMeter) -> AsyncIterator[str]:
+    """Spool a streamed PDF to disk, then yield its text one page at a time"""
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in body:
+                meter.add(len(chunk))
+                f.write(chunk)
+        try:
+            reader = await asyncio.to_thread(PdfReader, path)
+            page_count = len(reader.pages)
+        except Exception as e:
+            raise DocumentUpdateError(f"Could not read PDF: {e}", status_code=400)
+        for number in range(page_count):
+            # Extraction is CPU-bound; keep it off the event loop
+            text = await asyncio.to_thread(lambda: reader.pages[number].extract_text() or "")
+            meter.pages += 1
+            meter.sample()
+            yield f"\n--- Page {number + 1} ---\n{text}"
+    finally:
+        os.remove(path)
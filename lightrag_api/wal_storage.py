@@ -0,0 +1,401 @@
+"""
+Write-ahead log for LightRAG's file-based graph and KV storage
+JsonKVStorage, JsonDocStatusStorage and NetworkXStorage rewrite their whole
+file (kv_store_*.json, graph_*.graphml) every time LightRAG calls
+index_done_callback - after each ingest, and for doc status after every
+status change - so write cost grows with the corpus, and a crash mid-write
+leaves a truncated file. The Wal* subclasses keep LightRAG's in-memory
+behaviour and instead:
+
+    1. append every mutation as a JSON line to <file>.wal
+    2. fsync the log where LightRAG would have rewritten the file
+    3. compact (write the full file to a temp file, os.replace it, truncate
+       the log) once the log exceeds WAL_COMPACT_BYTES, or on a
+       WAL_COMPACT_SECONDS schedule, and on shutdown
+    4. replay the log over the main file at startup
+
+Replaying a record twice is harmless (upserts carry the stored values,
+deletes ignore missing keys), so a crash between the os.replace and the
+truncate is safe. A torn last line from a crash mid-append is cut off on
+replay, so later appends start on a fresh line.
+The log assumes a single API process writes the working directory.
+"""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import networkx as nx
+from lightrag.kg import STORAGE_ENV_REQUIREMENTS, STORAGE_IMPLEMENTATIONS, STORAGES
+from lightrag.kg.json_doc_status_impl import JsonDocStatusStorage
+from lightrag.kg.json_kv_impl import JsonKVStorage
+from lightrag.kg.networkx_impl import NetworkXStorage
+from lightrag.kg.shared_storage import clear_all_update_flags, set_all_update_flags
+from lightrag.utils import load_json, write_json
+
+STORAGE_WAL = os.getenv("STORAGE_WAL", "true").lower() == "true"
+WAL_COMPACT_BYTES = int(os.getenv("WAL_COMPACT_BYTES", str(32 * 1024 * 1024)))
+WAL_COMPACT_SECONDS = float(os.getenv("WAL_COMPACT_SECONDS", "600"))
+# How often the background task checks the schedule
+_COMPACT_CHECK_SECONDS = 30
+
+
+def _fsync_file(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+class WriteLog:
+    """Append-only JSON-lines log beside one storage file"""
+
+    def __init__(self, path: str, registry: "WalRegistry"):
+        self.path = path
+        self.registry = registry
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.records = 0
+        self.last_compaction = time.time()
+        self._file = None
+
+    def append(self, record: Dict[str, Any]):
+        line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        self._file.write(line)
+        self._file.flush()
+        self.size += len(line)
+        self.records += 1
+        self.registry.stats["wal_bytes"] += len(line)
+        self.registry.stats["wal_records"] += 1
+
+    def sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def replay(self, apply: Callable[[Dict[str, Any]], None]) -> int:
+        """Apply every complete record in order and cut off a torn tail; returns the number applied"""
+        if not os.path.exists(self.path):
+            return 0
+        applied = 0
+        # End of the last complete record
+        offset = 0
+        torn = False
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    # Records are written with their newline in one write; without it the write was torn
+                    if not line.endswith(b"\n"):
+                        raise ValueError("missing newline")
+                    record = json.loads(line)
+                except ValueError:
+                    torn = True
+                    break
+                apply(record)
+                applied += 1
+                offset += len(line)
+        if torn:
+            print(f"Warning: Dropping torn record at the end of {self.path}")
+            # Appends would otherwise continue the torn line, and the next replay would stop there
+            self.close()
+            os.truncate(self.path, offset)
+            _fsync_file(self.path)
+        self.size = offset
+        self.records = applied
+        return applied
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def due(self) -> bool:
+        if self.registry.paused:
+            return False
+        return self.size >= WAL_COMPACT_BYTES or (self.size > 0 and time.time() - self.last_compaction >= WAL_COMPACT_SECONDS)
+
+    def compacted(self, written: int):
+        """Record a compaction of `written` bytes and empty the log"""
+        self.close()
+        with open(self.path, "wb") as f:
+            os.fsync(f.fileno())
+        self.size, self.records = 0, 0
+        self.last_compaction = time.time()
+        self.registry.stats["compaction_bytes"] += written
+        self.registry.stats["compactions"] += 1
+
+
+class WalRegistry:
+    """Logged storages in this process, their write counters and the compaction schedule"""
+
+    def __init__(self):
+        self.stores: List[Any] = []
+        self.stats = {"wal_bytes": 0, "wal_records": 0, "compaction_bytes": 0, "compactions": 0, "full_rewrite_bytes": 0}
+        self._task: Optional[asyncio.Task] = None
+        # While > 0 (a snapshot is copying files) logs only grow; main files are not replaced
+        self.paused = 0
+
+    def storage_classes(self) -> Dict[str, str]:
+        """LightRAG constructor arguments selecting the logged storages (empty when STORAGE_WAL is off)"""
+        if not STORAGE_WAL:
+            return {}
+        return {"kv_storage": "WalJsonKVStorage", "doc_status_storage": "WalJsonDocStatusStorage", "graph_storage": "WalNetworkXStorage"}
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+    def report(self, before: Dict[str, int]) -> Dict[str, Any]:
+        """Bytes written since a snapshot(), next to what full-file rewrites would have written"""
+        delta = {k: self.stats[k] - before.get(k, 0) for k in self.stats}
+        delta["written_bytes"] = delta["wal_bytes"] + delta["compaction_bytes"]
+        return delta
+
+    async def compact_all(self, force: bool = False):
+        if self.paused and not force:
+            return
+        for store in list(self.stores):
+            if store._wal.size and (force or store._wal.due()):
+                try:
+                    await store.compact()
+                except Exception as e:
+                    print(f"Warning: WAL compaction failed for {store._wal.path}: {e}")
+
+    async def compact_workspace(self, workspace: str):
+        """Fold every log of a LightRAG workspace into its main file"""
+        for store in [s for s in self.stores if s.workspace == workspace]:
+            if store._wal.size:
+                await store.compact()
+
+    @contextmanager
+    def hold_compaction(self):
+        """Keep main files stable (no compaction) while they are being copied"""
+        self.paused += 1
+        try:
+            yield
+        finally:
+            self.paused -= 1
+
+    async def close_workspace(self, workspace: str):
+        """Compact and forget the logs of a LightRAG workspace that is being closed"""
+        for store in [s for s in self.stores if s.workspace == workspace]:
+            if store._wal.size:
+                await store.compact()
+            store._wal.close()
+            self.stores.remove(store)
+
+    async def _compact_loop(self):
+        while True:
+            await asyncio.sleep(min(_COMPACT_CHECK_SECONDS, WAL_COMPACT_SECONDS))
+            await self.compact_all()
+
+    def start(self):
+        if self._task is None and STORAGE_WAL:
+            self._task = asyncio.create_task(self._compact_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.compact_all(force=True)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "enabled": STORAGE_WAL,
+            "compact_bytes": WAL_COMPACT_BYTES,
+            "compact_seconds": WAL_COMPACT_SECONDS,
+            **self.stats,
+            "logs": [
+                {
+                    "path": store._wal.path,
+                    "bytes": store._wal.size,
+                    "records": store._wal.records,
+                    "last_compaction": store._wal.last_compaction,
+                }
+                for store in self.stores
+            ],
+        }
+
+
+wal_registry = WalRegistry()
+
+
+class _WalKVMixin:
+    """WAL for the dict-backed JSON stores (KV and doc status)"""
+
+    # JsonDocStatusStorage persists inside every upsert; keep that durability
+    _sync_every_upsert = False
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._wal = WriteLog(f"{self._file_name}.wal", wal_registry)
+        wal_registry.stores.append(self)
+
+    def _apply(self, record: Dict[str, Any]):
+        if record["op"] == "upsert":
+            self._data.update(record["data"])
+        elif record["op"] == "delete":
+            for key in record["ids"]:
+                self._data.pop(key, None)
+        elif record["op"] == "drop":
+            self._data.clear()
+
+    async def initialize(self):
+        await super().initialize()
+        async with self._storage_lock:
+            replayed = self._wal.replay(self._apply)
+        if replayed:
+            print(f"✓ Replayed {replayed} WAL records into {os.path.basename(self._file_name)}")
+
+    async def upsert(self, data: Dict[str, Dict[str, Any]]) -> None:
+        await super().upsert(data)
+        if data:
+            # Log the stored values (with the timestamps upsert added) so replay restores them exactly
+            self._wal.append({"op": "upsert", "data": {key: self._data[key] for key in data if key in self._data}})
+            if self._sync_every_upsert:
+                self._wal.sync()
+
+    async def delete(self, ids: List[str]) -> None:
+        await super().delete(ids)
+        if ids:
+            self._wal.append({"op": "delete", "ids": list(ids)})
+
+    async def drop(self) -> Dict[str, str]:
+        self._wal.append({"op": "drop"})
+        result = await super().drop()
+        await self.compact()
+        return result
+
+    async def index_done_callback(self) -> None:
+        async with self._storage_lock:
+            if not self.storage_updated.value:
+                return
+            # What the stock implementation would have written here
+            wal_registry.stats["full_rewrite_bytes"] += (os.path.getsize(self._file_name) if os.path.exists(self._file_name) else 0) + self._wal.size
+            self._wal.sync()
+            if self._wal.due():
+                self._compact_locked()
+            await clear_all_update_flags(self.namespace, workspace=self.workspace)
+
+    async def compact(self):
+        async with self._storage_lock:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        data = dict(self._data) if hasattr(self._data, "_getvalue") else self._data
+        tmp_path = f"{self._file_name}.tmp"
+        needs_reload = write_json(data, tmp_path)
+        _fsync_file(tmp_path)
+        os.replace(tmp_path, self._file_name)
+        if needs_reload:
+            cleaned = load_json(self._file_name)
+            if cleaned is not None:
+                self._data.clear()
+                self._data.update(cleaned)
+        self._wal.compacted(os.path.getsize(self._file_name))
+
+
+@dataclass
+class WalJsonKVStorage(_WalKVMixin, JsonKVStorage):
+    pass
+
+
+@dataclass
+class WalJsonDocStatusStorage(_WalKVMixin, JsonDocStatusStorage):
+    _sync_every_upsert = True
+
+
+@dataclass
+class WalNetworkXStorage(NetworkXStorage):
+    """NetworkXStorage that logs node/edge mutations instead of rewriting the GraphML each ingest"""
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._wal = WriteLog(f"{self._graphml_xml_file}.wal", wal_registry)
+        wal_registry.stores.append(self)
+        replayed = self._wal.replay(self._apply)
+        if replayed:
+            print(f"✓ Replayed {replayed} WAL records into {os.path.basename(self._graphml_xml_file)}")
+
+    def _apply(self, record: Dict[str, Any]):
+        graph = self._graph
+        if record["op"] == "node":
+            graph.add_node(record["id"], **record["data"])
+        elif record["op"] == "edge":
+            graph.add_edge(record["source"], record["target"], **record["data"])
+        elif record["op"] == "remove_nodes":
+            graph.remove_nodes_from(record["ids"])
+        elif record["op"] == "remove_edges":
+            graph.remove_edges_from(record["edges"])
+        elif record["op"] == "drop":
+            graph.clear()
+
+    async def upsert_node(self, node_id: str, node_data: Dict[str, str]) -> None:
+        await super().upsert_node(node_id, node_data)
+        self._wal.append({"op": "node", "id": node_id, "data": node_data})
+
+    async def upsert_edge(self, source_node_id: str, target_node_id: str, edge_data: Dict[str, str]) -> None:
+        await super().upsert_edge(source_node_id, target_node_id, edge_data)
+        self._wal.append({"op": "edge", "source": source_node_id, "target": target_node_id, "data": edge_data})
+
+    async def delete_node(self, node_id: str) -> None:
+        await super().delete_node(node_id)
+        self._wal.append({"op": "remove_nodes", "ids": [node_id]})
+
+    async def remove_nodes(self, nodes: List[str]):
+        await super().remove_nodes(nodes)
+        if nodes:
+            self._wal.append({"op": "remove_nodes", "ids": list(nodes)})
+
+    async def remove_edges(self, edges: List[tuple]):
+        await super().remove_edges(edges)
+        if edges:
+            self._wal.append({"op": "remove_edges", "edges": [list(edge) for edge in edges]})
+
+    async def drop(self) -> Dict[str, str]:
+        self._wal.append({"op": "drop"})
+        result = await super().drop()
+        if result.get("status") == "success":
+            self._wal.compacted(0)
+        return result
+
+    async def index_done_callback(self) -> bool:
+        async with self._storage_lock:
+            # The stock implementation rewrites the GraphML on every call
+            wal_registry.stats["full_rewrite_bytes"] += (os.path.getsize(self._graphml_xml_file) if os.path.exists(self._graphml_xml_file) else 0) + self._wal.size
+            self._wal.sync()
+            if self._wal.due():
+                await self._compact_locked()
+        return True
+
+    async def compact(self):
+        async with self._storage_lock:
+            await self._compact_locked()
+
+    async def _compact_locked(self):
+        tmp_path = f"{self._graphml_xml_file}.tmp"
+        nx.write_graphml(self._graph, tmp_path)
+        _fsync_file(tmp_path)
+        os.replace(tmp_path, self._graphml_xml_file)
+        self._wal.compacted(os.path.getsize(self._graphml_xml_file))
+        # Same cross-process notification as NetworkXStorage.index_done_callback
+        await set_all_update_flags(self.namespace, workspace=self.workspace)
+        self.storage_updated.value = False
+
+
+# Make the classes selectable by name in LightRAG(kv_storage=..., graph_storage=...)
+for _storage_type, _name in (
+    ("KV_STORAGE", "WalJsonKVStorage"),
+    ("DOC_STATUS_STORAGE", "WalJsonDocStatusStorage"),
+    ("GRAPH_STORAGE", "WalNetworkXStorage"),
+):
+    if _name not in STORAGE_IMPLEMENTATIONS[_storage_type]["implementations"]:
+        STORAGE_IMPLEMENTATIONS[_storage_type]["implementations"].append(_name)
+    STORAGES[_name] = __name__
+    STORAGE_ENV_REQUIREMENTS[_name] = []
@@ -0,0 +1,369 @@
+"""
+Workspace-scoped corpora served from one process
+A workspace is one corpus: a LightRAG instance (its own JSON/GraphML/vector
+files under WORKSPACES_DIR/<name>) plus the side indexes kept beside it
+(document manifest, BM25, metadata, graph layout, defaulters table, router
+and keyword caches). The LLM/embedding backends, extraction cache and
+chunk deduplicator are shared by every workspace.
+
+Named workspaces are opened on first use and kept in an LRU. Idle or least
+recently used ones are flushed (every storage's index_done_callback, WAL
+compaction) and closed when more than WORKSPACE_MAX_OPEN are open, when
+their estimated memory exceeds WORKSPACE_MEMORY_MB, or after
+WORKSPACE_IDLE_SECONDS without a request. Workspaces with requests in
+flight are never closed. The default workspace (WORKING_DIR, the
+unprefixed endpoints) is opened the same way but never evicted.
+
+Memory per workspace is estimated as the larger of the process RSS growth
+while it opened and the size of its storage files.
+"""
+
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from lightrag.kg import shared_storage
+
+from defaulters import DefaultersIndex
+from documents import DocumentManifest
+from graph_layout import GraphLayout
+from keyword_extractor import LocalKeywordExtractor
+from lexical_index import BM25Index
+from metadata_index import MetadataIndex
+from query_router import QueryRouter
+from wal_storage import wal_registry
+
+WORKSPACE_MAX_OPEN = int(os.getenv("WORKSPACE_MAX_OPEN", "8"))
+WORKSPACE_MEMORY_MB = float(os.getenv("WORKSPACE_MEMORY_MB", "4096"))
+WORKSPACE_IDLE_SECONDS = float(os.getenv("WORKSPACE_IDLE_SECONDS", "900"))
+_IDLE_CHECK_SECONDS = 30
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+
+class WorkspaceError(Exception):
+    """Invalid or unknown workspace; carries the HTTP status to return"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for entry in os.scandir(path) if os.path.isdir(path) else ():
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+
+class Workspace:
+    """One corpus: its LightRAG instance, side indexes and request stats"""
+
+    def __init__(self, name: str, data_dir: str, embed: Optional[Callable] = None):
+        self.name = name
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self.embed = embed
+        self.rag = None
+        self.unload()
+        self.lock = asyncio.Lock()
+        self.in_flight = 0
+        # Document writes run inside writing(); quiesced() waits them out and holds new ones back
+        self._writers = 0
+        self._quiesced = False
+        self._write_cond = asyncio.Condition()
+        self.closing = False
+        self.opened_at: Optional[float] = None
+        self.last_used = time.time()
+        self.open_ms: Optional[float] = None
+        self.rss_growth = 0
+        # Corpus version: bumped on every ingest/update/delete, keys the graph endpoints' ETags
+        self.version = 0
+        self.stats = {"requests": 0, "errors": 0, "busy_ms": 0.0, "opens": 0}
+
+    def load_indexes(self):
+        self.doc_manifest = DocumentManifest(self.data_dir)
+        self.bm25_index = BM25Index(self.data_dir)
+        self.metadata_index = MetadataIndex(self.data_dir)
+        self.graph_layout = GraphLayout(self.data_dir)
+        self.defaulters_index = DefaultersIndex(self.data_dir)
+        self.query_router = QueryRouter(self.data_dir, embed=self.embed)
+        self.keyword_extractor = LocalKeywordExtractor(self.query_router)
+
+    def unload(self):
+        """Drop the LightRAG instance and side indexes (they are saved as they change)"""
+        self.rag = None
+        self.doc_manifest: Optional[DocumentManifest] = None
+        self.bm25_index: Optional[BM25Index] = None
+        self.metadata_index: Optional[MetadataIndex] = None
+        self.graph_layout: Optional[GraphLayout] = None
+        self.defaulters_index: Optional[DefaultersIndex] = None
+        self.query_router: Optional[QueryRouter] = None
+        self.keyword_extractor: Optional[LocalKeywordExtractor] = None
+
+    def invalidate(self):
+        """Drop caches derived from the graph and chunks (call after documents change)"""
+        self.version += 1
+        self.query_router.invalidate()
+        self.keyword_extractor.invalidate()
+        self.graph_layout.invalidate()
+        self.graph_layout.refresh(self.rag)
+
+    @asynccontextmanager
+    async def writing(self):
+        """Hold for the duration of an ingest/update/delete"""
+        async with self._write_cond:
+            await self._write_cond.wait_for(lambda: not self._quiesced)
+            self._writers += 1
+        try:
+            yield
+        finally:
+            async with self._write_cond:
+                self._writers -= 1
+                self._write_cond.notify_all()
+
+    @asynccontextmanager
+    async def quiesced(self):
+        """No document writes in progress or starting (queries keep running)"""
+        async with self._write_cond:
+            await self._write_cond.wait_for(lambda: not self._quiesced)
+            self._quiesced = True
+            await self._write_cond.wait_for(lambda: self._writers == 0)
+        try:
+            yield
+        finally:
+            async with self._write_cond:
+                self._quiesced = False
+                self._write_cond.notify_all()
+
+    def storages(self) -> List[Any]:
+        rag = self.rag
+        return [
+            rag.full_docs, rag.text_chunks, rag.full_entities, rag.full_relations, rag.entity_chunks,
+            rag.relation_chunks, rag.entities_vdb, rag.relationships_vdb, rag.chunks_vdb,
+            rag.chunk_entity_relation_graph, rag.llm_response_cache, rag.doc_status,
+        ]
+
+    async def flush(self):
+        """Write every storage's in-memory state to its files and fold the write-ahead logs in"""
+        for storage in self.storages():
+            if storage is not None:
+                await storage.index_done_callback()
+        await wal_registry.compact_workspace(self.name)
+
+    @property
+    def memory_bytes(self) -> int:
+        return max(self.rss_growth, _dir_bytes(self.data_dir)) if self.rag is not None else 0
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name or "default",
+            "open": self.rag is not None,
+            "version": self.version,
+            "in_flight": self.in_flight,
+            "documents": len(self.doc_manifest.items()) if self.doc_manifest is not None else None,
+            "memory_mb": round(self.memory_bytes / 1e6, 1),
+            "disk_mb": round(_dir_bytes(self.data_dir) / 1e6, 1),
+            "opened_at": self.opened_at,
+            "open_ms": self.open_ms,
+            "idle_s": round(time.time() - self.last_used, 1),
+            **self.stats,
+            "busy_ms": round(self.stats["busy_ms"], 1),
+        }
+
+
+class WorkspaceManager:
+    """LRU of open workspaces bounded by count, estimated memory and idle time"""
+
+    def __init__(self, root_dir: str, default_dir: str, rag_factory: Callable[[str, str], Any], embed: Optional[Callable] = None):
+        # rag_factory(working_dir, workspace) -> LightRAG; the default workspace uses ("<WORKING_DIR>", "")
+        self.root_dir = root_dir
+        self.rag_factory = rag_factory
+        self.embed = embed
+        self.default = Workspace("", default_dir, embed)
+        self._open: "OrderedDict[str, Workspace]" = OrderedDict()
+        self._known: Dict[str, Workspace] = {}
+        self._open_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"opens": 0, "closes": 0, "evicted_lru": 0, "evicted_memory": 0, "evicted_idle": 0}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root_dir, name)
+
+    def get(self, name: Optional[str], create: bool = False) -> Workspace:
+        """The workspace object (not yet opened); unknown names raise WorkspaceError unless create"""
+        if not name:
+            return self.default
+        workspace = self._known.get(name)
+        if workspace is not None:
+            return workspace
+        if not _NAME_RE.match(name):
+            raise WorkspaceError("workspace names are 1-64 letters, digits, '_' or '-'")
+        if not create and not os.path.isdir(self._path(name)):
+            raise WorkspaceError(f"Workspace not found: {name}", status_code=404)
+        workspace = Workspace(name, self._path(name), self.embed)
+        self._known[name] = workspace
+        return workspace
+
+    async def _ensure_open(self, workspace: Workspace):
+        if workspace.rag is not None and not workspace.closing:
+            return
+        async with workspace.lock:
+            if workspace.rag is not None:
+                return
+            # One open at a time so the RSS growth belongs to this workspace
+            async with self._open_lock:
+                start, rss_before = time.perf_counter(), rss_bytes()
+                if workspace.name:
+                    # LightRAG keeps files under <working_dir>/<workspace>, i.e. WORKSPACES_DIR/<name>
+                    rag = self.rag_factory(self.root_dir, workspace.name)
+                else:
+                    rag = self.rag_factory(workspace.data_dir, "")
+                await rag.initialize_storages()
+                workspace.load_indexes()
+                rss_after = rss_bytes()
+                workspace.rss_growth = max(0, rss_after - rss_before) if rss_before and rss_after else 0
+                workspace.open_ms = round((time.perf_counter() - start) * 1000, 1)
+                workspace.opened_at = time.time()
+                workspace.rag = rag
+                workspace.stats["opens"] += 1
+                self.stats["opens"] += 1
+            print(f"✓ Workspace {workspace.name or 'default'} opened in {workspace.open_ms:.0f}ms")
+
+    async def open(self, workspace: Workspace):
+        """Open the workspace's LightRAG instance if needed and mark it most recently used"""
+        await self._ensure_open(workspace)
+        if workspace.name:
+            self._open[workspace.name] = workspace
+            self._open.move_to_end(workspace.name)
+
+    @asynccontextmanager
+    async def use(self, workspace: Workspace):
+        """Pin a workspace for one request (it cannot be closed meanwhile) and record its stats"""
+        workspace.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield workspace
+        except BaseException:
+            workspace.stats["errors"] += 1
+            raise
+        finally:
+            workspace.in_flight -= 1
+            workspace.last_used = time.time()
+            workspace.stats["requests"] += 1
+            workspace.stats["busy_ms"] += (time.perf_counter() - start) * 1000
+            await self._evict()
+
+    async def close(self, workspace: Workspace):
+        """Flush every storage to disk and release the workspace's memory"""
+        workspace.closing = True
+        async with workspace.lock:
+            rag = workspace.rag
+            if rag is None:
+                workspace.closing = False
+                return
+            storages = [storage for storage in workspace.storages() if storage is not None]
+            for storage in storages:
+                await storage.index_done_callback()
+            await wal_registry.close_workspace(workspace.name)
+            await rag.finalize_storages()
+            # LightRAG keeps JSON storage data in process-wide namespaces; drop this workspace's
+            # so the memory is freed and a reopen loads from disk. The default workspace's
+            # namespaces have no "<workspace>:" prefix, so remove the exact keys
+            keys = {shared_storage.get_final_namespace(storage.namespace, storage.workspace) for storage in storages}
+            keys.add(shared_storage.get_final_namespace("pipeline_status", rag.workspace))
+            for registry in (shared_storage._shared_dicts, shared_storage._init_flags, shared_storage._update_flags):
+                for key in keys:
+                    (registry or {}).pop(key, None)
+            workspace.unload()
+            workspace.closing = False
+            workspace.rss_growth = 0
+            self._open.pop(workspace.name, None)
+            self.stats["closes"] += 1
+        print(f"✓ Workspace {workspace.name or 'default'} flushed and closed")
+
+    def _victim(self) -> Optional[Workspace]:
+        for workspace in self._open.values():
+            if workspace.in_flight == 0 and not workspace.closing:
+                return workspace
+        return None
+
+    async def _evict(self):
+        while len(self._open) > WORKSPACE_MAX_OPEN:
+            victim = self._victim()
+            if victim is None:
+                return
+            self.stats["evicted_lru"] += 1
+            await self.close(victim)
+        budget = WORKSPACE_MEMORY_MB * 1e6
+        while budget > 0 and sum(w.memory_bytes for w in self._open.values()) > budget:
+            victim = self._victim()
+            # Keep the most recently used workspace open even when it alone exceeds the budget
+            if victim is None or len(self._open) <= 1:
+                return
+            self.stats["evicted_memory"] += 1
+            await self.close(victim)
+
+    async def close_idle(self):
+        now = time.time()
+        for workspace in list(self._open.values()):
+            if workspace.in_flight == 0 and now - workspace.last_used >= WORKSPACE_IDLE_SECONDS:
+                self.stats["evicted_idle"] += 1
+                try:
+                    await self.close(workspace)
+                except Exception as e:
+                    print(f"Warning: Closing idle workspace {workspace.name} failed: {e}")
+
+    async def _idle_loop(self):
+        while True:
+            await asyncio.sleep(min(_IDLE_CHECK_SECONDS, WORKSPACE_IDLE_SECONDS))
+            await self.close_idle()
+
+    def start(self):
+        if self._task is None and WORKSPACE_IDLE_SECONDS > 0:
+            self._task = asyncio.create_task(self._idle_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for workspace in list(self._open.values()):
+            await self.close(workspace)
+
+    def names(self) -> List[str]:
+        if not os.path.isdir(self.root_dir):
+            return []
+        return sorted(entry.name for entry in os.scandir(self.root_dir) if entry.is_dir() and _NAME_RE.match(entry.name))
+
+    def describe(self) -> Dict[str, Any]:
+        workspaces = [self.default.describe()]
+        for name in self.names():
+            workspace = self._known.get(name)
+            workspaces.append(workspace.describe() if workspace is not None else {"name": name, "open": False, "disk_mb": round(_dir_bytes(self._path(name)) / 1e6, 1)})
+        return {
+            "root": self.root_dir,
+            "max_open": WORKSPACE_MAX_OPEN,
+            "memory_budget_mb": WORKSPACE_MEMORY_MB,
+            "idle_seconds": WORKSPACE_IDLE_SECONDS,
+            "open": list(self._open),
+            "memory_mb": round(sum(w.memory_bytes for w in self._open.values()) / 1e6, 1),
+            "rss_mb": round((rss_bytes() or 0) / 1e6, 1),
+            **self.stats,
+            "workspaces": workspaces,
+        }
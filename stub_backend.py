@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Stub inference backend for testing load balancing and failover locally
+Serves the OpenAI-compatible (/v1/...) and Ollama (/api/...) endpoints the
+API uses, with configurable latency and failure rate. Start several on
+different ports and list them in LLM_BINDING_HOST / EMBEDDING_BINDING_HOST:
+
+    python stub_backend.py --port 18001 &
+    python stub_backend.py --port 18002 --latency 0.5 &
+    LLM_BINDING=openai LLM_BINDING_HOST=http://localhost:18001/v1,http://localhost:18002/v1 ...
+
+POST /admin/down and /admin/up simulate an outage; GET /stats shows request counts.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import random
+import re
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+
+app = FastAPI(title="Stub inference backend")
+config = {"name": "stub", "latency": 0.05, "fail_rate": 0.0, "dim": 768, "down": False}
+stats = {"chat": 0, "embeddings": 0, "probes": 0, "failures": 0}
+
+
+def _embed(text: str):
+    """Deterministic bag-of-words vector so similar texts embed close together"""
+    vector = [0.0] * config["dim"]
+    for word in re.findall(r"\w+", text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % config["dim"]] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+async def _simulate(kind: str):
+    stats[kind] += 1
+    if config["down"] or random.random() < config["fail_rate"]:
+        stats["failures"] += 1
+        raise HTTPException(status_code=503, detail=f"{config['name']} unavailable")
+    await asyncio.sleep(config["latency"])
+
+
+def _answer(messages) -> str:
+    prompt = messages[-1]["content"] if messages else ""
+    return f"Stub answer from {config['name']} ({len(prompt)} prompt chars)"
+
+
+@app.get("/v1/models")
+@app.get("/api/tags")
+async def models():
+    await _simulate("probes")
+    return {"data": [{"id": "stub"}], "models": [{"name": "stub"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await _simulate("chat")
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": _answer(body.get("messages", []))}}]}
+
+
+@app.post("/api/chat")
+async def ollama_chat(request: Request):
+    body = await request.json()
+    await _simulate("chat")
+    return {"message": {"role": "assistant", "content": _answer(body.get("messages", []))}}
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    await _simulate("embeddings")
+    texts = body.get("input", [])
+    texts = [texts] if isinstance(texts, str) else texts
+    return {"data": [{"index": i, "embedding": _embed(text)} for i, text in enumerate(texts)]}
+
+
+@app.post("/api/embeddings")
+async def ollama_embeddings(request: Request):
+    body = await request.json()
+    await _simulate("embeddings")
+    return {"embedding": _embed(body.get("prompt", ""))}
+
+
+@app.post("/admin/down")
+async def go_down():
+    config["down"] = True
+    return config
+
+
+@app.post("/admin/up")
+async def go_up():
+    config["down"] = False
+    return config
+
+
+@app.get("/stats")
+async def get_stats():
+    return {**config, **stats}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI/Ollama-compatible inference backend")
+    parser.add_argument("--port", type=int, default=18001)
+    parser.add_argument("--name", default=None, help="Name shown in answers (default: stub-<port>)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension")
+    args = parser.parse_args()
+    config.update(name=args.name or f"stub-{args.port}", latency=args.latency, fail_rate=args.fail_rate, dim=args.dim)
+    uvicorn.run(app, host="0.0.0.0", port=args.port, log_level="warning")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The API modules import each other by bare name (they are copied flat into the image)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lightrag_api"))
@@ -0,0 +1,61 @@
+import asyncio
+
+from chunk_dedup import _MARKERS, ChunkDeduplicator, carry_counts
+
+CLAUSE = " ".join(f"the seller shall ship clause{i} goods within the period" for i in range(30))
+CHUNK = f"GAFTA Form 48 contract between Alpha Grain Ltd and Beta Mills dated 1 March 2024. {CLAUSE}"
+
+
+def _prompt(chunk: str) -> str:
+    head, tail = _MARKERS
+    return f"extract entities{head}{chunk}{tail}"
+
+
+def test_near_duplicates_with_different_entities_are_extracted_again(tmp_path):
+    calls = []
+
+    async def llm(prompt, **kwargs):
+        calls.append(prompt)
+        return f"result {len(calls)}"
+
+    dedup = ChunkDeduplicator(str(tmp_path))
+    extract = carry_counts(dedup.wrap(llm))
+
+    async def run():
+        counts = dedup.counting()
+        first = await extract(_prompt(CHUNK))
+        # Same text but another form number and party: the entities differ
+        other_form = await extract(_prompt(CHUNK.replace("Form 48", "Form 64").replace("Beta Mills", "Gamma Mills")))
+        # Only a lowercase word differs: the earlier result still applies
+        reworded = await extract(_prompt(CHUNK.replace("clause7 goods", "clause7 cargo")))
+        exact = await extract(_prompt(CHUNK))
+        return counts, first, other_form, reworded, exact
+
+    counts, first, other_form, reworded, exact = asyncio.run(run())
+    assert len(calls) == 2
+    assert other_form != first and reworded == first and exact == first
+    assert dedup.report(counts) == {
+        "extraction_calls": 4, "llm_calls": 2, "reused_exact": 1, "reused_near": 1, "near_reextracted": 1, "saved_fraction": 0.5,
+    }
+
+
+def test_counts_are_kept_per_ingest(tmp_path):
+    async def llm(prompt, **kwargs):
+        await asyncio.sleep(0.01)
+        return "result"
+
+    dedup = ChunkDeduplicator(str(tmp_path))
+    extract = carry_counts(dedup.wrap(llm))
+
+    async def ingest(chunks):
+        counts = dedup.counting()
+        for chunk in chunks:
+            await extract(_prompt(chunk))
+        return dedup.report(counts)
+
+    async def run():
+        return await asyncio.gather(ingest([CHUNK, CHUNK, CHUNK]), ingest([f"Form {i} {CLAUSE}" for i in range(5)]))
+
+    first, second = asyncio.run(run())
+    assert first["extraction_calls"] == 3
+    assert second["extraction_calls"] == 5
@@ -0,0 +1,31 @@
+from defaulters import DefaultersIndex, extract_company_query, format_answer, is_defaulters_doc
+
+ROWS = """Name Country Award Date
+Black Sea Grain Trading Ltd Ukraine 14/123 12/03/2021
+Blacksea Grains LLC Russia 15/456 01/02/2022
+"""
+
+
+def test_only_configured_doc_ids_are_the_defaulters_list():
+    assert is_defaulters_doc("defaulters_list")
+    assert is_defaulters_doc("gafta_defaulters")
+    assert not is_defaulters_doc("gafta_arbitration_rules_125")
+    assert not is_defaulters_doc("awards_2024")
+
+
+def test_similar_names_are_not_reported_as_listed(tmp_path):
+    index = DefaultersIndex(str(tmp_path))
+    index.load_text("defaulters_list", ROWS)
+
+    exact = index.lookup("Black Sea Grain Trading")
+    assert format_answer("Black Sea Grain Trading", exact).startswith("Yes.")
+
+    similar = [match for match in index.lookup("Black Sea Grains") if match["company"].startswith("Blacksea")]
+    assert similar and similar[0]["score"] < 0.9
+    answer = format_answer("Black Sea Grains", similar)
+    assert not answer.startswith("Yes") and "Blacksea Grains LLC" in answer
+
+
+def test_quoted_names_need_a_question_about_the_list():
+    assert extract_company_query('Is "Acme Foods" on the defaulters list?') == "Acme Foods"
+    assert extract_company_query('What is the "default" clause for late shipment?') is None
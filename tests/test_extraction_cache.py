@@ -0,0 +1,28 @@
+import os
+
+from extraction_cache import ExtractionCache
+
+
+def test_database_is_created_on_first_use(tmp_path):
+    path = str(tmp_path / "cache" / "extraction_cache.sqlite")
+    cache = ExtractionCache(path)
+    assert not os.path.exists(os.path.dirname(path))
+    assert cache.get("chunk", "model", "v1", "extract") is None
+    assert os.path.exists(path)
+
+
+def test_entries_are_written_in_batches(tmp_path):
+    path = str(tmp_path / "extraction_cache.sqlite")
+    cache = ExtractionCache(path, batch=3)
+    cache.put("a", "model", "v1", "extract", "result a")
+    cache.put("b", "model", "v1", "extract", "result b")
+    # Buffered entries are served before they are written
+    assert cache.get("a", "model", "v1", "extract") == "result a"
+    assert ExtractionCache(path).describe()["entries"] == 0
+
+    cache.put("c", "model", "v1", "extract", "result c")
+    assert ExtractionCache(path).describe()["entries"] == 3
+
+    cache.put("d", "model", "v1", "extract", "result d")
+    cache.flush()
+    assert ExtractionCache(path).get("d", "model", "v1", "extract") == "result d"
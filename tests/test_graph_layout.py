@@ -0,0 +1,33 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from graph_layout import GraphLayout
+
+
+class _Graph:
+    def __init__(self):
+        self.fail = True
+
+    async def get_all_nodes(self):
+        if self.fail:
+            raise ConnectionError("graph storage unavailable")
+        return [{"id": "GAFTA 48", "entity_type": "contract", "description": ""}]
+
+    async def get_all_edges(self):
+        return []
+
+
+def test_failed_layout_is_retried(tmp_path):
+    graph = _Graph()
+    rag = SimpleNamespace(chunk_entity_relation_graph=graph)
+    layout = GraphLayout(str(tmp_path))
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(layout.ensure_current(rag))
+    assert layout.dirty
+
+    graph.fail = False
+    asyncio.run(layout.ensure_current(rag))
+    assert not layout.dirty and "GAFTA 48" in layout.data["nodes"]
@@ -0,0 +1,52 @@
+import asyncio
+
+from llm_roles import LLMRoleRouter
+from scheduler import PriorityScheduler
+
+
+def test_interactive_calls_run_while_ingest_saturates_extract_role():
+    router = LLMRoleRouter({"ollama": None}, "ollama", "http://gpu:11434", "model", lambda binding, hosts: None)
+    running = {"extract": 0, "answer": 0}
+
+    async def run():
+        # Extraction calls hold the GPU until the answers are done; the answers
+        # only finish once all four run at the same time
+        answers_done, answers_running = asyncio.Event(), asyncio.Event()
+
+        async def backend(prompt, **kwargs):
+            role = prompt.split(":")[0]
+            running[role] += 1
+            if role == "answer" and running["answer"] == 4:
+                answers_running.set()
+            await (answers_done if role == "extract" else answers_running).wait()
+            running[role] -= 1
+            return "ok"
+
+        router.binding_funcs["ollama"] = backend
+        router.scheduler = PriorityScheduler("llm", router.total_max_async, 1, limits=router.role_limits)
+        ingest = [
+            asyncio.ensure_future(router.dispatch(f"extract: chunk {i}", llm_role="extract", traffic_class="ingest"))
+            for i in range(14)
+        ]
+        while running["extract"] < 4:
+            await asyncio.sleep(0)
+        assert router.scheduler.metrics()["groups"]["extract"] == {"limit": 4, "in_flight": 4}
+        # Extraction calls waiting for their role hold no slots
+        assert router.scheduler.in_flight == running["extract"] == 4
+
+        answers = [
+            router.dispatch("answer: question", llm_role="answer", traffic_class=traffic_class)
+            for traffic_class in ("interactive", "interactive", "interactive", "maintenance")
+        ]
+        # Neither the interactive answers nor the maintenance one queue behind the extraction backlog
+        # (the timeout only turns a regression into a failure instead of a hang)
+        await asyncio.wait_for(asyncio.gather(*answers), timeout=10)
+        assert running["extract"] == 4
+        answers_done.set()
+        await asyncio.gather(*ingest)
+        return router.scheduler.metrics()
+
+    metrics = asyncio.run(run())
+    assert metrics["classes"]["ingest"]["granted"] == 14
+    assert metrics["classes"]["interactive"]["granted"] == 3
+    assert metrics["classes"]["maintenance"]["granted"] == 1
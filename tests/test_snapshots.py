@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from snapshots import MATRIX_SUFFIX, MmapNanoVectorDB, SnapshotStore
+
+DIM = 8
+
+
+def _vector_store(path, vectors):
+    db = MmapNanoVectorDB(DIM, storage_file=str(path))
+    if len(vectors):
+        db.upsert([{"__id__": f"v{i}", "__vector__": vector} for i, vector in enumerate(vectors)])
+    db.save()
+
+
+def test_restore_with_empty_vector_stores(tmp_path):
+    source, target = tmp_path / "source", tmp_path / "target"
+    source.mkdir()
+    vectors = np.random.RandomState(0).rand(3, DIM).astype(np.float32)
+    _vector_store(source / "vdb_chunks.json", vectors)
+    # Extraction found no graph: both graph vector stores are empty
+    _vector_store(source / "vdb_entities.json", [])
+    _vector_store(source / "vdb_relationships.json", [])
+    (source / "kv_store_full_docs.json").write_text('{"doc-a": {"content": "a"}}')
+
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    manifest = store.create(str(source))
+    report = store.restore(manifest["id"], str(target), mmap_vectors=True)
+
+    assert report["files"] == 4
+    assert os.path.exists(target / ("vdb_chunks.json" + MATRIX_SUFFIX))
+    for name in ("vdb_entities.json", "vdb_relationships.json"):
+        assert not os.path.exists(target / (name + MATRIX_SUFFIX))
+        db = MmapNanoVectorDB(DIM, storage_file=str(target / name))
+        assert db._NanoVectorDB__storage["matrix"].shape == (0, DIM)
+        assert db.query(vectors[0], top_k=5) == []
+    chunks = MmapNanoVectorDB(DIM, storage_file=str(target / "vdb_chunks.json"))
+    assert chunks.query(vectors[1], top_k=1)[0]["__id__"] == "v1"
+
+
+def test_empty_matrix_sidecar_loads(tmp_path):
+    # Sidecars left by earlier restores of empty stores
+    path = tmp_path / "vdb_entities.json"
+    _vector_store(path, [])
+    sidecar = tmp_path / ("vdb_entities.json" + MATRIX_SUFFIX)
+    sidecar.write_bytes(b"")
+    path.write_text(path.read_text().replace('"matrix": ""', f'"matrix": "", "matrix_file": "{sidecar.name}"'))
+    assert "matrix_file" in path.read_text()
+
+    db = MmapNanoVectorDB(DIM, storage_file=str(path))
+    assert db._NanoVectorDB__storage["matrix"].shape == (0, DIM)
+    db.save()
+    assert not sidecar.exists()
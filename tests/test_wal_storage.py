@@ -0,0 +1,25 @@
+from wal_storage import WalRegistry, WriteLog
+
+
+def _replay(path: str):
+    records = []
+    WriteLog(path, WalRegistry()).replay(records.append)
+    return records
+
+
+def test_appends_after_a_torn_tail_survive_the_next_replay(tmp_path):
+    path = str(tmp_path / "kv_store_full_docs.json.wal")
+    log = WriteLog(path, WalRegistry())
+    log.append({"op": "upsert", "n": 0})
+    log.close()
+    # Crash mid-append
+    with open(path, "ab") as f:
+        f.write(b'{"op": "upsert", "n": 1, "da')
+
+    log = WriteLog(path, WalRegistry())
+    assert log.replay(lambda record: None) == 1
+    for n in (2, 3, 4):
+        log.append({"op": "upsert", "n": n})
+    log.close()
+
+    assert [record["n"] for record in _replay(path)] == [0, 2, 3, 4]
@@ -0,0 +1,58 @@
+import asyncio
+
+import numpy as np
+from lightrag import LightRAG
+from lightrag.utils import EmbeddingFunc, Tokenizer
+
+from snapshots import SnapshotStore
+from workspaces import WorkspaceManager
+
+
+class _Bytes:
+    # Byte-level tokens; the default tiktoken encoding is downloaded on first use
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode("utf-8", "ignore")
+
+
+async def _embed(texts, **kwargs):
+    return np.random.RandomState(len(texts)).rand(len(texts), 8).astype(np.float32)
+
+
+async def _llm(prompt, **kwargs):
+    return ""
+
+
+def _rag(working_dir: str, workspace: str) -> LightRAG:
+    return LightRAG(
+        working_dir=working_dir, workspace=workspace, llm_model_func=_llm,
+        embedding_func=EmbeddingFunc(embedding_dim=8, func=_embed),
+        tokenizer=Tokenizer("bytes", _Bytes()),
+    )
+
+
+def test_restore_default_workspace_reloads_stores(tmp_path):
+    async def run():
+        workspaces = WorkspaceManager(str(tmp_path / "workspaces"), str(tmp_path / "default"), _rag)
+        snapshots = SnapshotStore(str(tmp_path / "snapshots"))
+        ws = workspaces.get(None)
+        await workspaces.open(ws)
+        await ws.rag.full_docs.upsert({"docA": {"content": "a"}})
+        await ws.rag.doc_status.upsert({"docA": {"status": "processed", "content_summary": "a", "content_length": 1, "file_path": "a"}})
+        await ws.flush()
+        manifest = snapshots.create(ws.data_dir)
+
+        await ws.rag.full_docs.upsert({"docB": {"content": "b"}})
+        await ws.rag.doc_status.upsert({"docB": {"status": "processed", "content_summary": "b", "content_length": 1, "file_path": "b"}})
+        await workspaces.close(ws)
+        snapshots.restore(manifest["id"], ws.data_dir)
+        await workspaces.open(ws)
+
+        assert await ws.rag.full_docs.get_by_id("docA") is not None
+        assert await ws.rag.full_docs.get_by_id("docB") is None
+        assert await ws.rag.doc_status.get_by_id("docB") is None
+        await workspaces.close(ws)
+
+    asyncio.run(run())